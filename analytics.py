@@ -0,0 +1,278 @@
+import calendar
+import datetime
+
+import pandas as pd
+
+import perf
+from ledger import TS_COL, baht, slice_range
+from storage import ROLLUP_APP_COLS as APP_COLS, ROLLUP_DAILY_COLS as DAILY_COLS
+
+# --- ROLLUP รายวัน ---
+# สรุปยอดต่อวัน (daily) และต่อวัน x แอป (apps) เก็บไว้ล่วงหน้า
+# แดชบอร์ดอ่านจาก rollup แทนการ groupby ข้อมูลดิบทุกครั้งที่ rerun
+# ทุกฟังก์ชันรับ ledger แบบ typed (ledger.py) และคืนค่าเงินเป็นบาท
+CARD_PAYMENT = '💳 ตัดบัตร/แอป'
+
+
+# --- ชั่วโมงขับ (จับคู่ เริ่มงาน -> เลิกงาน ทีเดียวทั้งตาราง) ---
+MAX_SHIFT_HOURS = 24  # คู่ที่ยาวกว่านี้ถือว่าลืมกดเลิกงาน ไม่นับ
+
+
+def event_times(df):
+    if TS_COL in df.columns:
+        return df[TS_COL]
+    times = pd.to_datetime(df['เวลา'], format='%H:%M', errors='coerce')
+    return pd.to_datetime(df['วันที่'], errors='coerce') + (times - times.dt.normalize())
+
+
+def pair_shifts(df):
+    # เรียงเหตุการณ์กะงานตามเวลาจริง (วันที่ + เวลา) แล้วจับคู่ "เริ่ม" กับ "เลิก" ที่ตามมาติดกัน
+    # กะที่ข้ามเที่ยงคืนจึงจับคู่ได้ตามปกติ และวันเดียวมีได้หลายกะ
+    shift_df = df[df['หมวดหมู่'] == 'กะงาน']
+    ev = pd.DataFrame({
+        'ts': event_times(shift_df),
+        'is_start': shift_df['รายการ'].str.contains("เริ่ม", na=False),
+        'is_end': shift_df['รายการ'].str.contains("เลิก", na=False),
+    }).dropna(subset=['ts'])
+    ev = ev[ev['is_start'] | ev['is_end']].sort_values('ts', kind='stable')
+
+    next_ts = ev['ts'].shift(-1)
+    next_is_end = ev['is_end'].shift(-1, fill_value=False).astype(bool)
+    paired = ev['is_start'] & next_is_end
+
+    shifts = pd.DataFrame({'เริ่ม': ev['ts'][paired], 'เลิก': next_ts[paired]})
+    shifts['ชั่วโมง'] = (shifts['เลิก'] - shifts['เริ่ม']).dt.total_seconds() / 3600
+    shifts = shifts[shifts['ชั่วโมง'] <= MAX_SHIFT_HOURS]
+    # ชั่วโมงของกะนับให้วันที่เริ่มกะ
+    shifts['วันที่'] = shifts['เริ่ม'].dt.normalize()
+    return shifts.reset_index(drop=True)
+
+
+def daily_shift_hours(df):
+    shifts = pair_shifts(df)
+    return shifts.groupby('วันที่')['ชั่วโมง'].sum().astype(float)
+
+
+def app_cost_parts(df, keys=('วันที่', 'แอป')):
+    # ต้นทุนค่าคอม 3 ส่วน: เติมเครดิตเอง + โดนหักส่วนต่าง + เงินเข้า Wallet (งานตัดบัตร)
+    is_inc = df['หมวดหมู่'] == 'รายรับ'
+    is_topup = (df['หมวดหมู่'] == 'รายจ่าย') & ~df['แอป'].isin(['ค่าใช้จ่าย', 'ระบบ'])
+    gross = df['ยอดเต็ม/หน้าแอป']
+    net = df['คงเหลือ/สุทธิ']
+    # เติมเครดิต Grab Wallet นับเป็นต้นทุนของ Grab แต่รายรับที่ลงแอป Grab Wallet แยกไว้ตามเดิม
+    app = df['แอป']
+    wallet_topup = is_topup & (app == 'Grab Wallet')
+    if wallet_topup.any():
+        app = app.astype(str).mask(wallet_topup, 'Grab')
+
+    parts = pd.DataFrame({
+        'วันที่': df['วันที่'],
+        'แอป': app,
+        'ยอดหน้าแอป': gross.where(is_inc, 0),
+        'เติมเอง': df['หัก/จ่าย'].where(is_topup, 0),
+        'หักส่วนต่าง': (gross - net).clip(lower=0).where(is_inc, 0),
+        'เครดิตเข้า Wallet': net.where(is_inc & (df['ช่องทางรับเงิน'] == CARD_PAYMENT), 0),
+        'รายรับสุทธิ': net.where(is_inc, 0),
+        'จำนวนงาน': is_inc.astype(int),
+    })[is_inc | is_topup]
+    keys = list(keys)
+    grouped = parts.groupby(keys, observed=True)[APP_COLS].sum().reset_index()
+    grouped['แอป'] = grouped['แอป'].astype(str)
+    grouped = grouped.set_index(keys)
+    money = [c for c in APP_COLS if c != 'จำนวนงาน']
+    grouped[money] = baht(grouped[money])
+    return grouped
+
+
+@perf.timed("analytics.gp_table")
+def gp_table(df):
+    # GP ต่อแอปในรอบเดียว (groupby) จากข้อมูลช่วงที่กรองแล้ว
+    parts = app_cost_parts(df, keys=('แอป',))
+    parts = parts[parts['ยอดหน้าแอป'] > 0]
+    total = parts['เติมเอง'] + parts['หักส่วนต่าง'] + parts['เครดิตเข้า Wallet']
+    gp_df = pd.DataFrame({
+        "GP (%)": total / parts['ยอดหน้าแอป'] * 100,
+        "รวมค่าคอม/เครดิต (บ.)": total,
+        "ยอดหน้าแอป (บ.)": parts['ยอดหน้าแอป'],
+        "เติมเอง": parts['เติมเอง'],
+        "หักส่วนต่าง": parts['หักส่วนต่าง'],
+        "เครดิตเข้า Wallet": parts['เครดิตเข้า Wallet'],
+    })
+    return gp_df.rename_axis("แอป").reset_index().sort_values(by="GP (%)", ascending=True)
+
+
+def build_daily(df):
+    is_inc = df['หมวดหมู่'] == 'รายรับ'
+    is_exp = df['หมวดหมู่'] == 'รายจ่าย'
+    daily = pd.DataFrame({
+        'วันที่': df['วันที่'],
+        'รายรับรวม': df['คงเหลือ/สุทธิ'].where(is_inc, 0),
+        'รายจ่ายรวม': df['หัก/จ่าย'].where(is_exp, 0),
+        'เงินสดเข้าตัว': df['เงินสดเข้าตัว'],
+        'จำนวนงาน': is_inc.astype(int),
+    }).groupby('วันที่').sum()
+    daily[['รายรับรวม', 'รายจ่ายรวม', 'เงินสดเข้าตัว']] = baht(daily[['รายรับรวม', 'รายจ่ายรวม', 'เงินสดเข้าตัว']])
+
+    odo = df[df['เลขไมล์'] > 0].groupby('วันที่')['เลขไมล์'].agg(['max', 'min'])
+    daily['ระยะทาง'] = (odo['max'] - odo['min']).reindex(daily.index, fill_value=0)
+    daily['ชั่วโมงขับ'] = daily_shift_hours(df).reindex(daily.index, fill_value=0)
+    daily['กำไรสุทธิ'] = daily['รายรับรวม'] - daily['รายจ่ายรวม']
+    return daily[DAILY_COLS].astype(float)
+
+
+@perf.timed("analytics.build_rollup")
+def build_rollup(df):
+    return {"daily": build_daily(df), "apps": app_cost_parts(df)}
+
+
+@perf.timed("analytics.refresh_rollup")
+def refresh_rollup(rollup, df, days):
+    # คำนวณใหม่เฉพาะวันที่มีการเพิ่ม/แก้ไขแถว
+    # รวมวันก่อนหน้าด้วย เพราะกะข้ามเที่ยงคืนนับชั่วโมงให้วันเริ่มกะ
+    days = {pd.Timestamp(d) for d in days}
+    touched = days | {d - datetime.timedelta(days=1) for d in days}
+    window = touched | {d + datetime.timedelta(days=1) for d in days}
+    part = build_rollup(df[df['วันที่'].isin(window)])
+    part_daily = part["daily"][part["daily"].index.isin(touched)]
+    part_apps = part["apps"][part["apps"].index.get_level_values('วันที่').isin(touched)]
+
+    daily = rollup["daily"].drop(index=list(touched), errors='ignore')
+    apps = rollup["apps"]
+    apps = apps[~apps.index.get_level_values('วันที่').isin(touched)]
+    return {
+        "daily": pd.concat([daily, part_daily]).sort_index(),
+        "apps": pd.concat([apps, part_apps]).sort_index(),
+    }
+
+
+@perf.timed("analytics.rollup_range")
+def rollup_range(rollup, start=None, end=None):
+    # index ของ rollup เรียงตามวันที่ จึงตัดช่วงด้วย .loc ได้ (binary search)
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    return rollup["daily"].loc[start:end]
+
+
+@perf.timed("analytics.hourly_heatmap")
+def hourly_heatmap(inc_df):
+    # รายรับสุทธิ (บาท) แยกแอป x ชั่วโมงที่รับงาน
+    temp = pd.DataFrame({'แอป': inc_df['แอป'].astype(str), 'Hour': inc_df[TS_COL].dt.hour, 'คงเหลือ/สุทธิ': baht(inc_df['คงเหลือ/สุทธิ'])})
+    return temp.pivot_table(index='แอป', columns='Hour', values='คงเหลือ/สุทธิ', aggfunc='sum', fill_value=0)
+
+
+@perf.timed("analytics.income_by_app")
+def income_by_app(inc_df):
+    # รายรับสุทธิ (บาท) ต่อแอป สำหรับกราฟวงกลม
+    return baht(inc_df['คงเหลือ/สุทธิ']).groupby(inc_df['แอป'], observed=True).sum().reset_index()
+
+
+# --- สรุปตัวเลขของช่วง (metrics บนแดชบอร์ด) ---
+SUMMARY_COLS = DAILY_COLS + ['บาท/กม.', 'บาท/ชม.', 'เป้ารายรับ', 'ทำได้ (%)']
+
+
+def summarize(daily, target_income=0.0, days_count=1):
+    # daily: rollup รายวันที่ตัดช่วงแล้ว; คืนยอดรวมทุกคอลัมน์ + ประสิทธิภาพ (บาท/กม., บาท/ชม.) + เป้า
+    out = {col: float(daily[col].sum()) for col in DAILY_COLS}
+    out['บาท/กม.'] = out['กำไรสุทธิ'] / out['ระยะทาง'] if out['ระยะทาง'] > 0 else 0.0
+    out['บาท/ชม.'] = out['กำไรสุทธิ'] / out['ชั่วโมงขับ'] if out['ชั่วโมงขับ'] > 0 else 0.0
+    out['เป้ารายรับ'] = float(target_income) * days_count
+    out['ทำได้ (%)'] = min(out['รายรับรวม'] / out['เป้ารายรับ'], 1.0) * 100 if out['เป้ารายรับ'] > 0 else 0.0
+    return out
+
+
+# --- รายงานทั้งชุด (ไม่พึ่ง Streamlit) ---
+# ตัวเลขและตารางชุดเดียวกับแดชบอร์ด tab2 จาก ledger แบบ typed: ใช้รันแบบไม่มีหน้าจอ/หลายคนขับ (fleet.py)
+# rollup = rollup ทั้ง ledger ที่มีอยู่แล้ว (ไม่ส่งมาก็สร้างจาก df ทั้งก้อน กะข้ามเที่ยงคืนที่ขอบช่วงจึงนับเหมือนแดชบอร์ด)
+@perf.timed("analytics.report")
+def report(df, start=None, end=None, target_income=0.0, days_count=1, rollup=None):
+    f_df = slice_range(df, start, end)
+    inc_df = f_df[f_df['หมวดหมู่'] == 'รายรับ']
+    exp_df = f_df[f_df['หมวดหมู่'] == 'รายจ่าย']
+    daily = rollup_range(rollup or build_rollup(df), start, end).rename_axis('วันที่').reset_index()
+    return {
+        "summary": summarize(daily, target_income, days_count),
+        "daily": daily,
+        "gp": gp_table(f_df),
+        "heatmap": hourly_heatmap(inc_df),
+        "income_by_app": income_by_app(inc_df),
+        "expenses": expense_breakdown(exp_df),
+    }
+
+
+# --- กราฟแนวโน้ม ---
+TREND_MAX_POINTS = 120
+
+
+@perf.timed("analytics.trend_buckets")
+def trend_buckets(daily, max_points=TREND_MAX_POINTS):
+    # daily: ตารางรายวัน (คอลัมน์ วันที่ + ยอดรวม) จาก rollup
+    # จุดเกิน max_points: รวมเป็นรายสัปดาห์ (เริ่มวันจันทร์) หรือรายเดือน ทุกคอลัมน์ใน rollup เป็นยอดรวมจึงใช้ sum ได้
+    if len(daily) <= max_points:
+        return daily, "รายวัน"
+    dates = pd.to_datetime(daily['วันที่'])
+    for label, period in (("รายสัปดาห์", 'W'), ("รายเดือน", 'M')):
+        out = daily.drop(columns='วันที่').groupby(dates.dt.to_period(period).dt.start_time).sum()
+        if len(out) <= max_points:
+            break
+    return out.rename_axis('วันที่').reset_index(), label
+
+
+# --- จัดกลุ่มรายจ่าย (ทำทีเดียวทั้งคอลัมน์แทน apply ทีละแถว) ---
+def expense_labels(df):
+    item = df['รายการ'].fillna('').astype(str)
+    note = df['หมายเหตุ'].fillna('').astype(str).str.strip()
+    has_note = (note != '') & (note.str.lower() != 'nan')
+
+    def has(s, word):
+        return s.str.contains(word, regex=False)
+
+    is_energy = has(item, 'น้ำมัน') | has(item, 'ไฟ')
+    rules = [
+        (has(item, 'เติมเครดิต'), "💳 เติม " + df['แอป'].astype(str)),
+        (is_energy & (has(item, 'ชาร์จ') | has(note, 'ชาร์จ')), "⚡ ชาร์จไฟ"),
+        (is_energy & (has(item, 'น้ำมัน') | has(note, 'น้ำมัน')), "⛽ น้ำมัน"),
+        (is_energy, "⛽ พลังงาน"),
+        (has(item, 'ทั่วไป') & has_note, "🛠️ " + note),
+        (has(item, 'ทั่วไป'), "🛠️ จ่ายทั่วไป"),
+    ]
+    labels = item.copy()
+    # ไล่กฎจากท้ายไปหน้า ให้กฎแรกที่ตรงเป็นตัวชนะ (เหมือน if/return เดิม)
+    for mask, label in reversed(rules):
+        labels = labels.mask(mask, label)
+    return labels
+
+
+@perf.timed("analytics.expense_breakdown")
+def expense_breakdown(exp_df):
+    return (baht(exp_df['หัก/จ่าย']).groupby(expense_labels(exp_df)).sum()
+            .rename_axis('ชื่อรายการกราฟ').reset_index()
+            .sort_values(by='หัก/จ่าย', ascending=True))
+
+
+# --- ช่วงเวลาของตัวกรอง ---
+def period_range(time_filter, today, custom_start=None, custom_end=None):
+    # คืน (วันเริ่ม, วันสุดท้าย, จำนวนวันสำหรับคิดเป้า) เป็น Timestamp; None = ไม่จำกัด
+    today = pd.Timestamp(today)
+    if time_filter == "วันนี้":
+        return today, today, 1
+    if time_filter == "เมื่อวาน":
+        d = today - datetime.timedelta(days=1)
+        return d, d, 1
+    if time_filter == "สัปดาห์นี้":
+        start = today - datetime.timedelta(days=today.weekday())
+        return start, start + datetime.timedelta(days=6), 7
+    if time_filter == "เดือนนี้":
+        n = calendar.monthrange(today.year, today.month)[1]
+        return today.replace(day=1), today.replace(day=n), n
+    if time_filter == "เดือนที่แล้ว":
+        last_prev = today.replace(day=1) - datetime.timedelta(days=1)
+        start_prev = last_prev.replace(day=1)
+        return start_prev, last_prev, calendar.monthrange(start_prev.year, start_prev.month)[1]
+    if time_filter == "ปีนี้":
+        return pd.Timestamp(today.year, 1, 1), pd.Timestamp(today.year, 12, 31), 365
+    if time_filter == "กำหนดเอง":
+        # เลือกวันไว้วันเดียว (ยังไม่เลือกวันสิ้นสุด) = ดูวันนั้น; ไม่คืน None ซึ่งทำให้โหลดข้อมูลทุกเดือน
+        custom_start = pd.Timestamp(custom_start or custom_end or today)
+        custom_end = pd.Timestamp(custom_end or custom_start)
+        return custom_start, custom_end, (custom_end - custom_start).days + 1
+    return None, None, 1
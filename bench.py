@@ -0,0 +1,288 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+import analytics
+import ledger
+import storage
+import sync
+from driver_data import DriverData
+from fake_gsheets import FakeGSheetsConnection
+
+# --- BENCHMARK ---
+# รัน: python bench.py shifts --sizes 1000 10000 100000
+# ดูว่าเวลาต่อแถว (µs/row) คงที่เมื่อจำนวนแถวเพิ่ม = โตแบบเส้นตรง
+# python bench.py app --sizes 10000 100000 --latency 0.2 --json results.json
+# วัดทุกขั้นของแอป (โหลด/บันทึก/แดชบอร์ด/ตารางแก้ไข) กับชีตจำลองในเครื่อง แล้วเก็บผลเป็น JSON ไว้เทียบระหว่างเวอร์ชัน
+
+
+def make_shift_events(n_rows, seed=0):
+    # กะงานสังเคราะห์: วันละ 1-2 กะ บางกะข้ามเที่ยงคืน
+    rng = np.random.default_rng(seed)
+    n_shifts = max(n_rows // 2, 1)
+    day0 = pd.Timestamp("2020-01-01")
+    day_offset = np.sort(rng.integers(0, max(n_shifts // 2, 1), n_shifts))
+    start = day0 + pd.to_timedelta(day_offset, unit="D") + pd.to_timedelta(rng.integers(5 * 60, 20 * 60, n_shifts), unit="min")
+    end = start + pd.to_timedelta(rng.integers(60, 9 * 60, n_shifts), unit="min")
+
+    ts = np.empty(n_shifts * 2, dtype="datetime64[ns]")
+    ts[0::2] = start.values
+    ts[1::2] = end.values
+    ts = pd.DatetimeIndex(ts)
+    items = np.tile(['☀️ เริ่มงาน', '🌙 เลิกงาน'], n_shifts)
+    return pd.DataFrame({
+        'วันที่': ts.date,
+        'เวลา': ts.strftime('%H:%M'),
+        'หมวดหมู่': 'กะงาน',
+        'รายการ': items,
+    })
+
+
+# --- LEDGER สังเคราะห์ ---
+PLATFORMS = ["Grab", "Bolt", "Line Man", "Maxim", "Robinhood", "Win", "งานนอก"]
+CASH_PAYMENT = '💵 เงินสด/โอน'
+ENERGY_NOTES = ["⛽ น้ำมัน", "⚡ ชาร์จบ้าน (เหมา)", "🔌 ชาร์จสถานี"]
+OTHER_NOTES = ["ข้าว", "ปะยาง", "ล้างรถ", "ที่จอดรถ"]
+
+
+def make_ledger(n_rows, seed=0, rows_per_day=20, end=None):
+    # ledger รูปแบบชีต n_rows แถว ย้อนหลังวันละ ~rows_per_day แถวจนถึง end (ค่าเริ่มต้น = วันนี้)
+    # ทุกวัน: เริ่มกะ (เลขไมล์) -> รายการระหว่างกะ -> เลิกกะ (เลขไมล์ + ระยะทาง)
+    # รายการระหว่างกะ: งาน 80% (หลายแอป เงินสด/ตัดบัตร), ค่าน้ำมัน/ไฟ 8%, เติมเครดิต 7%, จ่ายทั่วไป 5%
+    rng = np.random.default_rng(seed)
+    n_days = max(n_rows // rows_per_day, 1)
+    n = max(n_rows - 2 * n_days, 0)
+    end = pd.Timestamp(end or datetime.date.today()).normalize()
+    days = end - pd.to_timedelta(np.arange(n_days)[::-1], unit="D")
+    shift_start = (days + pd.to_timedelta(rng.integers(6 * 60, 10 * 60, n_days), unit="min")).values
+    shift_len = rng.integers(8 * 60, 12 * 60, n_days)
+    dist = rng.integers(80, 250, n_days)
+    odo_end = 10_000 + np.cumsum(dist)
+
+    day = rng.integers(0, n_days, n)
+    ts = shift_start[day] + pd.to_timedelta(shift_len[day] * rng.random(n), unit="min").values
+    kind = rng.choice(4, n, p=[0.80, 0.08, 0.07, 0.05])
+    inc, energy, topup, other = (kind == k for k in range(4))
+    card = inc & (rng.random(n) < 0.3)
+    gross = np.where(inc, rng.integers(40, 400, n), 0).astype(float)
+    tip = np.where(inc & ~card & (rng.random(n) < 0.15), rng.integers(5, 50, n), 0).astype(float)
+    fee = np.where(card, np.round(gross * rng.uniform(0.1, 0.3, n)), 0.0)
+    cost = np.select([energy, topup, other], [rng.integers(50, 600, n), rng.integers(1, 10, n) * 100, rng.integers(20, 300, n)], 0).astype(float)
+    net = np.where(inc, gross + tip - fee, -cost)
+    trips = pd.DataFrame({
+        'ts': ts,
+        'แอป': np.where(inc | topup, np.array(PLATFORMS)[rng.integers(0, len(PLATFORMS), n)], 'ค่าใช้จ่าย'),
+        'หมวดหมู่': np.where(inc, 'รายรับ', 'รายจ่าย'),
+        'รายการ': np.select([inc, energy, topup], ['ค่าโดยสาร', 'ค่าน้ำมัน/ไฟ', 'เติมเครดิต'], 'ทั่วไป'),
+        'ช่องทางรับเงิน': np.where(inc, np.where(card, analytics.CARD_PAYMENT, CASH_PAYMENT), 'จ่ายสด'),
+        'ยอดเต็ม/หน้าแอป': gross,
+        'หัก/จ่าย': np.where(inc, fee, cost),
+        'ทิป': tip,
+        'คงเหลือ/สุทธิ': net,
+        'เงินสดเข้าตัว': np.where(card, 0.0, net),
+        'เลขไมล์': 0,
+        'หมายเหตุ': np.select([energy, topup, other], [np.array(ENERGY_NOTES)[rng.integers(0, 3, n)], 'Top-up', np.array(OTHER_NOTES)[rng.integers(0, 4, n)]], ''),
+    })
+    shifts = pd.DataFrame({
+        'ts': np.concatenate([shift_start, shift_start + pd.to_timedelta(shift_len, unit="min").values]),
+        'แอป': 'ระบบ', 'หมวดหมู่': 'กะงาน',
+        'รายการ': ['☀️ เริ่มงาน'] * n_days + ['🌙 เลิกงาน'] * n_days,
+        'ช่องทางรับเงิน': '-',
+        'ยอดเต็ม/หน้าแอป': 0.0, 'หัก/จ่าย': 0.0, 'ทิป': 0.0, 'คงเหลือ/สุทธิ': 0.0, 'เงินสดเข้าตัว': 0.0,
+        'เลขไมล์': np.concatenate([odo_end - dist, odo_end]),
+        'หมายเหตุ': ['เริ่มกะใหม่'] * n_days + [f"ระยะทาง {d} กม." for d in dist],
+    })
+    df = pd.concat([shifts, trips], ignore_index=True).sort_values('ts', kind='stable')
+    df['วันที่'] = df['ts'].dt.strftime('%Y-%m-%d')
+    df['เวลา'] = df['ts'].dt.strftime('%H:%M')
+    df[storage.ROW_ID] = ledger.format_ids(ledger.new_ids(len(df)))
+    return df[storage.LEDGER_COLS].reset_index(drop=True)
+
+
+def legacy_daily_hours(f_df):
+    # ลูปรายวันแบบเดิมใน tab2 (เก็บไว้เทียบความเร็วเท่านั้น)
+    daily_hours = {}
+    shift_df = f_df[f_df['หมวดหมู่'] == 'กะงาน']
+    for d in f_df['วันที่'].unique():
+        ds = shift_df[shift_df['วันที่'] == d]
+        s = ds[ds['รายการ'].str.contains("เริ่ม")]['เวลา']
+        e = ds[ds['รายการ'].str.contains("เลิก")]['เวลา']
+        h_val = 0
+        if not s.empty and not e.empty:
+            ts = pd.to_datetime(s.min(), format='%H:%M')
+            te = pd.to_datetime(e.max(), format='%H:%M')
+            h = (te - ts).total_seconds()/3600
+            if h < 0: h += 24
+            h_val = h
+        daily_hours[d] = h_val
+    return pd.Series(daily_hours)
+
+
+def timed(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_shift_hours(sizes, legacy_limit=20000):
+    results = []
+    for n in sizes:
+        df = make_shift_events(n)
+        row = {"rows": len(df), "vectorized_s": timed(analytics.daily_shift_hours, df)}
+        row["us_per_row"] = row["vectorized_s"] / len(df) * 1e6
+        if len(df) <= legacy_limit:
+            row["legacy_s"] = timed(legacy_daily_hours, df, repeat=1)
+        results.append(row)
+    return results
+
+
+# --- APP SUITE ---
+# เรียก driver_data.DriverData ตัวเดียวกับ driver_app.py (ไม่ผ่าน Streamlit) กับ GSheetsStorage บนชีตจำลอง + outbox ในโฟลเดอร์ชั่วคราว
+# ขั้น sync_* คือเวลาส่งขึ้นชีต (รวม latency ของ API) ที่ในแอปทำใน thread เบื้องหลัง
+TIME_FILTERS = ["วันนี้", "เมื่อวาน", "สัปดาห์นี้", "เดือนนี้", "เดือนที่แล้ว", "ปีนี้"]
+EDITOR_PAGE_SIZE = 100  # เท่ากับตารางแก้ไขใน tab3
+
+
+def dashboard(frame, rollup, time_filter, today):
+    # ทุกอย่างที่ tab2 คำนวณต่อหนึ่งตัวกรอง: metrics จาก rollup, ตาราง GP, สัดส่วนรายได้, heatmap, รายจ่าย และกราฟทั้งหมด
+    p_start, p_end, _ = analytics.period_range(time_filter, today)
+    f_df = ledger.slice_range(frame, p_start, p_end)
+    daily = analytics.rollup_range(rollup, p_start, p_end).rename_axis('วันที่').reset_index()
+    out = {"totals": daily.drop(columns='วันที่').sum()}
+    if daily.empty:
+        return out
+    trend, bucket = analytics.trend_buckets(daily[['วันที่', 'กำไรสุทธิ']])
+    out["trend"] = px.area(trend, x='วันที่', y='กำไรสุทธิ', title=f"แนวโน้ม{bucket}", markers=True)
+    inc_df = f_df[f_df['หมวดหมู่'] == 'รายรับ']
+    exp_df = f_df[f_df['หมวดหมู่'] == 'รายจ่าย']
+    if not inc_df.empty:
+        gp_df = analytics.gp_table(f_df)
+        out["gp"] = px.bar(gp_df, x='GP (%)', y='แอป', orientation='h', text_auto='.1f', color='GP (%)')
+        pie_df = ledger.baht(inc_df['คงเหลือ/สุทธิ']).groupby(inc_df['แอป'], observed=True).sum().reset_index()
+        out["pie"] = px.pie(pie_df, values='คงเหลือ/สุทธิ', names='แอป', hole=0.4)
+        out["heatmap"] = px.imshow(analytics.hourly_heatmap(inc_df), aspect="auto")
+    if not exp_df.empty:
+        out["expense"] = px.bar(analytics.expense_breakdown(exp_df), x='หัก/จ่าย', y='ชื่อรายการกราฟ', color='ชื่อรายการกราฟ', orientation='h')
+    return out
+
+
+def edited_page(page):
+    # จำลองการแก้ใน tab3: แก้หมายเหตุ 3 แถว ลบ 1 แถว เพิ่ม 1 แถว
+    shown = ledger.to_display(page)
+    shown.loc[shown.index[-3:], 'หมายเหตุ'] = 'แก้ไข'
+    shown = shown.drop(index=shown.index[0])
+    added = shown.iloc[[-1]].set_axis([shown.index.max() + 1])
+    return ledger.from_sheet(pd.concat([shown, added]))
+
+
+def bench_app(sizes, latency=0.0, repeat=3):
+    results = []
+    for n in sizes:
+        sheet = make_ledger(n)
+        conn = FakeGSheetsConnection({"Drivers": sheet, "Settings": pd.DataFrame({'Key': list(storage.DEFAULT_SETTINGS), 'Value': list(storage.DEFAULT_SETTINGS.values())})}, latency=latency)
+        store = storage.GSheetsStorage(conn)
+        now = datetime.datetime.now()
+        today = pd.Timestamp(now.date())
+        timings = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            worker = sync.SyncWorker(sync.Outbox(os.path.join(tmp, "outbox.db")), store)  # ไม่ start: ส่งเองด้วย sync_once
+            versions = storage.DataVersions()
+            data = DriverData(ledger.DriverBook(""), store, worker, sync.RemoteLedger(store), versions, today=now.date)
+            book = data.book
+
+            # โหลด: อ่านทั้งชีต แล้วอ่านเฉพาะแถวที่เพิ่มหลัง high-water mark (bump รุ่นก่อนเหมือนกด 🔄 รีเฟรช)
+            def load(full=False):
+                versions.bump(store.worksheet)
+                return data.load_and_clean_data(full=full)
+
+            timings["load_full"] = timed(load, True, repeat=repeat)
+            store.append(make_ledger(10, seed=1))
+            timings["load_delta"] = timed(load, repeat=1)
+            timings["load_book"] = timed(data.load_book, repeat=1)  # ledger + rollup + live state ตอนเปิดแอป
+            timings["rollup_build"] = timed(analytics.build_rollup, book.frame(), repeat=repeat)
+
+            inserts = {
+                "insert_income": (ledger.make_record, ('รายรับ', 'ค่าโดยสาร'), dict(app='Grab', channel=CASH_PAYMENT, gross=150, tip=10, net=160, cash=160)),
+                "insert_energy": (ledger.expense_record, ('ค่าน้ำมัน/ไฟ', 300), dict(note='⛽ น้ำมัน')),
+                "insert_topup": (ledger.expense_record, ('เติมเครดิต', 500), dict(app='Grab', note='Top-up')),
+                "insert_other": (ledger.expense_record, ('ทั่วไป', 60), dict(note='ข้าว')),
+                "insert_shift": (ledger.shift_record, (True, int(sheet['เลขไมล์'].max()) + 10), dict(note='เริ่มกะใหม่')),
+            }
+            for name, (make, args, kwargs) in inserts.items():
+                timings[name] = timed(lambda: data.append_data(make(*args, when=now, **kwargs)), repeat=repeat)
+            timings["sync_append"] = timed(worker.sync_once, repeat=1)
+
+            timings["save_data"] = timed(lambda: data.save_data(book.frame()), repeat=1)
+            timings["sync_overwrite"] = timed(worker.sync_once, repeat=1)
+
+            for time_filter in TIME_FILTERS:
+                timings[f"tab2:{time_filter}"] = timed(dashboard, book.frame(), book.rollup, time_filter, today, repeat=repeat)
+
+            # tab3: เทียบหน้าที่แก้กับของเดิม ส่งเฉพาะแถวที่เปลี่ยน
+            def tab3_save():
+                page = book.frame().iloc[-EDITOR_PAGE_SIZE:]
+                data.save_edits(page, edited_page(page))
+
+            timings["tab3_save"] = timed(tab3_save, repeat=1)
+            timings["sync_edit"] = timed(worker.sync_once, repeat=1)
+        results.append({"rows": len(sheet), "api_calls": len(conn.calls), "cells_sent": conn.cells_sent, "timings": timings})
+    return results
+
+
+def print_timings(results):
+    # แถว = ขั้นตอน, คอลัมน์ = ขนาด ledger (วินาที)
+    steps = list(dict.fromkeys(k for r in results for k in r["timings"]))
+    print(f"{'step':<22}" + "".join(f"{r['rows']:>14,}" for r in results))
+    for step in steps:
+        print(f"{step:<22}" + "".join(f"{r['timings'].get(step, float('nan')):>14.4f}" for r in results))
+
+
+def write_json(path, suite, args, results):
+    payload = {
+        "suite": suite,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "args": vars(args),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+
+def print_table(results):
+    keys = list(dict.fromkeys(k for r in results for k in r))
+    print("  ".join(f"{k:>14}" for k in keys))
+    for r in results:
+        print("  ".join(f"{r[k]:>14.4f}" if isinstance(r.get(k), float) else f"{r.get(k, '-'):>14}" for k in keys))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="วัดความเร็วส่วนคำนวณของแอป")
+    parser.add_argument("suite", choices=["shifts", "app"])
+    parser.add_argument("--sizes", type=int, nargs="+")
+    parser.add_argument("--latency", type=float, default=0.0, help="หน่วงต่อการเรียก API ของชีตจำลอง (วินาที)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="บันทึกผลเป็นไฟล์ JSON")
+    args = parser.parse_args()
+
+    print(f"# {args.suite} @ {datetime.datetime.now():%Y-%m-%d %H:%M}")
+    if args.suite == "shifts":
+        results = bench_shift_hours(args.sizes or [1_000, 10_000, 100_000, 1_000_000])
+        print_table(results)
+    else:
+        results = bench_app(args.sizes or [10_000, 100_000, 1_000_000], latency=args.latency, repeat=args.repeat)
+        print_timings(results)
+    if args.json:
+        write_json(args.json, args.suite, args, results)
@@ -1,15 +1,40 @@
 import streamlit as st
 import pandas as pd
 import datetime
-import plotly.express as px
-import json
 import os
-from streamlit_gsheets import GSheetsConnection
+import time
+import storage
+import sync
+import analytics
+import ledger
+import perf
+import fleet
+import importer
+from driver_data import DriverData
 
 # --- 1. CONFIGURATION ---
 st.set_page_config(page_title="ระบบบันทึกรายได้คนขับ", page_icon="🚗", layout="wide")
-SETTINGS_FILE = "settings.json"
 SHEET_NAME = "Drivers" 
+EDITOR_PAGE_SIZE = 100  # จำนวนแถวต่อหน้าในตารางแก้ไข (tab3)
+
+# --- PERF (เวลาแต่ละขั้นต่อ rerun) ---
+# ไฟล์ metrics: [perf] metrics = "driver_perf.jsonl" ใน secrets.toml หรือ env DRIVER_PERF_FILE
+#   ลงท้าย .prom = Prometheus text format (ค่าสะสม), ค่าว่าง = ไม่เขียนไฟล์
+@st.cache_resource
+def setup_perf():
+    path = "driver_perf.jsonl"
+    try:
+        path = st.secrets.get("perf", {}).get("metrics", path)
+    except Exception:
+        pass
+    return perf.configure(os.environ.get("DRIVER_PERF_FILE", path))
+
+setup_perf()
+# rerun ก่อนหน้าที่ถูก st.rerun ตัดกลางทาง (เช่นหลังกดบันทึก) ยังไม่ถูกส่งออก: จบตรงนี้ แล้วเก็บไว้แสดงในแผง
+st.session_state.perf_prev = perf.end(st.session_state.get("perf"))
+st.session_state.perf = perf.begin("rerun")
+if "opened_at" not in st.session_state:
+    st.session_state.opened_at = st.session_state.perf.started  # รอบแรกของเซสชัน
 
 # --- FORMATTING HELPER ---
 def fmt_num(val):
@@ -31,126 +56,227 @@ def get_thai_time():
 def get_thai_date():
     return get_thai_time().date()
 
-# --- 2. SETTINGS ---
-def load_settings():
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    default_settings = {"ev_rate": 50.0, "target_income": 2000.0} 
+# --- 2. STORAGE ENGINE ---
+# เลือก backend ได้จาก [storage] ใน secrets.toml หรือ env DRIVER_STORAGE
+#   backend = "gsheets" (ค่าเริ่มต้น) | "local" (SQLite ในเครื่อง)
+#   path = "driver_data.db", mirror = true (ส่งสำเนาขึ้น Google Sheets)
+#   driver = "" (คนขับเมื่อ URL ไม่มี ?driver=, env DRIVER_ID), drivers = ["A", ...] (ID ที่เปิดผ่าน ?driver= ได้
+#   ไม่กำหนด = คนขับที่มี ledger อยู่แล้ว), cache_mb = 512 (เพดาน ledger ใน memory ทุกคนขับรวมกัน)
+def get_storage_config():
     try:
-        df = conn.read(worksheet="Settings", ttl=3600)
-        if not df.empty and 'Key' in df.columns and 'Value' in df.columns:
-            settings = dict(zip(df['Key'], df['Value']))
-            return settings
+        return storage.storage_config(st.secrets.get("storage", {}))
     except Exception:
-        pass
-    return default_settings
-
-def save_settings(settings):
-    conn = st.connection("gsheets", type=GSheetsConnection)
+        return storage.storage_config()
+
+# connection ของชีตตัวเดียวทั้ง process: สร้างเมื่อใช้ครั้งแรก (backend local ไม่ import streamlit_gsheets เลย)
+@st.cache_resource
+def get_connection():
+    def connect():
+        from streamlit_gsheets import GSheetsConnection
+        return st.connection("gsheets", type=GSheetsConnection)
+    return storage.SharedConnection(connect)
+
+# --- DRIVER (หลายคนขับในแอปเดียว) ---
+# เซสชันผูกกับคนขับตั้งแต่เปิด (?driver=<ID> ใน URL) resource ทุกตัวด้านล่างแยกตามคนขับ
+# ID ใน URL ต้องเป็นคนขับที่รู้จัก (ดู storage.allowed_driver): เดา ID แล้วเปิด/สร้าง ledger ของคนอื่นไม่ได้
+# ฟังก์ชันแบบไม่มีอาร์กิวเมนต์ (get_storage/get_sync/...) คืน resource ของคนขับในเซสชันนี้
+def resolve_driver(requested):
+    config = get_storage_config()
     try:
-        data = [{'Key': k, 'Value': str(v)} for k, v in settings.items()]
-        df = pd.DataFrame(data)
-        conn.update(worksheet="Settings", data=df)
-        st.cache_data.clear()
-    except Exception as e:
-        st.error(f"บันทึกค่าตั้งต้นไม่สำเร็จ: {e}")
+        return storage.allowed_driver(requested, config, get_connection)
+    except Exception:
+        # ดูรายชื่อคนขับใน backend ไม่ได้ (ออฟไลน์): เปิดได้เฉพาะคนขับที่เคยใช้บนเครื่องนี้ (มี outbox อยู่แล้ว)
+        driver = storage.driver_id(requested)
+        return driver if os.path.exists(storage.driver_path(config.get("outbox", "driver_outbox.db"), driver)) else None
+
+if "driver" not in st.session_state:
+    driver = resolve_driver(st.query_params.get("driver"))
+    if driver is None:
+        st.error("⛔ ไม่พบคนขับตามลิงก์นี้ ให้ผู้ดูแลเพิ่มใน [storage] drivers ของ secrets.toml")
+        st.stop()
+    st.session_state.driver = driver
+
+def current_driver():
+    return st.session_state.driver
+
+@st.cache_resource
+def driver_storage(driver):
+    return storage.open_storage(get_storage_config(), get_connection, driver)
+
+def get_storage():
+    return driver_storage(current_driver())
+
+# --- SYNC QUEUE ---
+# การเขียนทุกครั้งลง outbox ในเครื่องก่อน แล้ว worker เบื้องหลังส่งขึ้น backend
+# ส่งสำเร็จแล้วขึ้นรุ่นข้อมูลใหม่ ให้ cache อ่าน backend ใหม่แทนการอ่านจาก outbox
+@st.cache_resource
+def driver_sync(driver):
+    store, versions, remote = driver_storage(driver), get_versions(), driver_remote(driver)
+    outbox = sync.Outbox(storage.driver_path(get_storage_config().get("outbox", "driver_outbox.db"), driver))
+
+    def on_synced(op):
+        if op == sync.OVERWRITE:
+            remote.invalidate()  # เขียนทับทั้งชีต: high-water mark ใช้ต่อไม่ได้ (แถวที่แก้ read_since ดึงให้เอง)
+        versions.bump(store.worksheet)
+
+    return sync.SyncWorker(outbox, store, on_synced=on_synced).start()
+
+def get_sync():
+    return driver_sync(current_driver())
+
+# --- DATA VERSIONS (ใช้ร่วมทั้ง process) ---
+# cache ทุกตัวผูก key กับ (worksheet, version): บันทึกแล้ว bump เฉพาะ worksheet ที่เปลี่ยน
+# entry ของรุ่นเก่าจะไม่ถูกเรียกอีกและหลุดออกเองตาม max_entries / ttl
+@st.cache_resource
+def get_versions():
+    return storage.DataVersions()
+
+# --- SETTINGS (write-through ใน memory, บันทึกเบื้องหลัง) ---
+@st.cache_resource
+def driver_settings(driver):
+    return storage.SettingsStore(driver_storage(driver))
+
+def get_settings_store():
+    return driver_settings(current_driver())
+
+def load_settings():
+    return get_settings_store().get()
+
+def save_settings(**values):
+    return get_settings_store().update(**values)
         
 # --- 3. DATA LOADING (Smart Cache) ---
-@st.cache_data(ttl=600) 
-def load_and_clean_data_cached():
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    try:
-        df = conn.read(worksheet=SHEET_NAME, ttl=600)
-        
-        required_cols = [
-            'วันที่', 'เวลา', 'แอป', 'หมวดหมู่', 'รายการ', 'ช่องทางรับเงิน',
-            'ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'คงเหลือ/สุทธิ', 
-            'เงินสดเข้าตัว', 'เลขไมล์', 'หมายเหตุ'
-        ]
-        
-        if df.empty or len(df.columns) < len(required_cols):
-             return pd.DataFrame(columns=required_cols)
-        
-        col_map = {
-            'Date': 'วันที่', 'Time': 'เวลา', 'Platform': 'แอป',
-            'Category': 'หมวดหมู่', 'SubCategory': 'รายการ',
-            'Amount_Gross': 'ยอดเต็ม/หน้าแอป', 'Deduction': 'หัก/จ่าย',
-            'Tip': 'ทิป', 'Net_Income': 'คงเหลือ/สุทธิ',
-            'Distance_Km': 'ระยะทาง(กม.)', 'Note': 'หมายเหตุ',
-            'Odometer': 'เลขไมล์',
-            'Payment_Method': 'ช่องทางรับเงิน',
-            'Cash_In': 'เงินสดเข้าตัว'
-        }
-        df.rename(columns={k: v for k, v in col_map.items() if k in df.columns}, inplace=True)
-        
-        for col in required_cols:
-            if col not in df.columns:
-                df[col] = 0.0 if col in ['ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'คงเหลือ/สุทธิ', 'เงินสดเข้าตัว', 'เลขไมล์'] else ""
-        
-        num_cols = ['ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'คงเหลือ/สุทธิ', 'เงินสดเข้าตัว', 'เลขไมล์']
-        for col in num_cols:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            
-        if 'วันที่' in df.columns:
-            df['วันที่'] = pd.to_datetime(df['วันที่'], errors='coerce').dt.date
-            
-        return df[required_cols]
-        
-    except Exception as e:
-        return pd.DataFrame(columns=[
-            'วันที่', 'เวลา', 'แอป', 'หมวดหมู่', 'รายการ', 'ช่องทางรับเงิน',
-            'ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'คงเหลือ/สุทธิ', 
-            'เงินสดเข้าตัว', 'เลขไมล์', 'หมายเหตุ'
-        ])
-
-def load_and_clean_data():
-    return load_and_clean_data_cached()
-
-def save_data(df):
-    conn = st.connection("gsheets", type=GSheetsConnection)
+# สำเนา ledger ของ backend ร่วมทั้ง process (ต่อคนขับ): เปลี่ยนรุ่น/ครบ 10 นาที ดึงเฉพาะแถวใหม่ (full=True อ่านใหม่ทั้งชีต)
+@st.cache_resource
+def driver_remote(driver):
+    # เช็กทุก 60 วินาที: อ่านแค่ท้ายชีต + บันทึกการแก้ไข (ถูก) แถวที่เครื่องอื่นเพิ่ม/แก้จึงมาถึงเร็ว
+    return sync.RemoteLedger(driver_storage(driver), max_age=60)
+
+def get_remote():
+    return driver_remote(current_driver())
+
+# --- LEDGER ของคนขับ (ใช้ร่วมทุกเซสชัน/แท็บของคนขับคนเดียวกัน) ---
+# DriverBook อยู่ใน LRU ของ process (ไม่ได้อยู่ใน session_state) คนขับที่ถูก unload ล้าง RemoteLedger ด้วย
+# โหลด/บันทึก/rollup/live state อยู่ใน driver_data.DriverData (ไม่พึ่ง Streamlit ใช้ร่วมกับ bench.py)
+@st.cache_resource
+def get_books():
+    max_bytes = int(float(get_storage_config().get("cache_mb", 512)) * 2**20)
+    return ledger.BookCache(max_bytes, on_evict=lambda driver: driver_remote(driver).clear())
+
+def get_book():
+    return get_books().get(current_driver())
+
+def get_data():
+    return DriverData(get_book(), get_storage(), get_sync(), get_remote(), get_versions(), get_books(),
+                      today=get_thai_date, on_error=st.error)
+
+# --- MEMO ---
+# ค่าที่คำนวณไว้ใน driver_memo (ใช้ร่วมทุกเซสชันของคนขับ) ผูกกับ (worksheet, รุ่นของ DriverBook) รุ่นเก่าจะถูกทิ้ง
+def driver_memo(name, key, compute):
+    book = get_book()
+    version = (get_storage().worksheet, book.version)
+    memo = book.memo
+    full_key = (name, version) + tuple(key)
+    perf.cache("memo", full_key in memo)
+    if full_key not in memo:
+        for k in [k for k in memo if k[1] != version]:
+            memo.pop(k, None)
+        with perf.span(f"memo.{name}"):
+            memo[full_key] = compute()
+    return memo[full_key]
+
+def plot(name, fig):
+    # เวลาแปลงกราฟเป็น JSON ส่งเบราว์เซอร์ (ฝั่งเซิร์ฟเวอร์) แยกจากเวลาสร้างกราฟใน driver_memo
+    with perf.span(f"plotly.{name}"):
+        st.plotly_chart(fig, use_container_width=True)
+
+def record_entry(make, *args, **kwargs):
+    # จุดเดียวที่ฟอร์มใช้สร้าง + บันทึกรายการ (ใช้เวลาเดียวกันทั้งวันที่และเวลา)
     try:
-        df_save = df.copy()
-        if 'วันที่' in df_save.columns:
-            df_save['วันที่'] = df_save['วันที่'].astype(str)
-        conn.update(worksheet=SHEET_NAME, data=df_save)
-        st.cache_data.clear()
-    except Exception as e:
-        st.error(f"บันทึกไม่สำเร็จ: {e}")
-
-if 'data' not in st.session_state:
-    st.session_state.data = load_and_clean_data()
+        record = make(*args, when=get_thai_time(), **kwargs)
+    except ValueError as e:
+        st.toast(f"⚠️ {e}")
+        return False
+    get_data().append_data(record)
+    return True
+
+def import_file(upload, platform, progress):
+    # นำเข้าไฟล์สรุปรายได้ทีละ chunk: แต่ละ chunk = append_data ครั้งเดียว (outbox 1 รายการ / append ชีตเป็นชุด)
+    # เทียบซ้ำกับ ledger ช่วงวันที่ของ chunk นั้น (โหลดเดือนเก่าเพิ่มถ้าไฟล์ย้อนไปก่อนช่วงที่โหลดไว้)
+    def existing(start, end):
+        get_data().ensure_loaded(start)
+        return ledger.slice_range(get_book().frame(), start, end)
+
+    stats = None
+    with perf.span("import"):
+        for stats in importer.import_statement(upload, upload.name, platform, existing,
+                                               lambda rows: get_data().append_data(rows.to_dict("records"))):
+            progress.caption(f"อ่านแล้ว {stats['read']:,} แถว · เพิ่ม {stats['imported']:,} · ซ้ำ {stats['duplicates']:,}")
+    return stats
+
+get_data().load_book()
 
 # --- 4. SIDEBAR ---
 with st.sidebar:
     st.title("⚙️ ตั้งค่า")
-    st.caption(f"เวลา: {get_thai_time().strftime('%H:%M')}")
+    st.caption(f"เวลา: {get_thai_time().strftime('%H:%M')}" + (f" · 👤 {current_driver()}" if current_driver() else ""))
     
-    if st.button("🔄 รีเฟรชข้อมูล (Cloud)"):
-        st.cache_data.clear()
-        st.session_state.data = load_and_clean_data()
+    c_ref1, c_ref2 = st.columns([3, 2])
+    refresh = c_ref1.button("🔄 รีเฟรชข้อมูล (Cloud)")
+    full_reload = c_ref2.button("โหลดใหม่ทั้งหมด", help="อ่านทั้งชีตใหม่ (ใช้เมื่อมีการแก้/ลบแถวเก่าจากเครื่องอื่น)")
+    if refresh or full_reload:
+        # ข้อมูลบน Cloud อาจถูกเพิ่มจากเครื่องอื่น: ขึ้นรุ่นใหม่ให้ดึงแถวที่เพิ่มมา
+        get_sync().kick()
+        get_data().reload_book(full=full_reload)
         st.rerun()
+
+    worker = get_sync()
+    n_pending = worker.pending()
+    if n_pending:
+        err = f" (ลองใหม่อัตโนมัติ: {worker.last_error})" if worker.last_error else ""
+        st.caption(f"⏳ รอซิงก์ {n_pending} รายการ{err}")
+    else:
+        st.caption("✅ ซิงก์ข้อมูลครบแล้ว")
+
+    store = get_storage()
+    if isinstance(store, storage.MirroredStorage):
+        n_mirror = store.mirror_pending()
+        if n_mirror:
+            err = f" (ลองใหม่อัตโนมัติ: {store.last_error})" if store.last_error else ""
+            st.caption(f"⏳ รอส่งสำเนาขึ้น Google Sheets {n_mirror} รายการ{err}")
+    if store.partitioned and store.needs_migration():
+        with st.expander("🗄️ แบ่งข้อมูลรายเดือน"):
+            st.caption(f"คัดลอกข้อมูลจากชีต {store.worksheet} ไปเป็นชีตรายเดือน (ชีตเดิมเก็บไว้เป็นสำรอง)")
+            if st.button("เริ่มย้ายข้อมูล", use_container_width=True):
+                n = store.migrate()
+                get_remote().invalidate()
+                get_data().reload_book()
+                st.toast(f"ย้ายข้อมูล {fmt_num(n)} แถวเรียบร้อย")
+                st.rerun()
     
     current_settings = load_settings()
     
-    saved_rate = int(float(current_settings.get("ev_rate", 50.0)))
+    saved_rate = int(current_settings["ev_rate"])
     new_ev_rate = st.number_input("ค่าไฟชาร์จบ้าน (เหมา)", value=saved_rate, step=5, format="%d")
     
     st.divider()
     st.markdown("### 🎯 เป้าหมายรายวัน")
     
-    saved_target = int(float(current_settings.get("target_income", 2000.0)))
+    saved_target = int(current_settings["target_income"])
     new_target = st.number_input("ตั้งเป้ารายได้ (บาท)", value=saved_target, step=100, format="%d")
     
     target_income = new_target
     ev_home_rate = new_ev_rate
 
     if new_ev_rate != saved_rate or new_target != saved_target:
-        current_settings["ev_rate"] = new_ev_rate
-        current_settings["target_income"] = new_target
-        save_settings(current_settings)
-        st.toast(f"บันทึกการตั้งค่าลง Cloud แล้ว! ☁️")
-        import time
-        time.sleep(1)
-        st.rerun()
+        if save_settings(ev_rate=new_ev_rate, target_income=new_target):
+            # บันทึกลง Cloud เบื้องหลัง: ยังไม่รู้ผลตอนนี้ (สถานะแสดงในบรรทัดด้านล่าง)
+            st.toast("ใช้ค่าใหม่แล้ว กำลังบันทึกขึ้น Cloud ☁️")
+    settings_store = get_settings_store()
+    if settings_store.last_error is not None:
+        st.caption(f"⚠️ บันทึกค่าตั้งต้นไม่สำเร็จ (ลองใหม่อัตโนมัติ): {settings_store.last_error}")
+    elif settings_store.pending():
+        st.caption("⏳ กำลังบันทึกค่าตั้งต้นขึ้น Cloud")
     
     st.divider()
     with st.expander("⚠️ พื้นที่อันตราย (ล้างข้อมูล)"):
@@ -158,42 +284,36 @@ with st.sidebar:
         confirm_delete = st.checkbox("ฉันยืนยันที่จะลบข้อมูลทั้งหมด")
         if confirm_delete:
             if st.button("ยืนยันการล้างข้อมูล 🗑️", type="primary", use_container_width=True):
-                st.session_state.data = st.session_state.data.iloc[0:0] 
-                save_data(st.session_state.data)
-                st.success("ล้างข้อมูลเรียบร้อยแล้ว")
-                st.rerun()
+                if get_data().save_data(ledger.empty(), everything=True):
+                    st.success("ล้างข้อมูลเรียบร้อยแล้ว")
+                    st.rerun()
 
 # --- 5. MAIN APP ---
 st.title("🚗 ระบบบันทึกรายได้")
-tab1, tab2, tab3 = st.tabs(["📝 บันทึกงาน", "📊 สรุปผลละเอียด", "🗂️ ฐานข้อมูล"])
+if get_book().load_error is not None:
+    st.error(f"⚠️ โหลดข้อมูลจาก Cloud ไม่สำเร็จ ({get_book().load_error}) ที่เห็นอยู่มีเฉพาะรายการที่ยังรอซิงก์ "
+             "กด 🔄 รีเฟรชข้อมูล ในแถบด้านข้างเพื่อลองใหม่")
+# แท็บแบบติดตามสถานะ: คำนวณเฉพาะแท็บที่เปิดอยู่ (.open) บันทึกงานใน tab1 จึงไม่ต้องสร้างแดชบอร์ด/ตารางใหม่
+# tab2/tab3 เป็น fragment: เปลี่ยนตัวเลือกภายในแท็บ rerun เฉพาะแท็บนั้น
+# แท็บภาพรวมทีมขึ้นเมื่อมี [fleet] ใน secrets.toml: out = "fleet_reports" (โฟลเดอร์ผลของ fleet.py), workers = จำนวน process
+def get_fleet_config():
+    try:
+        return dict(st.secrets["fleet"]) if "fleet" in st.secrets else None
+    except Exception:
+        return None
+
+fleet_config = get_fleet_config()
+tab_labels = ["📝 บันทึกงาน", "📊 สรุปผลละเอียด", "🗂️ ฐานข้อมูล"] + (["🏁 ภาพรวมทีม"] if fleet_config is not None else [])
+tab1, tab2, tab3, *fleet_tabs = st.tabs(tab_labels, key="main_tab", on_change="rerun")
 
 # ==========================================
 # TAB 1: บันทึกงาน
 # ==========================================
 with tab1:
-    def get_last_odom():
-        df = st.session_state.data
-        if not df.empty:
-            max_odom = df['เลขไมล์'].max()
-            return int(max_odom) if max_odom > 0 else 0
-        return 0
-
-    def get_work_status():
-        df = st.session_state.data
-        if not df.empty:
-            shift_df = df[df['หมวดหมู่'] == 'กะงาน']
-            if not shift_df.empty:
-                return shift_df.iloc[-1]['รายการ']
-        return "🌙 เลิกงาน"
+    live = get_data().get_live_state()
 
     # --- แถบพลัง ---
-    today = get_thai_date()
-    df = st.session_state.data
-    
-    today_income = 0.0
-    if not df.empty:
-        today_df = df[(df['วันที่'] == today) & (df['หมวดหมู่'] == 'รายรับ')]
-        today_income = today_df['คงเหลือ/สุทธิ'].sum()
+    today_income = ledger.baht(live["today_income"])
     
     progress = min(today_income / target_income, 1.0) if target_income > 0 else 0
     
@@ -206,11 +326,12 @@ with tab1:
     st.divider()
 
     # --- จัดการกะงาน ---
-    current_status = get_work_status()
-    last_odom_val = get_last_odom()
+    current_status = live["status"]
+    last_odom_val = live["last_odom"]
 
     if "เริ่ม" in current_status:
-        expander_label = f"🟢 สถานะ: วิ่งงานอยู่ (เริ่มที่ {fmt_num(last_odom_val)} กม.) - คลิกเพื่อจบกะ 🔽"
+        start_txt = f"{live['shift_start']:%H:%M} " if live["shift_start"] is not None else ""
+        expander_label = f"🟢 สถานะ: วิ่งงานอยู่ (เริ่ม {start_txt}ที่ {fmt_num(last_odom_val)} กม.) - คลิกเพื่อจบกะ 🔽"
         expander_icon = "🚕"
     else:
         expander_label = f"🔴 สถานะ: พักผ่อน (ล่าสุด {fmt_num(last_odom_val)} กม.) - คลิกเพื่อเริ่มงาน 🔽"
@@ -224,15 +345,8 @@ with tab1:
             with c_end_2:
                 if st.button("🌙 ยืนยันจบกะ", type="primary", use_container_width=True):
                     if end_odom and end_odom >= last_odom_val:
-                        new_row = {
-                            'วันที่': get_thai_date(), 'เวลา': get_thai_time().strftime("%H:%M"),
-                            'แอป': 'ระบบ', 'หมวดหมู่': 'กะงาน', 'รายการ': '🌙 เลิกงาน', 'ช่องทางรับเงิน': '-',
-                            'ยอดเต็ม/หน้าแอป': 0, 'หัก/จ่าย': 0, 'ทิป': 0, 'คงเหลือ/สุทธิ': 0, 'เงินสดเข้าตัว': 0,
-                            'เลขไมล์': end_odom, 'หมายเหตุ': f"ระยะทาง {end_odom - last_odom_val} กม."
-                        }
-                        st.session_state.data = pd.concat([st.session_state.data, pd.DataFrame([new_row])], ignore_index=True)
-                        save_data(st.session_state.data)
-                        st.rerun()
+                        if record_entry(ledger.shift_record, False, end_odom, note=f"ระยะทาง {end_odom - last_odom_val} กม."):
+                            st.rerun()
                     else: st.toast("⚠️ เลขไมล์ต้องเพิ่มขึ้น")
         else:
             c_start_1, c_start_2 = st.columns([2, 1])
@@ -240,19 +354,12 @@ with tab1:
                 start_odom = st.number_input("เลขไมล์เริ่ม", min_value=0, value=last_odom_val, step=1, format="%d", label_visibility="collapsed")
             with c_start_2:
                 if st.button("🚀 ยืนยันเริ่ม", type="primary", use_container_width=True):
-                    new_row = {
-                        'วันที่': get_thai_date(), 'เวลา': get_thai_time().strftime("%H:%M"),
-                        'แอป': 'ระบบ', 'หมวดหมู่': 'กะงาน', 'รายการ': '☀️ เริ่มงาน', 'ช่องทางรับเงิน': '-',
-                        'ยอดเต็ม/หน้าแอป': 0, 'หัก/จ่าย': 0, 'ทิป': 0, 'คงเหลือ/สุทธิ': 0, 'เงินสดเข้าตัว': 0,
-                        'เลขไมล์': start_odom, 'หมายเหตุ': 'เริ่มกะใหม่'
-                    }
-                    st.session_state.data = pd.concat([st.session_state.data, pd.DataFrame([new_row])], ignore_index=True)
-                    save_data(st.session_state.data)
-                    st.rerun()
+                    if record_entry(ledger.shift_record, True, start_odom, note='เริ่มกะใหม่'):
+                        st.rerun()
 
     # --- แบบฟอร์มบันทึก ---
     st.markdown("### 📝 บันทึกรายการ")
-    sub_tab1, sub_tab2, sub_tab3, sub_tab4 = st.tabs(["🚗 รับงาน", "⛽ เติมของ", "💳 เติมแอป", "🛠️ จ่ายอื่น"])
+    sub_tab1, sub_tab2, sub_tab3, sub_tab4, sub_tab5 = st.tabs(["🚗 รับงาน", "⛽ เติมของ", "💳 เติมแอป", "🛠️ จ่ายอื่น", "📥 นำเข้า"])
     
     # 1. รับงาน
     with sub_tab1:
@@ -288,19 +395,14 @@ with tab1:
                     
                     cash_in_hand = real_val if "เงินสด" in pay_method else 0.0
 
-                    new_row = {
-                        'วันที่': get_thai_date(), 'เวลา': get_thai_time().strftime("%H:%M"),
-                        'แอป': platform, 'หมวดหมู่': 'รายรับ', 'รายการ': 'ค่าโดยสาร', 'ช่องทางรับเงิน': pay_method,
-                        'ยอดเต็ม/หน้าแอป': price_val, 
-                        'หัก/จ่าย': deducted, # บันทึกยอดที่โดนหักตรงนี้
-                        'ทิป': tip, 
-                        'คงเหลือ/สุทธิ': real_val, 'เงินสดเข้าตัว': cash_in_hand, 
-                        'เลขไมล์': 0, 'หมายเหตุ': note
-                    }
-                    st.session_state.data = pd.concat([st.session_state.data, pd.DataFrame([new_row])], ignore_index=True)
-                    save_data(st.session_state.data)
-                    st.toast(f"บันทึก +{fmt_num(real_val)} บาท")
-                    st.rerun()
+                    if record_entry(
+                        ledger.make_record, 'รายรับ', 'ค่าโดยสาร', app=platform, channel=pay_method,
+                        gross=price_val,
+                        deduct=deducted, # บันทึกยอดที่โดนหักตรงนี้
+                        tip=tip, net=real_val, cash=cash_in_hand, note=note,
+                    ):
+                        st.toast(f"บันทึก +{fmt_num(real_val)} บาท")
+                        st.rerun()
                 else: st.warning("ระบุยอดเงินด้วยครับ")
 
     # 2. เติมพลังงาน
@@ -314,14 +416,8 @@ with tab1:
             if st.form_submit_button("บันทึก", type="primary", use_container_width=True):
                 if cost:
                     full_note = f"{e_type} - {note}" if note else e_type
-                    new_row = {
-                        'วันที่': get_thai_date(), 'เวลา': get_thai_time().strftime("%H:%M"),
-                        'แอป': 'ค่าใช้จ่าย', 'หมวดหมู่': 'รายจ่าย', 'รายการ': 'ค่าน้ำมัน/ไฟ', 'ช่องทางรับเงิน': 'จ่ายสด', 
-                        'ยอดเต็ม/หน้าแอป': 0, 'หัก/จ่าย': cost, 'ทิป': 0, 'คงเหลือ/สุทธิ': -cost, 'เงินสดเข้าตัว': -cost, 'เลขไมล์': 0, 'หมายเหตุ': full_note
-                    }
-                    st.session_state.data = pd.concat([st.session_state.data, pd.DataFrame([new_row])], ignore_index=True)
-                    save_data(st.session_state.data)
-                    st.rerun()
+                    if record_entry(ledger.expense_record, 'ค่าน้ำมัน/ไฟ', cost, note=full_note):
+                        st.rerun()
 
     # 3. เติมเครดิต
     with sub_tab3:
@@ -331,10 +427,8 @@ with tab1:
             cost = st.number_input("จำนวนเงินที่เติม/โดนหัก", min_value=0, value=None, placeholder="0", step=1, format="%d")
             if st.form_submit_button("บันทึก", type="primary", use_container_width=True):
                 if cost:
-                    new_row = {'วันที่': get_thai_date(), 'เวลา': get_thai_time().strftime("%H:%M"), 'แอป': sub_cat, 'หมวดหมู่': 'รายจ่าย', 'รายการ': 'เติมเครดิต', 'ช่องทางรับเงิน': 'จ่ายสด', 'ยอดเต็ม/หน้าแอป': 0, 'หัก/จ่าย': cost, 'ทิป': 0, 'คงเหลือ/สุทธิ': -cost, 'เงินสดเข้าตัว': -cost, 'เลขไมล์': 0, 'หมายเหตุ': 'Top-up'}
-                    st.session_state.data = pd.concat([st.session_state.data, pd.DataFrame([new_row])], ignore_index=True)
-                    save_data(st.session_state.data)
-                    st.rerun()
+                    if record_entry(ledger.expense_record, 'เติมเครดิต', cost, app=sub_cat, note='Top-up'):
+                        st.rerun()
 
     # 4. จ่ายอื่น
     with sub_tab4:
@@ -343,111 +437,87 @@ with tab1:
             cost = st.number_input("จำนวนเงิน", min_value=0, value=None, placeholder="0", step=1, format="%d")
             if st.form_submit_button("บันทึก", type="primary", use_container_width=True):
                 if cost:
-                    new_row = {'วันที่': get_thai_date(), 'เวลา': get_thai_time().strftime("%H:%M"), 'แอป': 'ค่าใช้จ่าย', 'หมวดหมู่': 'รายจ่าย', 'รายการ': 'ทั่วไป', 'ช่องทางรับเงิน': 'จ่ายสด', 'ยอดเต็ม/หน้าแอป': 0, 'หัก/จ่าย': cost, 'ทิป': 0, 'คงเหลือ/สุทธิ': -cost, 'เงินสดเข้าตัว': -cost, 'เลขไมล์': 0, 'หมายเหตุ': sub_cat}
-                    st.session_state.data = pd.concat([st.session_state.data, pd.DataFrame([new_row])], ignore_index=True)
-                    save_data(st.session_state.data)
+                    if record_entry(ledger.expense_record, 'ทั่วไป', cost, note=sub_cat):
+                        st.rerun()
+
+    # 5. นำเข้าไฟล์สรุปรายได้จากแอป
+    with sub_tab5:
+        upload = st.file_uploader("ไฟล์สรุปรายได้ (CSV / XLSX) จาก Grab, Bolt, LINE MAN", type=["csv", "xlsx"], key="import_file")
+        if upload is not None:
+            platforms = list(importer.PROFILES)
+            guess = importer.guess_platform(upload.name)
+            platform = st.selectbox("แอป", platforms, index=platforms.index(guess) if guess else 0, key="import_platform")
+            if st.button("📥 นำเข้างาน", type="primary", use_container_width=True):
+                progress = st.empty()
+                try:
+                    stats = import_file(upload, platform, progress)
+                except ValueError as e:
+                    st.error(f"นำเข้าไม่สำเร็จ: {e}")
+                else:
+                    st.toast(f"นำเข้า {stats['imported']:,} งาน (ซ้ำ {stats['duplicates']:,} · ข้าม {stats['invalid']:,} แถว)")
                     st.rerun()
+            st.caption("งานที่มีอยู่แล้วจะถูกข้าม นำเข้าไฟล์เดิมซ้ำได้ไม่เกิดรายการซ้ำ")
+
+# --- STARTUP TIME ---
+# วัดครั้งเดียวต่อเซสชัน: เวลาจนฟอร์ม tab1 แสดงครบครั้งแรก (รวมต่อชีต/โหลด ledger/rollup)
+# เซสชันแรกของ process = cold start นับจาก process เริ่ม (บูต streamlit server + import ทุกโมดูล)
+# เซสชันถัดไปนับจากรอบแรกของเซสชัน ไม่ใช่รอบนี้ (รอบที่ถูก st.rerun ตัดก่อนถึงฟอร์มก็นับรวม)
+@st.cache_resource
+def cold_start_pending():
+    return {"cold": True}
+
+if "startup_ms" not in st.session_state:
+    cold = cold_start_pending().pop("cold", False)
+    since = perf.process_started() if cold else st.session_state.opened_at
+    st.session_state.startup_ms = (time.time() - since) * 1000
+    perf.record("startup.cold_first_form" if cold else "startup.first_form", st.session_state.startup_ms / 1000)
 
 # ==========================================
 # TAB 2: สรุปผล (GP Logic: Card Net = Top-up)
 # ==========================================
-import calendar
-
-with tab2:
-    with st.sidebar:
-        st.divider()
-        st.markdown("### 📊 ตัวเลือกแสดงผล (Tab 2)")
-        time_filter = st.selectbox("📅 ช่วงเวลา:", ["วันนี้", "เมื่อวาน", "สัปดาห์นี้", "เดือนนี้", "เดือนที่แล้ว", "ปีนี้", "กำหนดเอง"], key="sb_time_filter")
-        
-        custom_start, custom_end = None, None
-        if time_filter == "กำหนดเอง":
-            dr = st.date_input("เลือกวันที่:", value=(get_thai_date(), get_thai_date()), key="sb_date_picker")
-            if len(dr) == 2: custom_start, custom_end = dr
-
+# ตัวเลือกของ tab2 อยู่ที่ sidebar และแสดงเสมอ (ค่าที่เลือกไว้ไม่หายตอนเปิดแท็บอื่น)
+with st.sidebar:
+    st.divider()
+    st.markdown("### 📊 ตัวเลือกแสดงผล (Tab 2)")
+    time_filter = st.selectbox("📅 ช่วงเวลา:", ["วันนี้", "เมื่อวาน", "สัปดาห์นี้", "เดือนนี้", "เดือนที่แล้ว", "ปีนี้", "กำหนดเอง"], key="sb_time_filter")
+
+    custom_start, custom_end = None, None
+    if time_filter == "กำหนดเอง":
+        dr = st.date_input("เลือกวันที่:", value=(get_thai_date(), get_thai_date()), key="sb_date_picker")
+        if dr: custom_start, custom_end = dr[0], dr[-1]  # ระหว่างเลือก date_input คืนวันเดียว
+
+@st.fragment
+@perf.run("tab2")
+def dashboard_tab(time_filter, custom_start, custom_end):
+    import plotly.express as px  # โหลดเมื่อเปิดแดชบอร์ดครั้งแรก ไม่ถ่วงการเปิดแอป
     st.markdown(f"### 📊 แดชบอร์ด: {time_filter}")
     
-    df = st.session_state.data
+    today = get_thai_date()
+    p_start, p_end, days_count = analytics.period_range(time_filter, today, custom_start, custom_end)
+    get_data().ensure_loaded(p_start)
+    book = get_book()
+    df = book.frame()
     if not df.empty:
-        today = get_thai_date()
-        f_df = df.copy()
-        
         # --- Filter Logic ---
-        days_count = 1 
-        if time_filter == "วันนี้": 
-            f_df = df[df['วันที่'] == today]
-        elif time_filter == "เมื่อวาน": 
-            f_df = df[df['วันที่'] == today - datetime.timedelta(days=1)]
-        elif time_filter == "สัปดาห์นี้":
-            start = today - datetime.timedelta(days=today.weekday())
-            f_df = df[(df['วันที่'] >= start) & (df['วันที่'] <= start + datetime.timedelta(days=6))]
-            days_count = 7
-        elif time_filter == "เดือนนี้": 
-            f_df = df[(pd.to_datetime(df['วันที่']).dt.month == today.month) & (pd.to_datetime(df['วันที่']).dt.year == today.year)]
-            days_count = calendar.monthrange(today.year, today.month)[1]
-        elif time_filter == "เดือนที่แล้ว":
-            first = today.replace(day=1); last_prev = first - datetime.timedelta(days=1); start_prev = last_prev.replace(day=1)
-            f_df = df[(df['วันที่'] >= start_prev) & (df['วันที่'] <= last_prev)]
-            days_count = calendar.monthrange(start_prev.year, start_prev.month)[1]
-        elif time_filter == "ปีนี้": 
-            f_df = df[pd.to_datetime(df['วันที่']).dt.year == today.year]
-            days_count = 365
-        elif time_filter == "กำหนดเอง" and custom_start and custom_end:
-            f_df = df[(df['วันที่'] >= custom_start) & (df['วันที่'] <= custom_end)]
-            days_count = (custom_end - custom_start).days + 1
+        period_key = (time_filter, p_start, p_end)
+        f_df = ledger.slice_range(df, p_start, p_end)
 
         if not f_df.empty:
             inc_df = f_df[f_df['หมวดหมู่'] == 'รายรับ']
             exp_df = f_df[f_df['หมวดหมู่'] == 'รายจ่าย']
             
-            # --- 1. เตรียมข้อมูลรายวัน ---
-            daily_income = f_df[f_df['หมวดหมู่']=='รายรับ'].groupby('วันที่')['คงเหลือ/สุทธิ'].sum()
-            daily_expense = f_df[f_df['หมวดหมู่']=='รายจ่าย'].groupby('วันที่')['หัก/จ่าย'].sum()
-            daily_cash = f_df.groupby('วันที่')['เงินสดเข้าตัว'].sum()
-            daily_dist = f_df[f_df['เลขไมล์'] > 0].groupby('วันที่')['เลขไมล์'].agg(lambda x: x.max() - x.min())
-            
-            # คำนวณชั่วโมง
-            daily_hours = {}
-            shift_df = f_df[f_df['หมวดหมู่'] == 'กะงาน']
-            for d in f_df['วันที่'].unique():
-                ds = shift_df[shift_df['วันที่'] == d]
-                s = ds[ds['รายการ'].str.contains("เริ่ม")]['เวลา']
-                e = ds[ds['รายการ'].str.contains("เลิก")]['เวลา']
-                h_val = 0
-                if not s.empty and not e.empty:
-                    try:
-                        ts = pd.to_datetime(s.min(), format='%H:%M')
-                        te = pd.to_datetime(e.max(), format='%H:%M')
-                        h = (te - ts).total_seconds()/3600
-                        if h < 0: h += 24
-                        h_val = h
-                    except: pass
-                daily_hours[d] = h_val
-            daily_hours_series = pd.Series(daily_hours)
-
-            daily_master = pd.DataFrame(index=f_df['วันที่'].unique()).sort_index()
-            daily_master['กำไรสุทธิ'] = daily_income.sub(daily_expense, fill_value=0)
-            daily_master['รายรับรวม'] = daily_income
-            daily_master['รายจ่ายรวม'] = daily_expense
-            daily_master['เงินสดเข้าตัว'] = daily_cash
-            daily_master['ระยะทาง'] = daily_dist
-            daily_master['ชั่วโมงขับ'] = daily_hours_series
-            daily_master = daily_master.fillna(0).reset_index().rename(columns={'index':'วันที่'})
+            # --- 1. ข้อมูลรายวัน (อ่านจาก rollup) ---
+            daily_master = analytics.rollup_range(book.rollup, p_start, p_end)
+            daily_master = daily_master.rename_axis('วันที่').reset_index()
 
             # --- 2. Metrics รวม ---
-            net = daily_master['กำไรสุทธิ'].sum()
-            dist = daily_master['ระยะทาง'].sum()
-            cash = daily_master['เงินสดเข้าตัว'].sum()
-            total_exp = daily_master['รายจ่ายรวม'].sum()
-            hours = daily_master['ชั่วโมงขับ'].sum()
-            baht_per_km = net / dist if dist > 0 else 0
-            baht_per_hr = net / hours if hours > 0 else 0
-            
-            total_target = target_income * days_count
-            total_income_only = daily_master['รายรับรวม'].sum() 
+            summary = analytics.summarize(daily_master, target_income, days_count)
+            net, dist, hours = summary['กำไรสุทธิ'], summary['ระยะทาง'], summary['ชั่วโมงขับ']
+            total_income_only, total_target = summary['รายรับรวม'], summary['เป้ารายรับ']
             
             # --- Display Targets ---
             st.markdown(f"**🎯 เป้าหมาย (รายรับ): {fmt_num(total_income_only)} / {fmt_num(total_target)} บาท**")
-            progress = min(total_income_only / total_target, 1.0) if total_target > 0 else 0
+            progress = summary['ทำได้ (%)'] / 100
             st.progress(progress, text=f"ทำได้แล้ว {progress*100:.1f}%")
 
             # --- Display Metrics ---
@@ -455,14 +525,14 @@ with tab2:
             m1, m2, m3, m4 = st.columns(4)
             m1.metric("💰 กำไรสุทธิ", f"{fmt_num(net)} บ.", help="รายรับ - รายจ่าย")
             m2.metric("🛣️ ระยะทาง", f"{fmt_num(dist)} กม.")
-            m3.metric("⚡ บาท / กม.", f"{fmt_num(baht_per_km)} บ.")
-            m4.metric("⏱️ บาท / ชม.", f"{fmt_num(baht_per_hr)} บ.")
+            m3.metric("⚡ บาท / กม.", f"{fmt_num(summary['บาท/กม.'])} บ.")
+            m4.metric("⏱️ บาท / ชม.", f"{fmt_num(summary['บาท/ชม.'])} บ.")
             
             c1, c2, c3, c4 = st.columns(4)
-            c1.metric("💵 เงินสดเข้าตัว", f"{fmt_num(cash)} บ.")
-            c2.metric("💸 รายจ่ายรวม", f"{fmt_num(total_exp)} บ.")
+            c1.metric("💵 เงินสดเข้าตัว", f"{fmt_num(summary['เงินสดเข้าตัว'])} บ.")
+            c2.metric("💸 รายจ่ายรวม", f"{fmt_num(summary['รายจ่ายรวม'])} บ.")
             c3.metric("⏳ ชั่วโมงขับ", f"{fmt_num(hours)} ชม.")
-            c4.metric("📝 จำนวนงาน", f"{len(inc_df)} งาน")
+            c4.metric("📝 จำนวนงาน", f"{fmt_num(summary['จำนวนงาน'])} งาน")
             
             st.divider()
 
@@ -485,62 +555,23 @@ with tab2:
             selected_col, color_code = col_map[chart_mode]
 
             if not daily_master.empty:
-                fig_trend = px.area(daily_master, x='วันที่', y=selected_col, title=f"แนวโน้ม: {chart_mode}", markers=True, color_discrete_sequence=[color_code])
-                fig_trend.update_traces(hovertemplate='%{y:,.2f}')
-                st.plotly_chart(fig_trend, use_container_width=True)
+                def trend_figure():
+                    # ช่วงยาวรวมเป็นรายสัปดาห์/รายเดือนอัตโนมัติ จำนวนจุดที่ส่งไปเบราว์เซอร์จึงไม่เกิน analytics.TREND_MAX_POINTS
+                    trend, bucket = analytics.trend_buckets(daily_master[['วันที่', selected_col]])
+                    fig = px.area(trend, x='วันที่', y=selected_col, title=f"แนวโน้ม{bucket}: {chart_mode}", markers=True, color_discrete_sequence=[color_code])
+                    fig.update_traces(hovertemplate='%{y:,.2f}')
+                    return fig
+                plot("trend", driver_memo("fig_trend", period_key + (chart_mode,), trend_figure))
             else: st.info("ไม่มีข้อมูลสำหรับสร้างกราฟ")
 
             st.divider()
 
             # --- 🟢 วิเคราะห์ความคุ้มค่า (GP: เติมเงิน + ตัดบัตร + เครดิตเข้า Wallet) ---
             with st.expander("💸 วิเคราะห์ความคุ้มค่า (GP & ค่าคอม)", expanded=True):
-                # 1. ข้อมูลฝั่งจ่าย (ต้นทุนเติมเครดิต)
-                app_expenses = exp_df[~exp_df['แอป'].isin(['ค่าใช้จ่าย', 'ระบบ'])].copy()
-                app_expenses['แอป'] = app_expenses['แอป'].replace({'Grab Wallet': 'Grab'}) 
-                
-                # 2. ข้อมูลฝั่งรับ (รายได้)
-                app_incomes = inc_df.copy()
-                
-                if not app_incomes.empty:
-                    gp_data = []
-                    all_apps = set(app_incomes['แอป'].unique()) | set(app_expenses['แอป'].unique())
-                    
-                    for app in all_apps:
-                        my_inc = app_incomes[app_incomes['แอป'] == app]
-                        my_exp = app_expenses[app_expenses['แอป'] == app]
-
-                        # Gross
-                        gross_income = my_inc['ยอดเต็ม/หน้าแอป'].sum()
-                        
-                        # A. ต้นทุน: เติมเครดิตเอง
-                        deduct_manual_topup = my_exp['หัก/จ่าย'].sum()
-                        
-                        # B. ต้นทุน: โดนหักส่วนต่าง (หน้าแอป - รับจริง)
-                        diff_series = my_inc['ยอดเต็ม/หน้าแอป'] - my_inc['คงเหลือ/สุทธิ']
-                        deduct_diff = diff_series[diff_series > 0].sum()
-                        
-                        # C. ต้นทุน (แบบพิเศษ): นับเงินที่เข้า Wallet เป็นเหมือนการเติมเครดิต
-                        # เงื่อนไข: รับเงินทาง "ตัดบัตร/แอป" ถือเป็นเครดิตสำหรับจ่ายงานอื่น
-                        credit_from_app = my_inc[my_inc['ช่องทางรับเงิน'] == '💳 ตัดบัตร/แอป']['คงเหลือ/สุทธิ'].sum()
-                        
-                        # รวมต้นทุนทั้งหมด
-                        total_deduction = deduct_manual_topup + deduct_diff + credit_from_app
-
-                        if gross_income > 0:
-                            gp_pct = (total_deduction / gross_income) * 100
-                            gp_data.append({
-                                "แอป": app, 
-                                "GP (%)": gp_pct, 
-                                "รวมค่าคอม/เครดิต (บ.)": total_deduction, 
-                                "ยอดหน้าแอป (บ.)": gross_income,
-                                "เติมเอง": deduct_manual_topup,
-                                "หักส่วนต่าง": deduct_diff,
-                                "เครดิตเข้า Wallet": credit_from_app
-                            })
+                if not inc_df.empty:
+                    gp_df = driver_memo("gp", period_key, lambda: analytics.gp_table(f_df))
                     
-                    if gp_data:
-                        gp_df = pd.DataFrame(gp_data).sort_values(by="GP (%)", ascending=True)
-                        
+                    if not gp_df.empty:
                         c_gp1, c_gp2 = st.columns([1, 2])
                         with c_gp1: 
                             st.dataframe(
@@ -557,7 +588,8 @@ with tab2:
                                 use_container_width=True
                             )
                         with c_gp2: 
-                            st.plotly_chart(px.bar(gp_df, x='GP (%)', y='แอป', orientation='h', title="📉 Total Cost vs Gross", text_auto='.1f', color='GP (%)', color_continuous_scale='Reds'), use_container_width=True)
+                            fig_gp = driver_memo("fig_gp", period_key, lambda: px.bar(gp_df, x='GP (%)', y='แอป', orientation='h', title="📉 Total Cost vs Gross", text_auto='.1f', color='GP (%)', color_continuous_scale='Reds'))
+                            plot("gp", fig_gp)
                     else: st.info("ข้อมูลไม่เพียงพอ")
                 else: st.info("ไม่มีข้อมูลรายรับ")
 
@@ -568,103 +600,187 @@ with tab2:
             c_pie, c_heat = st.columns(2)
             with c_pie:
                 if not inc_df.empty:
-                    st.plotly_chart(px.pie(inc_df, values='คงเหลือ/สุทธิ', names='แอป', title="🍩 สัดส่วนรายได้", hole=0.4, color='แอป', color_discrete_map=APP_COLORS), use_container_width=True)
+                    def pie_figure():
+                        return px.pie(analytics.income_by_app(inc_df), values='คงเหลือ/สุทธิ', names='แอป', title="🍩 สัดส่วนรายได้", hole=0.4, color='แอป', color_discrete_map=APP_COLORS)
+                    plot("pie", driver_memo("fig_pie", period_key, pie_figure))
             with c_heat:
                 if not inc_df.empty:
-                    temp = inc_df.copy()
-                    temp['Hour'] = pd.to_datetime(temp['เวลา'], format='%H:%M').dt.hour
-                    hm = temp.pivot_table(index='แอป', columns='Hour', values='คงเหลือ/สุทธิ', aggfunc='sum', fill_value=0)
-                    if not hm.empty:
-                        st.plotly_chart(px.imshow(hm, title="🔥 ช่วงเวลาทำเงิน", aspect="auto", color_continuous_scale="Greens"), use_container_width=True)
+                    def heatmap_figure():
+                        hm = analytics.hourly_heatmap(inc_df)
+                        return None if hm.empty else px.imshow(hm, title="🔥 ช่วงเวลาทำเงิน", aspect="auto", color_continuous_scale="Greens")
+                    fig_heat = driver_memo("fig_heatmap", period_key, heatmap_figure)
+                    if fig_heat is not None:
+                        plot("heatmap", fig_heat)
 
             # --- กราฟรายจ่ายเจาะลึก ---
             st.markdown("### 💸 รายจ่าย (เจาะลึก)")
             if not exp_df.empty:
-                def detailed_expense_name(row):
-                    item = row['รายการ']
-                    app_name = row['แอป']
-                    note = str(row['หมายเหตุ']).strip()
-                    if 'เติมเครดิต' in item: return f"💳 เติม {app_name}"
-                    if 'น้ำมัน' in item or 'ไฟ' in item:
-                        if 'ชาร์จ' in item or 'ชาร์จ' in note: return "⚡ ชาร์จไฟ"
-                        if 'น้ำมัน' in item or 'น้ำมัน' in note: return "⛽ น้ำมัน"
-                        return "⛽ พลังงาน"
-                    if 'ทั่วไป' in item:
-                        if note and note.lower() != 'nan' and note != '': return f"🛠️ {note}"
-                        return "🛠️ จ่ายทั่วไป"
-                    return item
-
-                exp_df_plot = exp_df.copy()
-                exp_df_plot['ชื่อรายการกราฟ'] = exp_df_plot.apply(detailed_expense_name, axis=1)
-                exp_sum = exp_df_plot.groupby('ชื่อรายการกราฟ')['หัก/จ่าย'].sum().reset_index().sort_values(by='หัก/จ่าย', ascending=True)
-
-                fig_exp = px.bar(
-                    exp_sum, 
+                fig_exp = driver_memo("fig_expense", period_key, lambda: px.bar(
+                    analytics.expense_breakdown(exp_df), 
                     x='หัก/จ่าย', 
                     y='ชื่อรายการกราฟ', 
                     color='ชื่อรายการกราฟ', 
                     text_auto='.0f',
                     orientation='h'
-                )
-                st.plotly_chart(fig_exp, use_container_width=True)
+                ))
+                plot("expense", fig_exp)
             else:
                 st.info("ยังไม่มีข้อมูลรายจ่าย")
 
         else: st.warning(f"🔍 ไม่พบข้อมูล ({time_filter})")
     else: st.info("เริ่มบันทึกงานแรกได้เลย")
+
+with tab2:
+    if tab2.open:
+        dashboard_tab(time_filter, custom_start, custom_end)
                                     
 # ==========================================
 # TAB 3: ฐานข้อมูล (Performance)
 # ==========================================
-with tab3:
+@st.fragment
+@perf.run("tab3")
+def database_tab():
     st.subheader("🗂️ ฐานข้อมูล")
     
     with st.container(border=True):
         c1, c2, c3 = st.columns(3)
-        apps = st.session_state.data['แอป'].unique() if not st.session_state.data.empty else []
-        cats = st.session_state.data['หมวดหมู่'].unique() if not st.session_state.data.empty else []
+        f_date = c3.selectbox("วันที่", ["เดือนนี้", "วันนี้", "ทั้งหมด"])
+        if f_date == "ทั้งหมด":
+            get_data().ensure_loaded(None)
+        data = get_book().frame()
+        apps = data['แอป'].unique().tolist() if not data.empty else []
+        cats = data['หมวดหมู่'].unique().tolist() if not data.empty else []
         
         f_app = c1.multiselect("แอป", apps)
         f_cat = c2.multiselect("หมวดหมู่", cats)
-        f_date = c3.selectbox("วันที่", ["เดือนนี้", "วันนี้", "ทั้งหมด"])
 
-    df_show = st.session_state.data.copy()
+    df_show = data
     if not df_show.empty:
         if f_app: df_show = df_show[df_show['แอป'].isin(f_app)]
         if f_cat: df_show = df_show[df_show['หมวดหมู่'].isin(f_cat)]
-        if f_date == "วันนี้": df_show = df_show[df_show['วันที่'] == get_thai_date()]
-        elif f_date == "เดือนนี้": 
-            t = get_thai_date()
-            df_show = df_show[(pd.to_datetime(df_show['วันที่']).dt.month == t.month) & (pd.to_datetime(df_show['วันที่']).dt.year == t.year)]
+        if f_date == "วันนี้": df_show = ledger.slice_range(df_show, get_thai_date(), get_thai_date())
+        elif f_date == "เดือนนี้":
+            m_start, m_end, _ = analytics.period_range("เดือนนี้", get_thai_date())
+            df_show = ledger.slice_range(df_show, m_start, m_end)
+
+        # แสดงทีละหน้า (ค่าเริ่มต้นคือหน้าล่าสุด) ตารางใหญ่จึงไม่ต้องส่งทั้ง ledger ไปที่เบราว์เซอร์
+        n_pages = -(-len(df_show) // EDITOR_PAGE_SIZE)
+        page = st.number_input(f"หน้า (ทั้งหมด {n_pages:,} หน้า / {len(df_show):,} รายการ)", 1, n_pages, n_pages) if n_pages > 1 else 1
+        page_df = df_show.iloc[(page - 1) * EDITOR_PAGE_SIZE:page * EDITOR_PAGE_SIZE]
+
+        # ระหว่างที่มีการแก้ค้างในตาราง แสดงสำเนาเดิมต่อ (ตรึงไว้ใน session) แม้เครื่อง/แท็บอื่นบันทึกเข้ามา
+        # ตารางจึงไม่ถูกรีเซ็ตจนการแก้หาย; ตอนบันทึก save_edits รวมกับ ledger ปัจจุบันด้วยรหัสแถว
+        key = f"editor_{f_date}_{f_app}_{f_cat}_{page}"
+        pinned = st.session_state.get("editor_pinned")
+        pending = st.session_state.get(key)
+        if pinned and pinned[0] == key and isinstance(pending, dict) and any(pending.get(k) for k in ("edited_rows", "added_rows", "deleted_rows")):
+            _, version, page_df = pinned
+        else:
+            version = get_book().version
+            st.session_state.editor_pinned = (key, version, page_df)
 
         edited_df = st.data_editor(
-            df_show, 
+            ledger.to_display(page_df),
             num_rows="dynamic", 
             use_container_width=True, 
-            key="editor",
+            key=key,
             column_config={
                 "คงเหลือ/สุทธิ": st.column_config.NumberColumn(format="%.2f ฿"),
                 "ยอดเต็ม/หน้าแอป": st.column_config.NumberColumn(format="%.2f ฿"),
-                "วันที่": st.column_config.DateColumn(format="YYYY-MM-DD")
+                "วันที่": st.column_config.DateColumn(format="YYYY-MM-DD"),
+                ledger.ROW_ID: None,
             }
         )
         
         if st.button("💾 บันทึกการเปลี่ยนแปลง", type="primary"):
             try:
-                if len(df_show) != len(st.session_state.data):
-                      st.warning("⚠️ คุณกำลังกรองข้อมูลอยู่ ระบบจะบันทึกเฉพาะข้อมูลที่เห็นเท่านั้น")
-                      st.session_state.data.update(edited_df)
+                merged = get_book().version != version
+                n_changed = get_data().save_edits(page_df, ledger.from_sheet(edited_df))
+                if n_changed:
+                    st.session_state.pop("editor_pinned", None)
+                    st.success(f"บันทึกสำเร็จ! ({n_changed} รายการ)"
+                               + (" รวมกับข้อมูลที่บันทึกจากเครื่องอื่นระหว่างแก้แล้ว" if merged else ""))
+                    st.rerun()
                 else:
-                      st.session_state.data = edited_df
-                
-                save_data(st.session_state.data)
-                st.success("บันทึกสำเร็จ!")
-                st.rerun()
+                    st.info("ไม่มีการเปลี่ยนแปลง")
             except Exception as e: st.error(f"Error: {e}")
     else:
         st.info("ไม่มีข้อมูลให้แสดง")
 
+with tab3:
+    if tab3.open:
+        database_tab()
 
+# ==========================================
+# TAB 4: ภาพรวมทีม (ผลจาก fleet.py)
+# ==========================================
+# อ่านผลรอบล่าสุดที่ fleet.py เขียนไว้ (ปกติรันทุกคืน) ไม่คำนวณของทุกคนใน rerun ของแอป
+@st.fragment
+@perf.run("fleet")
+def fleet_tab(config):
+    import plotly.express as px
+    st.subheader("🏁 ภาพรวมทีม")
+    out = config.get("out", "fleet_reports")
+    result = fleet.read_results(out)
+    period = result["period"] if result else "เดือนนี้"
+    if st.button(f"🔄 คำนวณใหม่ ({period})", help="คำนวณรายงานของคนขับทุกคนตอนนี้ (ปกติรันทุกคืนด้วย python fleet.py)"):
+        custom = result if period == "กำหนดเอง" else {}
+        with st.spinner("กำลังคำนวณรายงานของคนขับทุกคน..."):
+            result = fleet.build(get_storage_config(), out, period, custom.get("start"), custom.get("end"),
+                                 workers=config.get("workers"), today=get_thai_date())
+    if result is None:
+        st.info("ยังไม่มีผล: ตั้งให้รัน python fleet.py ทุกคืน หรือกดคำนวณใหม่")
+        return
+
+    st.caption(f"ช่วง{result['period']} ({result['start']} ถึง {result['end']}) · คำนวณเมื่อ {result['created']} · "
+               f"{result['drivers']} คนขับ ใน {result['seconds']:,.1f} วินาที")
+    rank = pd.DataFrame(result["ranking"])
+    if not rank.empty:
+        rank['driver'] = rank['driver'].replace('', '(ค่าเริ่มต้น)')
+        rank = rank.rename(columns={'driver': 'คนขับ'})
+        money = {c: st.column_config.NumberColumn(format="%.0f") for c in ['กำไรสุทธิ', 'รายรับรวม', 'รายจ่ายรวม', 'เงินสดเข้าตัว', 'เป้ารายรับ']}
+        st.dataframe(rank, hide_index=True, use_container_width=True, column_config={
+            **money,
+            'ชั่วโมงขับ': st.column_config.NumberColumn(format="%.1f"),
+            'บาท/กม.': st.column_config.NumberColumn(format="%.2f"),
+            'บาท/ชม.': st.column_config.NumberColumn(format="%.0f"),
+            'ทำได้ (%)': st.column_config.ProgressColumn(min_value=0, max_value=100, format="%.0f%%"),
+        })
+        plot("fleet", px.bar(rank.iloc[::-1], x=fleet.RANK_BY, y='คนขับ', orientation='h', text_auto='.0f',
+                             title=f"💰 {fleet.RANK_BY}รายคน"))
+    else:
+        st.info("ไม่พบคนขับใน backend")
+    for driver, error in result["errors"].items():
+        st.warning(f"{driver or '(ค่าเริ่มต้น)'}: คำนวณไม่สำเร็จ ({error})")
+
+if fleet_tabs:
+    with fleet_tabs[0]:
+        if fleet_tabs[0].open:
+            fleet_tab(fleet_config)
+
+# --- PERF PANEL ---
+# เวลาแต่ละขั้นของ rerun นี้ (ไม่รวมตัวแผง) และ rerun ก่อนหน้า เช่นรอบที่กดบันทึกก่อน st.rerun
+# fragment ที่ rerun เดี่ยว ๆ (tab2/tab3) ไม่ขึ้นในแผงนี้ แต่ถูกเขียนลงไฟล์ metrics แยกเป็น run ของตัวเอง
+def perf_table(rec):
+    rows = [{"ขั้นตอน": "· " * depth + name, "ครั้ง": n, "ms": total * 1000} for name, depth, n, total in rec.breakdown()]
+    if rows:
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True,
+                     column_config={"ms": st.column_config.NumberColumn(format="%.1f")})
+    if rec.cache:
+        st.caption("cache hit: " + ", ".join(f"{name} {hit}/{hit + miss}" for name, (hit, miss) in rec.cache.items()))
 
-
-
+with st.sidebar:
+    st.divider()
+    if st.toggle("⏱️ แสดงเวลาแต่ละขั้น", key="perf_panel"):
+        rec = st.session_state.perf
+        st.caption(f"rerun นี้ {rec.elapsed() * 1000:,.0f} ms · เปิดแอปจนเห็นฟอร์ม {st.session_state.startup_ms:,.0f} ms")
+        perf_table(rec)
+        books = get_books()
+        loaded = books.stats()
+        st.caption(f"ledger ใน memory {books.total() / 2**20:,.1f} / {books.max_bytes / 2**20:,.0f} MB · {len(loaded)} คนขับ · evict {books.evictions} ครั้ง")
+        prev = st.session_state.perf_prev
+        if prev is not None and prev.spans:
+            with st.expander(f"rerun ก่อนหน้า ({prev.total * 1000:,.0f} ms)"):
+                perf_table(prev)
+
+perf.end(st.session_state.perf)
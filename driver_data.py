@@ -0,0 +1,246 @@
+import datetime
+
+import pandas as pd
+
+import analytics
+import ledger
+import perf
+import sync
+
+# --- DRIVER DATA (โหลด/บันทึก ledger ของคนขับหนึ่งคน ไม่พึ่ง Streamlit) ---
+# driver_app สร้างจาก resource ของคนขับในเซสชันทุกครั้งที่ใช้ (storage / sync worker / RemoteLedger / DriverBook)
+# bench.py เรียกตัวเดียวกันกับชีตปลอม เวลาที่วัดได้จึงเป็นของโค้ดที่แอปรันจริง
+# ข้อความผิดพลาดที่ต้องแจ้งผู้ใช้ส่งผ่าน on_error (ในแอปคือ st.error) แล้วทำงานใน memory ต่อเหมือนเดิม
+# ไม่ส่ง on_error (เช่น bench) = raise RuntimeError ไม่ให้ความผิดพลาดหายเงียบ
+#
+# ledger / rollup / live state / memo อยู่ใน DriverBook ใน LRU ของ process (BookCache) ไม่ได้อยู่ใน session_state
+# หน่วยความจำจึงโตตามจำนวนคนขับ ไม่ใช่จำนวนแท็บ; รวมเกิน cache_mb คนขับที่ไม่ได้ใช้นานสุดถูก unload
+# แล้วโหลดใหม่จาก backend + outbox เมื่อกลับมาใช้
+#
+# LAZY LOADING (พาร์ทิชันรายเดือน): โหลดเดือนก่อนหน้า + เดือนนี้ตอนเริ่ม (loaded_from = วันแรกของเดือนที่โหลดแล้ว)
+# ตัวกรองที่ย้อนไปก่อนหน้านั้นจึงโหลดเดือนที่ขาดมาต่อ (ช่วงที่โหลดต่อเนื่องถึงปัจจุบันเสมอ)
+# backend ที่ไม่แบ่งพาร์ทิชันโหลดทั้ง ledger ทีเดียว (loaded_from = None)
+
+
+def month_start(d):
+    return pd.Timestamp(d).normalize().replace(day=1)
+
+
+class DriverData:
+    def __init__(self, book, store, worker, remote, versions, books=None, today=datetime.date.today, on_error=None):
+        self.book = book
+        self.store = store
+        self.worker = worker
+        self.remote = remote
+        self.versions = versions
+        self.books = books
+        self.today = today  # () -> วันที่ปัจจุบัน (แอปใช้เวลาไทย)
+        self.on_error = on_error
+
+    def _error(self, message):
+        if self.on_error is None:
+            raise RuntimeError(message)
+        self.on_error(message)
+
+    # --- LOAD ---
+    @perf.timed("load_and_clean_data")
+    def load_and_clean_data(self, start=None, end=None, full=False):
+        # start/end: ช่วงเดือนที่ต้องการ (แบ่งพาร์ทิชันรายเดือน) อ่านเฉพาะพาร์ทิชันที่ทับช่วงนี้
+        with self.worker.lock:  # กันไม่ให้ worker ส่ง/ลบ outbox ระหว่างอ่าน
+            pending = self.worker.outbox.pending()
+            try:
+                frame = self.remote.get(self.versions.get(self.store.worksheet), self.store.partitions(start, end), full=full)
+            except Exception as e:
+                # ไม่มีสำเนาเดิมให้ใช้: แสดงเฉพาะรายการใน outbox พร้อมเตือน และห้ามเขียนทับทั้งชีต (save_data)
+                self.book.load_error = e
+                frame = ledger.empty()
+        return sync.replay(frame, pending, start, end)
+
+    def account(self, new_rows=0):
+        # วัดขนาดจริงหลังโหลด/แก้แบบ bulk (new_rows=0); ตอนเพิ่มแถวประมาณจากขนาดเฉลี่ยต่อแถว แล้ว trim LRU
+        if new_rows:
+            self.book.grow(new_rows)
+        else:
+            self.book.measure(extra=self.remote.nbytes())
+        if self.books is not None:
+            self.books.trim(keep=self.book.driver)
+
+    def load_book(self):
+        # โหลดครั้งแรกของคนขับ (หรือหลังถูก unload): เซสชันที่มาพร้อมกันรอ lock แล้วใช้ผลเดียวกัน
+        book = self.book
+        with book.lock:
+            loaded = book.loaded
+        if loaded:
+            if self.books is not None:
+                self.books.trim(keep=book.driver)  # คนขับอื่นที่ไม่ได้ใช้เกิน min_idle ถูกปล่อยแม้ไม่มีใครโหลดใหม่
+            return
+        with book.lock:
+            if book.loaded:
+                return
+            book.loaded_from = self.initial_load_start()
+            book.load_error = None
+            book.ledger = ledger.Ledger(self.load_and_clean_data(book.loaded_from))
+            book.rollup = self.load_rollup(book.ledger.frame)
+            self.rebuild_live_state()
+            if book.live["last_shift_ts"] is None:
+                self.ensure_loaded(None)  # ยังไม่เจอกะงานในเดือนที่โหลด: ต้องใช้ประวัติเก่าหาสถานะ/เลขไมล์ล่าสุด
+            book.version += 1
+        self.account()
+
+    def reload_book(self, full=False):
+        # อ่าน ledger ใหม่จาก backend (ช่วงเดือนเดิม) แทนของใน memory: ขึ้นรุ่นก่อน cache จึงดึงแถวที่เพิ่มมา
+        book = self.book
+        with book.lock:
+            self.bump_data_version()
+            book.load_error = None
+            book.ledger.replace(self.load_and_clean_data(book.loaded_from, full=full))
+            book.rollup = self.load_rollup(book.ledger.frame)
+            self.rebuild_live_state()
+        self.account()
+
+    def initial_load_start(self):
+        if not self.store.partitioned:
+            return None
+        return month_start(month_start(self.today()) - datetime.timedelta(days=1))
+
+    def ensure_loaded(self, start):
+        book = self.book
+        with book.lock:
+            loaded_from = book.loaded_from
+            if loaded_from is None or (start is not None and month_start(start) >= loaded_from):
+                return
+            start = None if start is None else month_start(start)
+            older = self.load_and_clean_data(start, loaded_from - datetime.timedelta(days=1))
+            if book.load_error is not None:
+                return  # ยังโหลดไม่ได้: ไม่เลื่อน loaded_from ครั้งหน้าลองใหม่
+            book.loaded_from = start
+            if older.empty:
+                return
+            book.ledger.merge(older)
+            self.update_rollup(set(older['วันที่'].dropna()))
+            self.rebuild_live_state()
+            book.version += 1
+        self.account()
+
+    def save_scope(self, df):
+        # เดือนที่ save_data เขียนทับได้: เฉพาะเดือนที่โหลดมาครบ (None = ทั้ง ledger)
+        loaded_from = self.book.loaded_from
+        if loaded_from is None:
+            return None
+        first = loaded_from.strftime('%Y-%m')
+        months = {p.month for p in self.store.partitions(loaded_from)}
+        months |= set(ledger.month_keys(df).dropna())
+        months.add(self.today().strftime('%Y-%m'))
+        return sorted(m for m in months if m >= first)
+
+    # --- DATA VERSION ---
+    # ทุกครั้งที่ ledger เปลี่ยน: bump รุ่นของ worksheet (cache ร่วม) และรุ่นของ DriverBook (memo ของแดชบอร์ด)
+    def bump_data_version(self):
+        self.versions.bump(self.store.worksheet)
+        self.book.version += 1
+
+    # --- ROLLUP รายวัน (อัปเดตตามแถวที่เพิ่ม/แก้ไข) ---
+    def load_rollup(self, df):
+        try:
+            rollup = self.store.read_rollup(len(df))
+        except Exception:
+            rollup = None
+        perf.cache("rollup", rollup is not None)
+        if rollup is None:
+            rollup = analytics.build_rollup(df)
+            try:
+                self.store.write_rollup(rollup, len(df))
+            except Exception:
+                pass
+        return rollup
+
+    def update_rollup(self, days=None):
+        book = self.book
+        if days is None:
+            book.rollup = analytics.build_rollup(book.ledger.frame)
+        else:
+            # อ่านเฉพาะช่วงวันที่เกี่ยวข้อง (±1 วัน) ไม่ต้องรวม pending เข้าตารางหลัก
+            one_day = datetime.timedelta(days=1)
+            rows = book.ledger.rows_between(min(days) - one_day, max(days) + one_day)
+            book.rollup = analytics.refresh_rollup(book.rollup, rows, days)
+        try:
+            self.store.write_rollup(book.rollup, len(book.ledger), days)
+        except Exception:
+            pass
+
+    # --- LIVE STATE (สถานะกะ / เลขไมล์ / รายได้วันนี้) ---
+    def rebuild_live_state(self):
+        self.book.live = ledger.build_live_state(self.book.frame(), self.today())
+
+    def get_live_state(self):
+        book = self.book
+        with book.lock:
+            if book.live is None or book.live["today"] != pd.Timestamp(self.today()):  # ข้ามวัน: เริ่มนับรายได้ใหม่
+                self.rebuild_live_state()
+            return book.live
+
+    # --- SAVE ---
+    def save_data(self, df, everything=False):
+        # เขียนทับทั้งชีต: ใช้กับการแก้ไขแบบ bulk เท่านั้น (ตารางฐานข้อมูล / ล้างข้อมูล)
+        # everything=True เขียนทับทุกเดือน ไม่ใช่เฉพาะที่โหลดไว้
+        book = self.book
+        if book.load_error is not None:
+            self._error("โหลดข้อมูลจาก Cloud ไม่สำเร็จ: ข้อมูลที่เห็นไม่ครบ ยังเขียนทับไม่ได้ (กด 🔄 รีเฟรชข้อมูล แล้วลองใหม่)")
+            return False
+        with book.lock:
+            if everything:
+                book.loaded_from = None
+            try:
+                self.worker.submit(sync.OVERWRITE, ledger.to_sheet(df), scope=self.save_scope(df))
+            except Exception as e:
+                self._error(f"บันทึกไม่สำเร็จ: {e}")
+            book.ledger.replace(df)
+            self.update_rollup()
+            self.rebuild_live_state()
+            self.bump_data_version()
+        self.account()
+        return True
+
+    def save_edits(self, before, after):
+        # บันทึกจากตารางแก้ไข: ส่งเฉพาะแถวที่แก้/ลบ/เพิ่ม เป็นคู่ (แถวเดิม, แถวใหม่) แทนการเขียนทับทั้งชีต
+        # before = สำเนาที่ตารางแสดงตอนเริ่มแก้: ระหว่างนั้นเครื่อง/แท็บอื่นอาจบันทึกไปแล้ว
+        # จึงใส่ใน ledger แบบเดียวกับ backend (หาแถวด้วยรหัสแถว + รวมเฉพาะช่องที่แก้) ไม่ใช่ตามตำแหน่งแถว
+        _, _, pairs = ledger.diff_rows(before, after)
+        if not pairs:
+            return 0
+        pairs = ledger.assign_ids(pairs)
+        book = self.book
+        with book.lock:
+            try:
+                self.worker.submit(sync.EDIT, pairs)
+            except Exception as e:
+                self._error(f"บันทึกไม่สำเร็จ: {e}")
+            current = book.frame()
+            touched = current[current[ledger.ROW_ID].isin(ledger.pair_ids(pairs))]
+            frame = book.ledger.edit(pairs)
+            if book.loaded_from is not None and (frame['วันที่'] < book.loaded_from).any():
+                # แถวที่ถูกแก้วันที่ไปก่อนช่วงที่โหลดไว้ ไม่ใส่ใน ledger (จะมากับพาร์ทิชันนั้นตอนโหลดเพิ่ม)
+                book.ledger.replace(frame[~(frame['วันที่'] < book.loaded_from)])
+            rows = ledger.from_records([row for pair in pairs for row in pair if row is not None])
+            days = set(touched['วันที่'].dropna()) | set(rows['วันที่'].dropna())
+            self.update_rollup(days or None)
+            self.rebuild_live_state()
+            self.bump_data_version()
+        self.account()
+        return len(pairs)
+
+    def append_data(self, records):
+        # บันทึกรายการใหม่: ส่งเฉพาะแถวที่เพิ่ม (รับ record เดียวหรือ list ของ record จาก ledger.make_record)
+        book = self.book
+        with book.lock:
+            live = self.get_live_state()
+            new_rows = book.ledger.append(records)
+            try:
+                self.worker.submit(sync.APPEND, ledger.to_sheet(new_rows))
+            except Exception as e:
+                self._error(f"บันทึกไม่สำเร็จ: {e}")
+            self.update_rollup(set(new_rows['วันที่'].dropna()))
+            ledger.apply_live_events(live, new_rows)
+            self.bump_data_version()
+        self.account(len(new_rows))
+        return new_rows
@@ -0,0 +1,142 @@
+import time
+
+import pandas as pd
+
+# --- ตัวจำลอง GSheetsConnection (ใช้ทดสอบ/วัดผลแบบออฟไลน์) ---
+# เก็บแต่ละ worksheet เป็นตาราง list-of-lists (แถวแรกคือหัวคอลัมน์) เหมือนชีตจริง
+# และนับจำนวนเซลล์ที่ถูกส่งไป เพื่อเทียบต้นทุนการเขียนแต่ละแบบ
+# latency: หน่วงทุกการเรียก API (วินาที) จำลองเวลารับส่งกับ Google Sheets
+
+
+class WorksheetNotFound(Exception):
+    # ชื่อเดียวกับ gspread.WorksheetNotFound (storage แยกด้วยชื่อคลาส)
+    pass
+
+
+def _cell(ref):
+    # "N5" -> (14, 5); ไม่มีเลขแถว -> แถวสุดท้าย (None)
+    letters = ref.rstrip("0123456789")
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch) - ord('A') + 1
+    return col, int(ref[len(letters):]) if ref[len(letters):] else None
+
+
+class FakeWorksheet:
+    def __init__(self, owner, title):
+        self.owner = owner
+        self.title = title
+        self.values = []
+
+    def row_values(self, row):
+        self.owner.api(("row_values", self.title, row))
+        if len(self.values) < row:
+            return []
+        return list(self.values[row - 1])
+
+    def _range(self, range_name):
+        # "A2:M" (ถึงแถวสุดท้าย) / "A5:M5" / "N2:N" / "N5" ค่าที่ได้เป็นข้อความเหมือน FORMATTED_VALUE
+        start, _, end = range_name.partition(":")
+        (c1, r1), (c2, r2) = _cell(start), _cell(end or start)
+        return [["" if v is None else str(v) for v in row[c1 - 1:c2]] for row in self.values[r1 - 1:r2]]
+
+    def get_values(self, range_name):
+        self.owner.api(("get_values", self.title, range_name))
+        return self._range(range_name)
+
+    def batch_get(self, ranges):
+        self.owner.api(("batch_get", self.title, len(ranges)))
+        return [self._range(r) for r in ranges]
+
+    def append_rows(self, values, value_input_option="RAW"):
+        self.values.extend([list(v) for v in values])
+        self.owner.cells_sent += sum(len(v) for v in values)
+        self.owner.api(("append_rows", self.title, len(values)))
+
+    def batch_update(self, data, value_input_option="RAW"):
+        # รองรับ range แบบ "A{แถว}:{คอลัมน์}{แถว}" (ทีละแถว)
+        for item in data:
+            row = int(item["range"].split(":")[0].lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+            for offset, values in enumerate(item["values"]):
+                self.values[row - 1 + offset] = list(values)
+                self.owner.cells_sent += len(values)
+        self.owner.api(("batch_update", self.title, len(data)))
+
+    def delete_rows(self, start_index, end_index=None):
+        end_index = start_index if end_index is None else end_index
+        del self.values[start_index - 1:end_index]
+        self.owner.api(("delete_rows", self.title, end_index - start_index + 1))
+
+    def clear(self):
+        self.values = []
+
+
+class FakeGSheetsClient:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def _select_worksheet(self, worksheet=None, **kwargs):
+        # ของจริง: เปิด spreadsheet แล้วหา worksheet (2 API call ทุกครั้ง)
+        return self._open_spreadsheet().worksheet(worksheet)
+
+    def _open_spreadsheet(self, **kwargs):
+        self.owner.api(("open_spreadsheet",))
+        return self
+
+    def worksheet(self, title):
+        # gspread.Spreadsheet.worksheet (ตัวที่ _open_spreadsheet คืน)
+        self.owner.api(("worksheet", title))
+        if title not in self.owner.sheets:
+            raise WorksheetNotFound(title)
+        return self.owner.sheets[title]
+
+    def worksheets(self):
+        self.owner.api(("worksheets",))
+        return list(self.owner.sheets.values())
+
+
+class FakeGSheetsConnection:
+    def __init__(self, worksheets=None, latency=0.0):
+        self.sheets = {}
+        self.cells_sent = 0
+        self.calls = []
+        self.latency = 0.0
+        self.client = FakeGSheetsClient(self)
+        for name, df in (worksheets or {}).items():
+            self.update(worksheet=name, data=df)
+        self.cells_sent = 0
+        self.calls = []
+        self.latency = latency
+
+    def api(self, call):
+        # ทุกการเรียกที่จะวิ่งไป Google จริง: บันทึกไว้ใน calls แล้วหน่วงตาม latency
+        self.calls.append(call)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def worksheet(self, name):
+        # update/create สร้าง worksheet ให้ถ้ายังไม่มี (อ่าน/_select_worksheet ไม่สร้าง เหมือนของจริง)
+        if name not in self.sheets:
+            self.sheets[name] = FakeWorksheet(self, name)
+        return self.sheets[name]
+
+    def read(self, worksheet=None, ttl=None, **kwargs):
+        self.api(("read", worksheet))
+        if worksheet not in self.sheets:
+            raise WorksheetNotFound(worksheet)
+        values = self.sheets[worksheet].values
+        if not values:
+            return pd.DataFrame()
+        header, rows = values[0], values[1:]
+        return pd.DataFrame(rows, columns=header)
+
+    def create(self, worksheet=None, data=None, **kwargs):
+        return self.update(worksheet=worksheet, data=data)
+
+    def update(self, worksheet=None, data=None, **kwargs):
+        ws = self.worksheet(worksheet)
+        df = pd.DataFrame(data)
+        ws.values = [list(df.columns)] + df.astype(object).where(df.notna(), "").values.tolist()
+        self.cells_sent += df.size + len(df.columns)
+        self.api(("update", worksheet, len(df)))
+        return df
@@ -0,0 +1,194 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import analytics
+import ledger
+import storage
+import sync
+
+# --- FLEET REPORTS (รายงานของคนขับทุกคน) ---
+# รัน (เช่น cron ทุกคืน): python fleet.py --period เดือนนี้ --out fleet_reports
+# คนขับหนึ่งคน = งานหนึ่งชิ้นใน process pool: อ่าน ledger ของตัวเอง (backend + outbox ในเครื่อง) แล้วคำนวณ analytics.report
+# งาน pandas จึงกระจายได้ทุกคอร์ และการรอชีตของคนขับหลายคนเกิดพร้อมกัน
+# ผลใน out: ranking.<ext> (คนขับละแถว) + <ตาราง>.<ext> ของทุกคนต่อกัน (คอลัมน์ driver) + fleet.json (ข้อมูลรอบ + อันดับ)
+RANK_BY = 'กำไรสุทธิ'
+TABLES = ("daily", "gp", "heatmap", "income_by_app", "expenses")
+PERIODS = ["วันนี้", "เมื่อวาน", "สัปดาห์นี้", "เดือนนี้", "เดือนที่แล้ว", "ปีนี้"]
+
+_conn = None
+
+
+def _connection():
+    # connection ของชีต 1 ตัวต่อ process (worker แต่ละตัวสร้างเองตอนอ่านครั้งแรก)
+    global _conn
+    if _conn is None:
+        def connect():
+            import streamlit as st
+            from streamlit_gsheets import GSheetsConnection
+            return st.connection("gsheets", type=GSheetsConnection)
+        _conn = storage.SharedConnection(connect)
+    return _conn
+
+
+def load_config():
+    # [storage] ใน .streamlit/secrets.toml เหมือนแอป
+    try:
+        import streamlit as st
+        return storage.storage_config(st.secrets.get("storage", {}))
+    except Exception:
+        return storage.storage_config()
+
+
+def thai_today():
+    return datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=7))).date()
+
+
+def load_driver(config, driver, start=None, end=None, gsheets_conn=None):
+    # ledger ช่วง [start, end + 1 วัน] (กะที่เลิกหลังเที่ยงคืนของวันสุดท้าย) + รายการใน outbox เครื่องนี้ที่ยังไม่ได้ส่ง
+    store = storage.open_storage(config, gsheets_conn or _connection, driver)
+    until = None if end is None else pd.Timestamp(end) + datetime.timedelta(days=1)
+    frame = ledger.sort_by_time(ledger.from_sheet(store.read(start, until)))
+    outbox = storage.driver_path(config.get("outbox", "driver_outbox.db"), driver)
+    if os.path.exists(outbox):
+        frame = sync.replay(frame, sync.Outbox(outbox).pending(), start, until)
+    return frame, storage.SettingsStore(store).get()
+
+
+def driver_report(job):
+    # งานหนึ่งชิ้นใน pool: job = (config, driver, start, end, days_count); คนขับที่อ่านไม่ได้คืน error แทนการล้มทั้งรอบ
+    config, driver, start, end, days_count = job
+    try:
+        frame, settings = load_driver(config, driver, start, end)
+        rep = analytics.report(frame, start, end, settings["target_income"], days_count)
+    except Exception as e:
+        return {"driver": driver, "error": f"{type(e).__name__}: {e}"}
+    return {"driver": driver, "rows": len(frame), **rep}
+
+
+def run_reports(config, drivers, start=None, end=None, days_count=1, workers=None):
+    # workers=None = ทุกคอร์; ใช้ spawn เสมอ: fork จาก process ที่มี thread อยู่แล้ว (แอป/sync worker) อาจค้าง
+    jobs = [(config, d, start, end, days_count) for d in drivers]
+    if workers == 1 or len(jobs) <= 1:
+        return [driver_report(job) for job in jobs]
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        return list(pool.map(driver_report, jobs))
+
+
+def ranking(reports, by=RANK_BY):
+    rows = [{"driver": r["driver"], **r["summary"]} for r in reports if "summary" in r]
+    rank = pd.DataFrame(rows, columns=["driver"] + analytics.SUMMARY_COLS)
+    rank = rank.sort_values(by, ascending=False, kind="stable").reset_index(drop=True)
+    rank.insert(0, "อันดับ", range(1, len(rank) + 1))
+    return rank
+
+
+def _long(name, table):
+    # heatmap เป็นตารางกว้าง (แอป x ชั่วโมง): แปลงเป็นแถวละค่า ต่อกันข้ามคนขับได้
+    if name == "heatmap":
+        return table.stack().rename('คงเหลือ/สุทธิ').reset_index()
+    return table
+
+
+def table_format(fmt):
+    # parquet ต้องมี pyarrow (ไม่ได้อยู่ใน requirements ของแอป): ไม่มีก็เขียน JSON แทน
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return "json"
+    return fmt
+
+
+def write_reports(out_dir, reports, meta, fmt="parquet"):
+    os.makedirs(out_dir, exist_ok=True)
+    fmt = table_format(fmt)
+
+    def save(df, name):
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        if fmt == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.to_json(path, orient="records", force_ascii=False, date_format="iso")
+
+    rank = ranking(reports)
+    save(rank, "ranking")
+    for name in TABLES:
+        frames = [_long(name, r[name]).assign(driver=r["driver"]) for r in reports if name in r]
+        frames = [f for f in frames if not f.empty]
+        if frames:
+            save(pd.concat(frames, ignore_index=True), name)
+    payload = {
+        **meta,
+        "format": fmt,
+        "drivers": len(reports),
+        "ranking": json.loads(rank.to_json(orient="records", force_ascii=False)),
+        "errors": {r["driver"]: r["error"] for r in reports if "error" in r},
+    }
+    # เขียนไฟล์ชั่วคราวแล้ว replace: หน้าภาพรวมทีมที่อ่านอยู่ไม่เห็นไฟล์ครึ่ง ๆ
+    tmp = os.path.join(out_dir, "fleet.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(out_dir, "fleet.json"))
+    return payload
+
+
+def read_results(out_dir):
+    try:
+        with open(os.path.join(out_dir, "fleet.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build(config, out_dir, period="เดือนนี้", start=None, end=None, drivers=None, workers=None,
+          fmt="parquet", today=None):
+    # ทั้งรอบ: หาคนขับ -> คำนวณใน pool -> เขียนผล (ใช้ทั้ง CLI และปุ่มคำนวณใหม่ในหน้าภาพรวมทีม)
+    if start is None and end is None:
+        start, end, days_count = analytics.period_range(period, today or thai_today())
+    else:
+        period = "กำหนดเอง"
+        start, end, days_count = analytics.period_range(period, today or thai_today(), start, end)
+    if drivers is None:
+        drivers = storage.list_drivers(config, _connection)
+    t0 = time.perf_counter()
+    reports = run_reports(config, drivers, start, end, days_count, workers)
+    meta = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "period": period,
+        "start": None if start is None else start.date().isoformat(),
+        "end": None if end is None else end.date().isoformat(),
+        "workers": workers or os.cpu_count(),
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+    return write_reports(out_dir, reports, meta, fmt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="คำนวณรายงานแดชบอร์ดของคนขับทุกคนแบบขนาน")
+    parser.add_argument("--period", choices=PERIODS, default="เดือนนี้")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, help="วันเริ่ม (YYYY-MM-DD) ใช้คู่กับ --end แทน --period")
+    parser.add_argument("--end", type=datetime.date.fromisoformat)
+    parser.add_argument("--drivers", nargs="+", help="รหัสคนขับ (ค่าเริ่มต้น = ทุกคนใน backend)")
+    parser.add_argument("--workers", type=int, help="จำนวน process (ค่าเริ่มต้น = จำนวนคอร์)")
+    parser.add_argument("--out", default="fleet_reports")
+    parser.add_argument("--format", choices=["parquet", "json"], default="parquet")
+    args = parser.parse_args()
+    if (args.start is None) != (args.end is None):
+        parser.error("--start กับ --end ต้องใส่คู่กัน")
+
+    drivers = None if args.drivers is None else [storage.driver_id(d) for d in args.drivers]
+    result = build(load_config(), args.out, args.period, args.start, args.end, drivers, args.workers, args.format)
+    print(f"# fleet {result['period']} {result['start']} - {result['end']}: "
+          f"{result['drivers']} คนขับ, {result['seconds']:.1f} s, {result['workers']} process -> {args.out} ({result['format']})")
+    print(pd.DataFrame(result["ranking"]).to_string(index=False))
+    for driver, error in result["errors"].items():
+        print(f"! {driver or '(ค่าเริ่มต้น)'}: {error}", file=sys.stderr)
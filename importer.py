@@ -0,0 +1,237 @@
+import codecs
+import csv
+import io
+import itertools
+import re
+
+import numpy as np
+import pandas as pd
+
+import ledger
+import perf
+from storage import LEDGER_COLS, ROW_ID
+
+# --- IMPORT (ไฟล์สรุปรายได้จากแอป) ---
+# อ่าน CSV / XLSX ทีละ chunk (CHUNK_ROWS แถว) ไม่โหลดทั้งไฟล์: CSV ใช้ read_csv(chunksize), XLSX ใช้ openpyxl แบบ read_only
+# แต่ละ chunk: จับคอลัมน์ของแอปเข้ากับ ledger -> ตัดแถวที่มีอยู่แล้ว (hash ของเนื้อหาแถว) -> บันทึกทีเดียวทั้ง batch
+# งานที่นำเข้าเป็น รายรับ / ค่าโดยสาร ความหมายของแต่ละช่องเหมือนฟอร์ม "🚗 รับงาน"
+CHUNK_ROWS = 5000
+HEADER_SCAN_ROWS = 20  # ไฟล์ export บางแอปมีหัวรายงานก่อนแถวชื่อคอลัมน์
+CASH = '💵 เงินสด/โอน'
+CARD = '💳 ตัดบัตร/แอป'
+
+# ชื่อคอลัมน์ (ตัวเล็ก ไม่มีหน่วยในวงเล็บ) -> ช่องของรายการ; ของแอปเช็กก่อนชื่อกลาง
+# ชื่อมาจากไฟล์ export ที่เคยเจอ: แอปเปลี่ยนรูปแบบเมื่อไรเพิ่มชื่อใหม่ที่นี่
+COMMON_COLUMNS = {
+    "when": ["date/time", "datetime", "date time", "completed at", "วันที่/เวลา", "วันเวลา"],
+    "date": ["date", "trip date", "order date", "วันที่"],
+    "time": ["time", "เวลา"],
+    "gross": ["fare", "gross", "gross fare", "trip fare", "ค่าโดยสาร", "ยอดเต็ม", "ราคา"],
+    "deduct": ["commission", "service fee", "platform fee", "ค่าคอมมิชชั่น", "ค่าธรรมเนียม", "ค่าบริการ"],
+    "tip": ["tip", "tips", "ทิป"],
+    "net": ["net earnings", "net", "earnings", "total earnings", "รายได้สุทธิ", "ยอดสุทธิ", "รายได้"],
+    "payment": ["payment method", "payment type", "payment", "วิธีชำระเงิน", "การชำระเงิน", "ช่องทางชำระเงิน"],
+    "ref": ["trip id", "order id", "job id", "รหัสงาน", "หมายเลขคำสั่งซื้อ"],
+}
+PROFILES = {
+    "Grab": {
+        "when": ["booking time", "date & time"],
+        "gross": ["fare amount"],
+        "deduct": ["grab commission", "commission fee"],
+        "ref": ["booking id", "booking code"],
+    },
+    "Bolt": {
+        "when": ["ride date", "order created"],
+        "gross": ["ride price", "trip price"],
+        "deduct": ["bolt fee", "booking fee"],
+        "ref": ["ride id", "order number"],
+    },
+    "Line Man": {
+        "when": ["order time", "เวลาสั่งซื้อ"],
+        "gross": ["delivery fee", "ค่าส่ง", "ค่าจัดส่ง"],
+        "deduct": ["gp", "ค่า gp"],
+        "ref": ["order no", "เลขที่ออเดอร์"],
+    },
+}
+NO_PAYMENT_COLUMN = CARD  # statement ที่ไม่มีช่องการชำระเงิน ส่วนใหญ่เป็นงานที่แอปเก็บเงินแทน
+
+
+def guess_platform(filename):
+    name = re.sub(r"[\s_\-]", "", str(filename).lower())
+    for platform in PROFILES:
+        if platform.lower().replace(" ", "") in name:
+            return platform
+    return None
+
+
+def _norm(name):
+    # "Fare (THB)" -> "fare", "  ค่าโดยสาร(บาท) " -> "ค่าโดยสาร"
+    return re.sub(r"\s+", " ", re.sub(r"\(.*?\)|[฿$:*]", "", str(name))).strip().lower()
+
+
+def column_map(columns, platform):
+    # {ช่อง: ชื่อคอลัมน์ในไฟล์}
+    by_name = {}
+    for col in columns:
+        by_name.setdefault(_norm(col), col)
+    out = {}
+    profile = PROFILES.get(platform, {})
+    for field, names in COMMON_COLUMNS.items():
+        for name in profile.get(field, []) + names:
+            if name in by_name and by_name[name] not in out.values():
+                out[field] = by_name[name]
+                break
+    return out
+
+
+def _usable(mapping):
+    return ("when" in mapping or "date" in mapping) and ("gross" in mapping or "net" in mapping)
+
+
+# --- READ (ทีละ chunk) ---
+def _find_header(rows, platform):
+    # แถวแรกใน HEADER_SCAN_ROWS แถวที่จับคอลัมน์วันที่ + ยอดเงินได้
+    for i, row in enumerate(itertools.islice(rows, HEADER_SCAN_ROWS)):
+        names = ["" if c is None else str(c) for c in row]
+        if _usable(column_map(names, platform)):
+            return i, names
+    raise ValueError("ไม่พบแถวชื่อคอลัมน์ (ต้องมีวันที่และยอดเงิน) ในไฟล์")
+
+
+def _text_stream(file):
+    # CSV จากแอปไทยมีทั้ง UTF-8 (มี/ไม่มี BOM) และ TIS-620 (cp874): ดูจากต้นไฟล์ก่อนอ่านจริง
+    raw = file.read(64 * 1024)
+    file.seek(0)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(raw)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "cp874"
+    return io.TextIOWrapper(file, encoding=encoding, newline="")
+
+
+def _csv_chunks(file, platform, chunk_rows):
+    text = _text_stream(file)
+    try:
+        skip, _ = _find_header(csv.reader(text), platform)
+        text.seek(0)
+        yield from pd.read_csv(text, skiprows=skip, dtype=str, chunksize=chunk_rows, skip_blank_lines=True)
+    finally:
+        text.detach()  # คืนไฟล์ให้ผู้เรียก (ไม่ปิด)
+
+
+def _xlsx_chunks(file, platform, chunk_rows):
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        skip, header = _find_header(wb.active.iter_rows(values_only=True), platform)
+        rows = itertools.islice(wb.active.iter_rows(values_only=True), skip + 1, None)
+        rows = (r for r in rows if any(c not in (None, "") for c in r))
+        while True:
+            batch = list(itertools.islice(rows, chunk_rows))
+            if not batch:
+                break
+            yield pd.DataFrame([r[:len(header)] for r in batch], columns=header)
+    finally:
+        wb.close()
+
+
+def read_chunks(file, filename, platform=None, chunk_rows=CHUNK_ROWS):
+    # file: path หรือ binary file object ที่ seek ได้ (เช่น st.file_uploader)
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            yield from read_chunks(f, filename, platform, chunk_rows)
+        return
+    if str(filename).lower().endswith((".xlsx", ".xlsm")):
+        yield from _xlsx_chunks(file, platform, chunk_rows)
+    else:
+        yield from _csv_chunks(file, platform, chunk_rows)
+
+
+# --- MAP (คอลัมน์ของแอป -> ledger) ---
+def _amount(values):
+    # "฿1,234.50", "-12.00", "THB 80" -> ตัวเลข; ค่าว่าง/อ่านไม่ได้ = NaN
+    if not pd.api.types.is_numeric_dtype(values):  # object หรือ str (ค่าเริ่มต้นของ pandas 3)
+        values = values.astype(str).str.replace(r"[^\d.\-]", "", regex=True)
+    return pd.to_numeric(values, errors="coerce")
+
+
+def _when(chunk, mapping):
+    if "when" in mapping:
+        values = chunk[mapping["when"]]
+    elif "time" in mapping:
+        values = chunk[mapping["date"]].astype(str) + " " + chunk[mapping["time"]].astype(str)
+    else:
+        values = chunk[mapping["date"]]
+    if values.map(type).eq(str).any():
+        # ปี พ.ศ. -> ค.ศ. (pandas รองรับถึงปี 2262)
+        values = values.astype(str).str.strip().str.replace(r"\b(25\d\d)\b", lambda m: str(int(m.group(1)) - 543), regex=True)
+        # ปีขึ้นก่อน (2024-05-03) = ISO; อื่น ๆ แบบไทย วัน/เดือน/ปี (dayfirst กับ ISO จะสลับวันกับเดือน)
+        if values.str.match(r"\d{4}-").any():
+            return pd.to_datetime(values, errors="coerce", format="ISO8601")
+        return pd.to_datetime(values, errors="coerce", dayfirst=True)
+    return pd.to_datetime(values, errors="coerce")
+
+
+@perf.timed("import.map")
+def to_ledger(chunk, platform, mapping=None):
+    # คืน (แถวรูปแบบชีต, จำนวนแถวที่ข้ามเพราะไม่มีวันที่/ยอดเงิน)
+    mapping = mapping or column_map(chunk.columns, platform)
+    if not _usable(mapping):
+        raise ValueError(f"ไฟล์ไม่มีคอลัมน์วันที่/ยอดเงินของ {platform}: {', '.join(map(str, chunk.columns))}")
+    col = lambda field: _amount(chunk[mapping[field]]) if field in mapping else pd.Series(np.nan, index=chunk.index)
+    when = _when(chunk, mapping)
+    gross, deduct, tip, net = col("gross"), col("deduct").abs(), col("tip").fillna(0).abs(), col("net")
+    # ช่องที่ไม่มีในไฟล์คำนวณจากช่องอื่น
+    gross = gross.fillna(net - tip + deduct.fillna(0))
+    net = net.fillna(gross - deduct.fillna(0) + tip)
+    deduct = deduct.fillna((gross + tip - net).clip(lower=0))
+
+    if "payment" in mapping:
+        text = chunk[mapping["payment"]].fillna("").astype(str).str.lower()
+        is_cash = text.str.contains(r"cash(?!less)|เงินสด", regex=True)  # "Cashless" ของ Grab = ตัดบัตร
+    else:
+        is_cash = pd.Series(NO_PAYMENT_COLUMN == CASH, index=chunk.index)
+    # งานเงินสด: รับจากผู้โดยสารเต็มจำนวน (ค่าคอมหักผ่านเครดิตที่เติม) เหมือนฟอร์มรับงาน
+    # หัก = 0 เหมือนฟอร์ม: ค่าคอมลงบัญชีตอนเติมเครดิตแล้ว ไม่นับซ้ำ และ ยอดเต็ม - หัก + ทิป = สุทธิ
+    net = net.where(~is_cash, gross + tip)
+    deduct = deduct.where(~is_cash, 0.0)
+
+    ok = when.notna() & gross.notna() & net.notna() & (gross >= 0) & ((gross > 0) | (net > 0))
+    note = f"นำเข้า {platform}"
+    if "ref" in mapping:
+        ref = chunk[mapping["ref"]].fillna("").astype(str).str.strip()
+        note = (note + " #" + ref).where(ref != "", note)
+    rows = pd.DataFrame({
+        'วันที่': when.dt.strftime('%Y-%m-%d'), 'เวลา': when.dt.strftime('%H:%M'),
+        'แอป': platform, 'หมวดหมู่': 'รายรับ', 'รายการ': 'ค่าโดยสาร',
+        'ช่องทางรับเงิน': np.where(is_cash, CASH, CARD),
+        'ยอดเต็ม/หน้าแอป': gross, 'หัก/จ่าย': deduct, 'ทิป': tip, 'คงเหลือ/สุทธิ': net,
+        'เงินสดเข้าตัว': net.where(is_cash, 0.0), 'เลขไมล์': 0, 'หมายเหตุ': note,
+        ROW_ID: ledger.format_ids(ledger.new_ids(len(chunk))),
+    }, index=chunk.index)[LEDGER_COLS]
+    return rows[ok].reset_index(drop=True), int((~ok).sum())
+
+
+# --- IMPORT ---
+def import_statement(file, filename, platform, existing, write, chunk_rows=CHUNK_ROWS):
+    # existing(start, end) -> ledger (typed) ที่มีอยู่แล้วในช่วงวันที่นั้น; write(rows) บันทึกหนึ่ง batch (รูปแบบชีต)
+    # เป็น generator: ส่งสถิติสะสมหลังแต่ละ chunk (ใช้แสดงความคืบหน้า)
+    stats = {"read": 0, "imported": 0, "duplicates": 0, "invalid": 0}
+    mapping = None
+    for chunk in read_chunks(file, filename, platform, chunk_rows):
+        mapping = mapping or column_map(chunk.columns, platform)
+        rows, invalid = to_ledger(chunk, platform, mapping)
+        stats["read"] += len(chunk)
+        stats["invalid"] += invalid
+        if len(rows):
+            typed = ledger.from_sheet(rows)
+            fresh = ledger.drop_existing(typed, existing(typed['วันที่'].min(), typed['วันที่'].max()))
+            stats["duplicates"] += len(rows) - len(fresh)
+            if len(fresh):
+                with perf.span("import.write"):
+                    write(rows.loc[fresh.index])
+                stats["imported"] += len(fresh)
+        yield dict(stats)
+    if not stats["read"]:
+        yield dict(stats)  # ไฟล์มีแต่หัวคอลัมน์
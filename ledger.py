@@ -0,0 +1,537 @@
+import bisect
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import perf
+from storage import CONTENT_COLS, LEDGER_COLS, ROW_ID, legacy_row_id, plan_edits
+
+# --- TYPED LEDGER ---
+# รูปแบบข้อมูลในหน่วยความจำ (ต่างจากรูปแบบบนชีต):
+#   วันที่     -> datetime64 (เที่ยงคืนของวันนั้น) กรองช่วงวันที่ได้ด้วยการเทียบค่าตรง ๆ
+#   วันเวลา   -> datetime64 จริงของรายการ (วันที่ + เวลา)
+#   ข้อความซ้ำ ๆ (แอป/หมวดหมู่/รายการ/ช่องทาง/เวลา) -> category
+#   เงิน      -> int64 หน่วยสตางค์ (ใช้ baht() แปลงกลับเป็นบาทตอนแสดงผล)
+#   รหัสแถว   -> int64 (0 = แถวรุ่นก่อนที่ยังไม่มีรหัส)
+# from_sheet() แปลงจากชีต -> typed, to_sheet() แปลงกลับตอนบันทึก
+TS_COL = 'วันเวลา'
+CATEGORY_COLS = ['เวลา', 'แอป', 'หมวดหมู่', 'รายการ', 'ช่องทางรับเงิน']
+MONEY_COLS = ['ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'คงเหลือ/สุทธิ', 'เงินสดเข้าตัว']
+TYPED_COLS = LEDGER_COLS + [TS_COL]
+
+
+def baht(satang):
+    return satang / 100
+
+
+def to_satang(values):
+    return (pd.to_numeric(values, errors='coerce').fillna(0) * 100).round().astype('int64')
+
+
+def _text(values):
+    return values.fillna('').astype(str)
+
+
+def _time_offsets(times):
+    # แปลงเวลา "HH:MM" เฉพาะค่าที่ไม่ซ้ำ (categories) แล้วกระจายกลับตาม code
+    cats = pd.to_datetime(pd.Series(times.cat.categories, dtype=object), format='%H:%M', errors='coerce')
+    offsets = (cats - cats.dt.normalize()).fillna(pd.Timedelta(0)).to_numpy()
+    codes = times.cat.codes.to_numpy()
+    out = np.zeros(len(codes), dtype='timedelta64[ns]')
+    valid = codes >= 0
+    out[valid] = offsets[codes[valid]]
+    return out
+
+
+# --- ROW ID ---
+# สุ่ม 60 บิตต่อแถว (ไม่ต้องถาม backend ว่าเลขถัดไปคืออะไร เครื่องที่ออฟไลน์ก็สร้างได้)
+# บนชีตเป็นข้อความ "r" + hex 15 หลัก: ขึ้นต้นด้วยตัวอักษร ชีตจึงไม่แปลงเป็นตัวเลข/ปัดหลัก
+def new_ids(n):
+    ids = (np.frombuffer(os.urandom(8 * n), dtype='uint64') >> np.uint64(4)).astype('int64')
+    return np.where(ids == 0, 1, ids)
+
+
+_HEX = np.frombuffer(b"0123456789abcdef", dtype='uint8')
+_HEX_VALUE = np.full(256, 16, dtype='uint8')
+_HEX_VALUE[_HEX] = np.arange(16)
+_SHIFTS = np.arange(56, -4, -4, dtype='uint64')  # hex 15 หลัก (60 บิต) จากหลักซ้ายสุด
+
+
+def format_ids(ids):
+    # แปลงทั้ง array ด้วย numpy (ledger ใหญ่ไม่ต้องวน format ทีละแถว); 0 -> ""
+    ids = np.asarray(ids, dtype='int64')
+    chars = np.empty((len(ids), 16), dtype='uint8')
+    chars[:, 0] = ord('r')
+    chars[:, 1:] = _HEX[(ids.astype('uint64')[:, None] >> _SHIFTS) & np.uint64(15)]
+    out = chars.view('S16').ravel().astype(str).astype(object)
+    out[ids == 0] = ""
+    return out.tolist()
+
+
+def parse_ids(values):
+    # ข้อความที่ไม่ใช่รหัส (ว่าง/NaN/ค่าอื่น) -> 0; ยาวกว่า 16 ตัวอักษรจะเห็นตัวที่ 17 จึงไม่ผ่าน
+    raw = np.asarray(values, dtype=object)
+    try:
+        codes = raw.astype('S17').view('uint8')  # ปกติเป็น ASCII ล้วน: แปลงเป็น bytes เร็วกว่า unicode
+    except UnicodeEncodeError:
+        codes = np.minimum(raw.astype(str).astype('U17').view('uint32'), 255).astype('uint8')
+    codes = codes.reshape(len(raw), 17)
+    # hex 15 หลัก + 0 นำหน้า = 8 ไบต์ big-endian
+    digits = np.zeros((len(raw), 16), dtype='uint8')
+    digits[:, 1:] = _HEX_VALUE[codes[:, 1:16]]
+    valid = (codes[:, 0] == ord('r')) & (codes[:, 16] == 0) & (digits < 16).all(axis=1)
+    out = ((digits[:, 0::2] << 4) | digits[:, 1::2]).view('>u8').ravel().astype('int64')
+    out[~valid] = 0
+    return out
+
+
+def new_id():
+    return format_ids(new_ids(1))[0]
+
+
+@perf.timed("ledger.from_sheet")
+def from_sheet(df):
+    out = pd.DataFrame(index=df.index)
+    out['วันที่'] = pd.to_datetime(df['วันที่'], errors='coerce').dt.normalize()
+    for col in CATEGORY_COLS:
+        out[col] = _text(df[col]).astype('category')
+    for col in MONEY_COLS:
+        out[col] = to_satang(df[col])
+    out['เลขไมล์'] = pd.to_numeric(df['เลขไมล์'], errors='coerce').fillna(0).round().astype('int64')
+    out['หมายเหตุ'] = _text(df['หมายเหตุ'])
+    out[ROW_ID] = parse_ids(df[ROW_ID]) if ROW_ID in df else 0
+    out[TS_COL] = out['วันที่'] + _time_offsets(out['เวลา'])
+    return out[TYPED_COLS]
+
+
+@perf.timed("ledger.from_records")
+def from_records(rows):
+    if isinstance(rows, dict):
+        rows = [rows]
+    return from_sheet(pd.DataFrame(rows, columns=LEDGER_COLS))
+
+
+def empty():
+    return from_sheet(pd.DataFrame(columns=LEDGER_COLS))
+
+
+@perf.timed("ledger.to_sheet")
+def to_sheet(df):
+    # กลับเป็นรูปแบบบนชีต: วันที่เป็นข้อความ YYYY-MM-DD, เงินเป็นบาท
+    out = pd.DataFrame(index=df.index)
+    out['วันที่'] = df['วันที่'].dt.strftime('%Y-%m-%d').fillna('')
+    for col in LEDGER_COLS[1:]:
+        if col in MONEY_COLS:
+            out[col] = baht(df[col]).astype(float)
+        elif col == 'เลขไมล์':
+            out[col] = df[col].astype('int64')
+        elif col == ROW_ID:
+            out[col] = format_ids(df[col].to_numpy())
+        else:
+            out[col] = df[col].astype(object).fillna('').astype(str)
+    return out
+
+
+@perf.timed("ledger.to_display")
+def to_display(df):
+    # สำหรับตารางแก้ไขใน tab3: วันที่เป็น date, เงินเป็นบาท, ข้อความธรรมดา
+    out = to_sheet(df)
+    out['วันที่'] = df['วันที่'].dt.date
+    return out
+
+
+# --- SORTED INDEX ---
+# ledger ในเซสชันเรียงตาม วันเวลา เสมอ (แถวที่วันที่อ่านไม่ได้อยู่ท้ายสุด)
+# การกรองช่วงวันที่จึงเป็นการหาตำแหน่งด้วย searchsorted (O(log n)) แล้วตัด slice
+def sort_by_time(df):
+    return df.sort_values(TS_COL, kind='stable', na_position='last').reset_index(drop=True)
+
+
+def _n_valid(ts):
+    # จำนวนแถวที่มีวันเวลา (NaT อยู่ท้ายเสมอ จึงหาจุดแบ่งด้วย bisect ได้)
+    return bisect.bisect_left(range(len(ts)), True, key=lambda i: np.isnat(ts[i]))
+
+
+def _bounds(df, start, end):
+    ts = df[TS_COL].to_numpy()
+    n_valid = _n_valid(ts)
+    ts = ts[:n_valid]
+    lo = 0 if start is None else int(np.searchsorted(ts, np.datetime64(pd.Timestamp(start).normalize()), 'left'))
+    hi = n_valid if end is None else int(np.searchsorted(ts, np.datetime64(pd.Timestamp(end).normalize() + pd.Timedelta(days=1)), 'left'))
+    return lo, max(lo, hi)
+
+
+def slice_range(df, start=None, end=None):
+    # ช่วงวันที่แบบรวมหัวท้าย [start, end]; None = ไม่จำกัดด้านนั้น
+    if df.empty or (start is None and end is None):
+        return df
+    lo, hi = _bounds(df, start, end)
+    return df.iloc[lo:hi]
+
+
+def month_keys(df):
+    # เดือนของแต่ละแถวแบบ "YYYY-MM" (ตรงกับชื่อพาร์ทิชันใน storage.PartitionedStorage)
+    return df['วันที่'].dt.strftime('%Y-%m')
+
+
+def insert_sorted(df, new_rows):
+    # กรณีปกติ (รายการใหม่ล่าสุด) แค่ต่อท้าย; ถ้าย้อนหลังค่อยเรียงใหม่
+    new_rows = sort_by_time(new_rows)
+    out = concat([df, new_rows])
+    if len(df) and len(new_rows):
+        last = df[TS_COL].iloc[-1]
+        first = new_rows[TS_COL].iloc[0]
+        if pd.isna(last) or pd.isna(first) or first < last:
+            out = sort_by_time(out)
+    return out
+
+
+def concat(frames):
+    # ต่อตารางโดยรวม categories ให้เข้ากัน (กัน category กลายเป็น object)
+    frames = [f for f in frames if len(f)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    frames = [f.copy() for f in frames]
+    for col in CATEGORY_COLS:
+        cats = pd.api.types.union_categoricals([f[col] for f in frames]).categories
+        for f in frames:
+            f[col] = f[col].cat.set_categories(cats)
+    return pd.concat(frames, ignore_index=True)
+
+
+# --- EDITS (ตารางแก้ไขใน tab3) ---
+@perf.timed("ledger.diff_rows")
+def diff_rows(before, after):
+    # เทียบตารางก่อน/หลังแก้ด้วย index (ตำแหน่งในสำเนาที่ตารางแสดง)
+    # คืน (index ที่ต้องเอาออก, index ของแถวใหม่/แถวที่แก้ใน after, คู่ (แถวเดิม, แถวใหม่) รูปแบบชีต)
+    old, new = to_sheet(before), to_sheet(after)
+    common = old.index.intersection(new.index)
+    changed = common[(old.loc[common] != new.loc[common]).any(axis=1)]
+    deleted = old.index.difference(new.index)
+    added = new.index.difference(old.index)
+    pairs = [(old.loc[i].to_dict(), new.loc[i].to_dict()) for i in changed]
+    pairs += [(old.loc[i].to_dict(), None) for i in deleted]
+    pairs += [(None, new.loc[i].to_dict()) for i in added]
+    return changed.union(deleted), changed.union(added), pairs
+
+
+def assign_ids(pairs):
+    # ก่อนบันทึก: แถวที่เพิ่มในตารางได้รหัสใหม่เสมอ (แม้คัดลอกมาจากแถวอื่น)
+    # แถวรุ่นก่อนที่ยังไม่มีรหัสได้รหัสตอนถูกแก้ครั้งแรก จากค่าเดิมของแถว (แถวซ้ำกันทุกช่องในชุดเดียวกันได้รหัสสุ่ม)
+    out, used = [], set()
+    for old, new in pairs:
+        if new is not None and old is None:
+            new = {**new, ROW_ID: new_id()}
+        elif new is not None and not new.get(ROW_ID):
+            row_id = legacy_row_id(old)
+            new = {**new, ROW_ID: new_id() if row_id in used else row_id}
+            used.add(row_id)
+        out.append((old, new))
+    return out
+
+
+def pair_ids(pairs):
+    # รหัสแถว (int64) ที่คู่อ้างถึง: แถวเดิมที่มีรหัส + แถวใหม่ที่เพิ่ม (ตรวจว่าเคยเพิ่มไปแล้วหรือยัง)
+    ids = parse_ids(pd.Series([old.get(ROW_ID) if old is not None else new.get(ROW_ID)
+                               for old, new in pairs if old is not None or new is not None], dtype=object))
+    return ids[ids != 0]
+
+
+@perf.timed("ledger.apply_edits")
+def apply_edits(frame, pairs):
+    # ใช้คู่ (แถวเดิม, แถวใหม่) แบบเดียวกับ backend (storage.plan_edits): ทั้งรายการใน outbox ตอนโหลดใหม่
+    # และการแก้จากตารางที่ ledger อาจเปลี่ยนไปแล้วระหว่างแก้ (ตำแหน่งแถวใช้อ้างไม่ได้)
+    # แถวเดิมหาจากรหัสแถว (ที่ไหนก็ได้ใน ledger) และค่าในแถวเฉพาะช่วงวันที่ของแถวเดิม
+    olds = [old for old, _ in pairs if old is not None]
+    dates = pd.to_datetime(pd.Series([old['วันที่'] for old in olds], dtype=object), errors='coerce')
+    if not olds:
+        candidates = frame.iloc[:0]
+    elif dates.notna().all():
+        lo, hi = _bounds(frame, dates.min(), dates.max())
+        in_range = np.zeros(len(frame), dtype=bool)
+        in_range[lo:hi] = True
+        candidates = frame[in_range | frame[ROW_ID].isin(pair_ids(pairs)).to_numpy()]
+    else:
+        candidates = frame
+    updates, deletes, inserts = plan_edits(to_sheet(candidates), pairs)
+    kept = frame.drop(index=list(updates) + deletes)
+    return sort_by_time(concat([kept, from_records(list(updates.values()) + inserts)]))
+
+
+def memory_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+# --- CONTENT HASH (หาแถวซ้ำตอนนำเข้า) ---
+def row_hashes(df):
+    # hash 64 บิตของค่าทุกช่องในแถว (แบบ typed ไม่รวมรหัสแถว): แถวที่ค่าเหมือนกันได้ hash เดียวกันไม่ว่ามาจากชีตหรือไฟล์นำเข้า
+    content = df[CONTENT_COLS].assign(**{'หมายเหตุ': df['หมายเหตุ'].str.strip()})
+    return pd.util.hash_pandas_object(content, index=False).to_numpy()
+
+
+@perf.timed("ledger.drop_existing")
+def drop_existing(new_rows, existing):
+    # แถวใน new_rows ที่ยังไม่มีใน existing นับตามจำนวน: ไฟล์มี 2 แถวเหมือนกัน ในระบบมีแล้ว 1 -> เหลือ 1
+    new_hashes, old_hashes = row_hashes(new_rows), row_hashes(existing)
+    candidates = np.flatnonzero(np.isin(new_hashes, old_hashes))
+    if not len(candidates):
+        return new_rows
+    left = Counter(old_hashes[np.isin(old_hashes, new_hashes)])
+    keep = np.ones(len(new_rows), dtype=bool)
+    for i in candidates:
+        if left[new_hashes[i]] > 0:
+            left[new_hashes[i]] -= 1
+            keep[i] = False
+    return new_rows[keep]
+
+
+# --- LIVE STATE ---
+# สถานะกะปัจจุบัน / เลขไมล์ล่าสุด / รายได้วันนี้ เก็บเป็น dict เล็ก ๆ
+# สร้างใหม่ตอนโหลดหรือแก้ไขแบบ bulk เท่านั้น ตอนเพิ่มรายการใช้ apply_live_events() อัปเดตเฉพาะส่วนต่าง
+@perf.timed("ledger.build_live_state")
+def build_live_state(df, today):
+    live = {
+        "today": pd.Timestamp(today),
+        "status": "🌙 เลิกงาน",
+        "shift_start": None,
+        "last_shift_ts": None,
+        "last_odom": 0,
+        "today_income": 0,  # สตางค์
+    }
+    if df.empty:
+        return live
+    live["last_odom"] = max(int(df['เลขไมล์'].max()), 0)
+    shift_df = df[df['หมวดหมู่'] == 'กะงาน']
+    if not shift_df.empty:
+        _set_shift(live, shift_df.iloc[-1])
+    today_df = slice_range(df, today, today)
+    live["today_income"] = int(today_df.loc[today_df['หมวดหมู่'] == 'รายรับ', 'คงเหลือ/สุทธิ'].sum())
+    return live
+
+
+def _set_shift(live, row):
+    live["status"] = row['รายการ']
+    live["last_shift_ts"] = row[TS_COL]
+    live["shift_start"] = row[TS_COL] if "เริ่ม" in row['รายการ'] else None
+
+
+def apply_live_events(live, new_rows):
+    live["last_odom"] = max(live["last_odom"], int(new_rows['เลขไมล์'].max()))
+    for _, row in new_rows[new_rows['หมวดหมู่'] == 'กะงาน'].iterrows():
+        # รายการย้อนหลังไม่เปลี่ยนสถานะกะปัจจุบัน
+        if live["last_shift_ts"] is None or pd.isna(live["last_shift_ts"]) or row[TS_COL] >= live["last_shift_ts"]:
+            _set_shift(live, row)
+    is_today = (new_rows['วันที่'] == live["today"]) & (new_rows['หมวดหมู่'] == 'รายรับ')
+    live["today_income"] += int(new_rows.loc[is_today, 'คงเหลือ/สุทธิ'].sum())
+    return live
+
+
+# --- RECORDS ---
+# ทุกฟอร์มสร้างแถวผ่าน make_record() ที่เดียว (ตรวจค่าก่อนบันทึก)
+CATEGORIES = ('รายรับ', 'รายจ่าย', 'กะงาน')
+
+
+def make_record(category, item, *, when, app, channel='-', gross=0, deduct=0, tip=0,
+                net=0, cash=0, odometer=0, note=''):
+    if category not in CATEGORIES:
+        raise ValueError(f"หมวดหมู่ไม่ถูกต้อง: {category}")
+    amounts = {'ยอดเต็ม/หน้าแอป': gross, 'หัก/จ่าย': deduct, 'ทิป': tip,
+               'คงเหลือ/สุทธิ': net, 'เงินสดเข้าตัว': cash, 'เลขไมล์': odometer}
+    for col, val in amounts.items():
+        val = float(val or 0)
+        if not np.isfinite(val):
+            raise ValueError(f"{col} ต้องเป็นตัวเลข")
+        if col in ('ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'เลขไมล์') and val < 0:
+            raise ValueError(f"{col} ติดลบไม่ได้")
+        amounts[col] = val
+    return {
+        'วันที่': when.date(), 'เวลา': when.strftime("%H:%M"),
+        'แอป': app, 'หมวดหมู่': category, 'รายการ': item, 'ช่องทางรับเงิน': channel,
+        **amounts, 'หมายเหตุ': note or '', ROW_ID: new_id(),
+    }
+
+
+def expense_record(item, cost, *, when, app='ค่าใช้จ่าย', note=''):
+    return make_record('รายจ่าย', item, when=when, app=app, channel='จ่ายสด',
+                       deduct=cost, net=-cost, cash=-cost, note=note)
+
+
+def shift_record(started, odometer, *, when, note=''):
+    item = '☀️ เริ่มงาน' if started else '🌙 เลิกงาน'
+    return make_record('กะงาน', item, when=when, app='ระบบ', odometer=odometer, note=note)
+
+
+# --- LEDGER (append buffer) ---
+# append() ไม่ต่อเข้าตารางหลักทันที แต่พักไว้ใน pending แล้วรวมทีเดียว
+# เมื่อมีคนอ่าน .frame หรือ pending ครบ FLUSH_AT แถว ต้นทุนการเพิ่มแต่ละแถวจึงไม่โตตามขนาด ledger
+class Ledger:
+    FLUSH_AT = 256
+
+    def __init__(self, frame=None):
+        self._frame = sort_by_time(frame) if frame is not None else empty()
+        self._pending = []
+        self._n_pending = 0
+
+    def __len__(self):
+        return len(self._frame) + self._n_pending
+
+    @property
+    def frame(self):
+        self.flush()
+        return self._frame
+
+    def flush(self):
+        if self._pending:
+            self._frame = insert_sorted(self._frame, concat(self._pending))
+            self._pending = []
+            self._n_pending = 0
+        return self._frame
+
+    def replace(self, frame):
+        self._frame = sort_by_time(frame)
+        self._pending = []
+        self._n_pending = 0
+
+    def append(self, records):
+        new_rows = from_records(records)
+        self._pending.append(new_rows)
+        self._n_pending += len(new_rows)
+        if self._n_pending >= self.FLUSH_AT:
+            self.flush()
+        return new_rows
+
+    def edit(self, pairs):
+        # ใช้คู่ (แถวเดิม, แถวใหม่) จาก diff_rows: หาแถวด้วยรหัสแถว ไม่ใช่ตำแหน่ง (ดู apply_edits)
+        self._frame = apply_edits(self.flush(), pairs)
+        return self._frame
+
+    def merge(self, frame):
+        # รวมแถวที่โหลดเพิ่มภายหลัง (เช่นพาร์ทิชันเดือนเก่า) เข้าตารางหลัก
+        self._frame = insert_sorted(self.flush(), frame)
+
+    def rows_between(self, start, end):
+        # อ่านช่วงวันที่โดยไม่ต้อง flush: slice ของตารางหลัก + แถวที่ยังพักอยู่
+        parts = [slice_range(self._frame, start, end)]
+        parts += [slice_range(sort_by_time(p), start, end) for p in self._pending]
+        return concat(parts)
+
+
+# --- DRIVER BOOK (ใช้ร่วมทุกเซสชันของคนขับคนเดียวกัน) ---
+# ledger / rollup / live state / เดือนที่โหลดแล้ว / รุ่นข้อมูล / memo ของแดชบอร์ด ของคนขับหนึ่งคน
+# แก้ไขทุกครั้งถือ lock และแทน frame ด้วยก้อนใหม่ (frame ที่เซสชันอื่นกำลังอ่านอยู่ไม่ถูกแก้ในที่)
+# ledger = None คือยังไม่ได้โหลดหรือถูก evict: เซสชันถัดไปโหลดใหม่จาก backend + outbox
+class DriverBook:
+    def __init__(self, driver):
+        self.driver = driver
+        self.lock = threading.RLock()
+        self.ledger = None
+        self.rollup = None
+        self.live = None
+        self.loaded_from = None
+        self.load_error = None  # โหลดจาก backend ไม่สำเร็จ: ledger ไม่ครบ ห้ามเขียนทับจนกว่าจะโหลดได้
+        self.version = 0
+        self.memo = {}
+        self.nbytes = 0
+        self.used_at = 0.0
+
+    @property
+    def loaded(self):
+        return self.ledger is not None
+
+    def frame(self):
+        with self.lock:
+            return self.ledger.frame
+
+    def measure(self, extra=0):
+        # วัดขนาดจริง (memory_usage deep) ของ ledger + rollup; extra = สำเนาอื่นของคนขับนี้ (เช่น RemoteLedger)
+        with self.lock:
+            n = memory_bytes(self.ledger.frame) if self.ledger is not None else 0
+            n += sum(memory_bytes(df) for df in (self.rollup or {}).values())
+            self.nbytes = n + extra
+            return self.nbytes
+
+    def grow(self, n_rows):
+        # เพิ่มทีละไม่กี่แถว: ประมาณจากขนาดเฉลี่ยต่อแถวที่วัดไว้ (ไม่วัด deep ใหม่ทั้งตารางทุกครั้ง)
+        with self.lock:
+            n = len(self.ledger) if self.ledger is not None else 0
+            if n > n_rows:
+                self.nbytes += self.nbytes * n_rows // (n - n_rows)
+            return self.nbytes
+
+    def unload(self):
+        with self.lock:
+            self.ledger = self.rollup = self.live = None
+            self.memo = {}
+            self.nbytes = 0
+
+
+# --- BOOK CACHE (LRU ตามขนาดหน่วยความจำ) ---
+# หนึ่ง DriverBook ต่อคนขับ หน่วยความจำจึงโตตามจำนวนคนขับที่ใช้งาน ไม่ใช่จำนวนแท็บที่เปิด
+# รวมเกิน max_bytes: unload คนขับที่ไม่ได้ใช้นานที่สุดก่อนจนต่ำกว่าเพดาน
+# ไม่แตะคนขับ keep และคนขับที่มีเซสชันใช้ภายใน min_idle วินาที (rerun ที่กำลังอ่าน ledger อยู่ต้องไม่ถูกดึงออก)
+class BookCache:
+    def __init__(self, max_bytes, on_evict=None, min_idle=30):
+        self.max_bytes = max_bytes
+        self.min_idle = min_idle
+        self.on_evict = on_evict  # on_evict(driver): ปล่อยสำเนาอื่นของคนขับนั้น
+        self.evictions = 0
+        self._books = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, driver):
+        with self._lock:
+            book = self._books.pop(driver, None) or DriverBook(driver)
+            self._books[driver] = book  # ใช้ล่าสุดอยู่ท้าย
+            book.used_at = time.monotonic()
+            return book
+
+    def total(self):
+        with self._lock:
+            return sum(b.nbytes for b in self._books.values())
+
+    def stats(self):
+        # [(driver, bytes)] เฉพาะคนขับที่โหลดอยู่ เรียงจากใช้ล่าสุด
+        with self._lock:
+            return [(b.driver, b.nbytes) for b in reversed(self._books.values()) if b.loaded]
+
+    def _drop_unloaded(self, idle_before, keep=None):
+        # ทิ้ง DriverBook ที่ว่าง (ถูก evict / โหลดไม่สำเร็จ) และไม่มีใครใช้ ไม่ให้ _books โตตามจำนวนคนขับที่เคยเปิด
+        # ข้ามเล่มที่มีคนถือ lock อยู่ (กำลังโหลด): get() ครั้งถัดไปได้เล่มใหม่ ส่วนเล่มนี้ไม่มีใครรู้จักแล้ว
+        with self._lock:
+            for book in list(self._books.values()):
+                if book.driver == keep or book.loaded or book.used_at > idle_before:
+                    continue
+                if book.lock.acquire(blocking=False):
+                    try:
+                        if not book.loaded:
+                            del self._books[book.driver]
+                    finally:
+                        book.lock.release()
+
+    def trim(self, keep=None):
+        idle_before = time.monotonic() - self.min_idle
+        self._drop_unloaded(idle_before, keep)
+        with self._lock:
+            books = list(self._books.values())
+        total = sum(b.nbytes for b in books)
+        for book in books:
+            if total <= self.max_bytes:
+                break
+            if book.driver == keep or not book.loaded or book.used_at > idle_before:
+                continue
+            if not book.lock.acquire(blocking=False):
+                continue  # มีเซสชันกำลังใช้อยู่ (และไม่รอ lock: กัน deadlock ตอน trim ซ้อนใน lock ของคนขับอื่น)
+            try:
+                total -= book.nbytes
+                book.unload()
+            finally:
+                book.lock.release()
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(book.driver)
+        self._drop_unloaded(idle_before, keep)
+
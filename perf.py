@@ -0,0 +1,233 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- PERF (จับเวลาแต่ละขั้น) ---
+# span = เวลาของหนึ่งขั้น (เรียก storage, แปลงชนิดข้อมูล, คำนวณ/วาดกราฟ tab2) ซ้อนกันได้
+# แต่ละ run (rerun ของสคริปต์ / fragment / รอบซิงก์เบื้องหลัง) เก็บ span + cache hit/miss ใน Recorder ของตัวเอง
+# Recorder อยู่ใน contextvar: thread ของแต่ละเซสชันและ worker ไม่ปนกัน span ที่อยู่นอก run ไม่ถูกเก็บ
+# run จบแล้วส่งให้ exporter เขียนลงไฟล์ (JSON lines หรือ Prometheus text format) ไว้รวมข้ามเซสชัน
+_current = contextvars.ContextVar("perf_recorder", default=None)
+_exporter = None
+
+
+class Recorder:
+    def __init__(self, label):
+        self.label = label
+        self.started = time.time()
+        self.total = None
+        self.spans = []  # [(ชื่อ, วินาที, ระดับการซ้อน)] ตามลำดับที่เริ่ม
+        self.cache = {}  # ชื่อ cache -> [hit, miss]
+        self.depth = 0
+        self._t0 = time.perf_counter()
+
+    @property
+    def done(self):
+        return self.total is not None
+
+    def elapsed(self):
+        return self.total if self.done else time.perf_counter() - self._t0
+
+    def finish(self):
+        if self.total is None:
+            self.total = time.perf_counter() - self._t0
+        return self
+
+    def breakdown(self):
+        # รวมตามชื่อ: [(ชื่อ, ระดับการซ้อนครั้งแรก, จำนวนครั้ง, วินาทีรวม)] ตามลำดับที่เจอครั้งแรก
+        out = {}
+        for name, seconds, depth in self.spans:
+            depth0, n, total = out.get(name, (depth, 0, 0.0))
+            out[name] = (depth0, n + 1, total + seconds)
+        return [(name, depth, n, total) for name, (depth, n, total) in out.items()]
+
+    def to_dict(self):
+        return {
+            "ts": round(self.started, 3),
+            "run": self.label,
+            "total_ms": round(self.elapsed() * 1000, 3),
+            "spans": [{"name": name, "depth": depth, "calls": n, "ms": round(total * 1000, 3)}
+                      for name, depth, n, total in self.breakdown()],
+            "cache": {name: {"hit": hit, "miss": miss} for name, (hit, miss) in self.cache.items()},
+        }
+
+
+def _active():
+    rec = _current.get()
+    return rec if rec is not None and not rec.done else None
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    rec = _active()
+    if rec is None:
+        yield
+        return
+    i = len(rec.spans)
+    rec.spans.append((name, 0.0, rec.depth))
+    rec.depth += 1
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        rec.depth -= 1
+        rec.spans[i] = (name, time.perf_counter() - t0, rec.depth)
+
+
+def timed(name):
+    # decorator: ทุกครั้งที่เรียกฟังก์ชันนับเป็น span ชื่อ name
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+_IMPORTED_AT = time.time()
+
+
+def process_started():
+    # เวลาที่ process เริ่ม (epoch): Linux อ่านจาก /proc (รวมเวลาบูต streamlit server และ import ทั้งหมด)
+    # ระบบอื่นใช้เวลาที่ import โมดูลนี้ครั้งแรกแทน
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = float(f.read().rsplit(")", 1)[1].split()[19])  # starttime: นับจากบูตเครื่อง
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return _IMPORTED_AT
+
+
+def record(name, seconds):
+    # ค่าเวลาที่วัดเอง (ไม่ได้ครอบด้วย span) เช่นเวลาเปิดแอปจนเห็นฟอร์มแรก
+    rec = _active()
+    if rec is not None:
+        rec.spans.append((name, seconds, rec.depth))
+
+
+def cache(name, hit):
+    rec = _active()
+    if rec is not None:
+        rec.cache.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+
+def begin(label):
+    # เริ่ม run ใหม่ในบริบทปัจจุบัน (เช่นต้นสคริปต์ Streamlit) จบด้วย end()
+    rec = Recorder(label)
+    _current.set(rec)
+    return rec
+
+
+def end(rec=None):
+    # จบ run (ค่าเริ่มต้น = run ปัจจุบัน) แล้วส่งออก; เรียกซ้ำได้ run ที่จบแล้วไม่ถูกส่งซ้ำ
+    rec = rec if rec is not None else _current.get()
+    if rec is not None and not rec.done:
+        _export(rec.finish())
+    return rec
+
+
+@contextmanager
+def run(label):
+    # run ย่อย (fragment / รอบซิงก์): ถ้าอยู่ใน run ที่ยังไม่จบ นับเป็น span หนึ่งในนั้นแทน
+    if _active() is not None:
+        with span(label):
+            yield _current.get()
+        return
+    rec = Recorder(label)
+    token = _current.set(rec)
+    try:
+        yield rec
+    finally:
+        _current.reset(token)
+        end(rec)
+
+
+# --- EXPORT ---
+class JsonLinesExporter:
+    # หนึ่งบรรทัดต่อหนึ่ง run (to_dict) ต่อท้ายไฟล์
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, rec):
+        line = json.dumps(rec.to_dict(), ensure_ascii=False)
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusExporter:
+    # textfile สำหรับ node_exporter: ค่าสะสมตั้งแต่ process เริ่ม เขียนทับทั้งไฟล์ (os.replace) ทุกครั้งที่ run จบ
+    def __init__(self, path, prefix="driver_app"):
+        self.path = path
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.runs = {}  # run -> [ครั้ง, วินาที]
+        self.spans = {}  # span -> [ครั้ง, วินาที]
+        self.cache = {}  # (cache, "hit"|"miss") -> ครั้ง
+
+    def export(self, rec):
+        with self.lock:
+            stats = self.runs.setdefault(rec.label, [0, 0.0])
+            stats[0] += 1
+            stats[1] += rec.elapsed()
+            for name, _, n, total in rec.breakdown():
+                stats = self.spans.setdefault(name, [0, 0.0])
+                stats[0] += n
+                stats[1] += total
+            for name, (hit, miss) in rec.cache.items():
+                self.cache[(name, "hit")] = self.cache.get((name, "hit"), 0) + hit
+                self.cache[(name, "miss")] = self.cache.get((name, "miss"), 0) + miss
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp, self.path)
+
+    def render(self):
+        p = self.prefix
+        lines = []
+        for metric, label, values, i in ((f"{p}_runs_total", "run", self.runs, 0),
+                                         (f"{p}_run_seconds_total", "run", self.runs, 1),
+                                         (f"{p}_span_calls_total", "span", self.spans, 0),
+                                         (f"{p}_span_seconds_total", "span", self.spans, 1)):
+            lines.append(f"# TYPE {metric} counter")
+            lines += [f'{metric}{{{label}="{_label(k)}"}} {v[i]:.6g}' for k, v in values.items()]
+        lines.append(f"# TYPE {p}_cache_requests_total counter")
+        lines += [f'{p}_cache_requests_total{{cache="{_label(name)}",result="{result}"}} {n}'
+                  for (name, result), n in self.cache.items()]
+        return "\n".join(lines) + "\n"
+
+
+def configure(path):
+    # path ลงท้าย .prom = Prometheus text format, อื่น ๆ = JSON lines, ค่าว่าง/None = ไม่เขียนไฟล์
+    global _exporter
+    if not path:
+        _exporter = None
+    elif str(path).endswith(".prom"):
+        _exporter = PrometheusExporter(path)
+    else:
+        _exporter = JsonLinesExporter(path)
+    return _exporter
+
+
+def _export(rec):
+    if _exporter is None:
+        return
+    try:
+        _exporter.export(rec)
+    except OSError:
+        pass  # เขียนไฟล์ metrics ไม่ได้ไม่ควรทำให้แอปพัง
@@ -0,0 +1,1314 @@
+import datetime
+import glob
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import pandas as pd
+
+import perf
+
+# --- LEDGER SCHEMA ---
+# รหัสแถว: รหัสถาวรของแถว (ledger.new_ids) ให้หลายเครื่องแก้แถวเดียวกันได้โดยไม่ต้องอาศัยตำแหน่ง/ค่าในแถว
+# ชีตรุ่นก่อนไม่มีคอลัมน์นี้ (แถวเก่ารหัสว่าง) คอลัมน์จะถูกเพิ่มท้ายหัวชีตตอนเขียนครั้งแรก
+ROW_ID = 'รหัสแถว'
+LEDGER_COLS = [
+    'วันที่', 'เวลา', 'แอป', 'หมวดหมู่', 'รายการ', 'ช่องทางรับเงิน',
+    'ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'คงเหลือ/สุทธิ',
+    'เงินสดเข้าตัว', 'เลขไมล์', 'หมายเหตุ', ROW_ID
+]
+CONTENT_COLS = LEDGER_COLS[:-1]  # ค่าในแถว (ไม่รวมรหัสแถว)
+NUM_COLS = ['ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'คงเหลือ/สุทธิ', 'เงินสดเข้าตัว', 'เลขไมล์']
+
+# หัวคอลัมน์ภาษาอังกฤษจากชีตรุ่นเก่า
+COL_MAP = {
+    'Date': 'วันที่', 'Time': 'เวลา', 'Platform': 'แอป',
+    'Category': 'หมวดหมู่', 'SubCategory': 'รายการ',
+    'Amount_Gross': 'ยอดเต็ม/หน้าแอป', 'Deduction': 'หัก/จ่าย',
+    'Tip': 'ทิป', 'Net_Income': 'คงเหลือ/สุทธิ',
+    'Distance_Km': 'ระยะทาง(กม.)', 'Note': 'หมายเหตุ',
+    'Odometer': 'เลขไมล์',
+    'Payment_Method': 'ช่องทางรับเงิน',
+    'Cash_In': 'เงินสดเข้าตัว'
+}
+
+
+def empty_ledger():
+    return pd.DataFrame(columns=LEDGER_COLS)
+
+
+@perf.timed("ledger.normalize")
+def normalize_ledger(df):
+    if df.empty or len(df.columns) < len(LEDGER_COLS) - 1:  # ชีตรุ่นก่อนขาด รหัสแถว ได้
+        return empty_ledger()
+
+    df = df.rename(columns={k: v for k, v in COL_MAP.items() if k in df.columns})
+
+    for col in LEDGER_COLS:
+        if col not in df.columns:
+            df[col] = 0.0 if col in NUM_COLS else ""
+
+    for col in NUM_COLS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    df['วันที่'] = pd.to_datetime(df['วันที่'], errors='coerce')
+    return df[LEDGER_COLS]
+
+
+# --- SHEET I/O ---
+# ทุกฟังก์ชันรับ conn ที่หน้าตาเหมือน GSheetsConnection (read/update/client)
+# จึงทดสอบกับตัวจำลองใน fake_gsheets.py ได้โดยไม่ต้องต่อเน็ต
+_header_cache = {}
+
+
+@perf.timed("sheets.read")
+def read_ledger(conn, worksheet, ttl=600):
+    return normalize_ledger(conn.read(worksheet=worksheet, ttl=ttl))
+
+
+@perf.timed("sheets.update")
+def overwrite_ledger(conn, worksheet, df):
+    # เขียนทับทั้งชีต: ใช้เฉพาะการแก้ไขแบบ bulk (แก้ตาราง/ล้างข้อมูล)
+    df_save = df.copy()
+    if 'วันที่' in df_save.columns:
+        df_save['วันที่'] = df_save['วันที่'].map(_cell)
+    conn.update(worksheet=worksheet, data=df_save)
+    _header_cache[worksheet] = list(df_save.columns)
+
+
+def _cell(val):
+    if val is None:
+        return ""
+    if val is pd.NaT:
+        return ""
+    if isinstance(val, datetime.datetime):
+        return val.strftime('%Y-%m-%d') if val.time() == datetime.time() else val.isoformat(sep=' ')
+    if isinstance(val, datetime.date):
+        return val.isoformat()
+    if isinstance(val, float) and math.isnan(val):
+        return ""
+    if hasattr(val, "item"):  # numpy scalar
+        return val.item()
+    return val
+
+
+def _sheet_header(ws, worksheet):
+    if worksheet not in _header_cache:
+        _header_cache[worksheet] = [h for h in ws.row_values(1) if h]
+    return _header_cache[worksheet]
+
+
+def _padded(row, header):
+    return list(row) + [""] * (len(header) - len(row))
+
+
+def _writable_header(ws, worksheet):
+    # หัวชีตก่อนเขียน: ชีตรุ่นก่อนที่ยังไม่มีคอลัมน์ของ ledger (รหัสแถว) เติมต่อท้ายหัวเดิม
+    header = _sheet_header(ws, worksheet)
+    missing = [c for c in LEDGER_COLS if c not in {COL_MAP.get(h, h) for h in header}]
+    if header and missing:
+        header = header + missing
+        ws.batch_update([{"range": f"A1:{_col_letter(len(header))}1", "values": [header]}],
+                        value_input_option="RAW")
+        _header_cache[worksheet] = header
+    return header
+
+
+@perf.timed("sheets.append")
+def append_rows(conn, worksheet, rows):
+    # ส่งเฉพาะแถวใหม่ (ครั้งเดียวต่อ batch) แทนการอัปโหลดทั้ง ledger
+    if isinstance(rows, dict):
+        rows = [rows]
+    if isinstance(rows, pd.DataFrame):
+        rows = rows.to_dict("records")
+    if not rows:
+        return 0
+
+    ws = select_worksheet(conn, worksheet)
+    header = _writable_header(ws, worksheet)
+    values = []
+    if not header:
+        header = list(LEDGER_COLS)
+        values.append(header)
+        _header_cache[worksheet] = header
+
+    # เรียงค่าตามหัวคอลัมน์ของชีตจริง (รองรับหัวภาษาอังกฤษแบบเก่า)
+    keys = [COL_MAP.get(h, h) for h in header]
+    for row in rows:
+        values.append([_cell(row.get(k, "")) for k in keys])
+
+    ws.append_rows(values, value_input_option="USER_ENTERED")
+    return len(rows)
+
+
+# --- SHARED CONNECTION (ใช้ร่วมทั้ง process) ---
+# สร้าง connection ตอนใช้ครั้งแรกจริง ๆ ไม่ใช่ตอนเปิดแอป; ทุก backend ของชีต (รวมพาร์ทิชัน) ใช้ตัวเดียวกัน
+# ไม่ได้ใช้นานเกิน check_every วินาที: เช็กด้วยการอ่านหัวชีต ping_sheet ก่อน ไม่ผ่านก็ reconnect
+# read/update (ส่งซ้ำได้) ล้มด้วยปัญหาเครือข่าย/token: reconnect แล้วลองอีก 1 ครั้ง
+# handle ของ spreadsheet/worksheet เก็บไว้ (client._select_worksheet เปิด spreadsheet + หา worksheet ใหม่ทุกครั้ง = 2 API call)
+# select_worksheet(conn, ชื่อ) ใช้แทน conn.client._select_worksheet ทุกที่ (ยกเว้น ping ที่ต้องวิ่งถึง Google จริง)
+# ล้างทิ้งเมื่อ reconnect, ตอน ping ทุก check_every วินาที และเมื่อสร้าง worksheet ชื่อนั้นใหม่
+def _transient(e):
+    return isinstance(e, OSError) or type(e).__name__ in ("APIError", "RefreshError", "TransportError")
+
+
+def _missing(e):
+    # ยังไม่มี worksheet นี้ (คนขับใหม่/ยังไม่เคยเขียน): gspread.WorksheetNotFound ไม่ต้อง import gspread
+    return type(e).__name__ == "WorksheetNotFound"
+
+
+def select_worksheet(conn, worksheet):
+    # SharedConnection คืน handle ที่เก็บไว้; connection แบบอื่น (เช่นในเทสต์) เปิดใหม่ทุกครั้ง
+    if isinstance(conn, SharedConnection):
+        return conn.select_worksheet(worksheet)
+    return conn.client._select_worksheet(worksheet=worksheet)
+
+
+def open_spreadsheet(conn):
+    if isinstance(conn, SharedConnection):
+        return conn.spreadsheet()
+    return conn.client._open_spreadsheet()
+
+
+class SharedConnection:
+    def __init__(self, factory, check_every=300, ping_sheet="Settings"):
+        self.factory = factory
+        self.check_every = check_every
+        self.ping_sheet = ping_sheet
+        self.reconnects = 0
+        self._conn = None
+        self._checked = 0.0
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        with self._lock:
+            if self._conn is None:
+                with perf.span("sheets.connect"):
+                    self._conn = self.factory()
+            elif time.monotonic() - self._checked > self.check_every:
+                self._forget()  # worksheet อาจถูกลบ/สร้างใหม่จากที่อื่นระหว่างนั้น
+                try:
+                    with perf.span("sheets.ping"):
+                        self._conn.client._select_worksheet(worksheet=self.ping_sheet).row_values(1)
+                except Exception as e:
+                    if not _missing(e):  # ชีตยังไม่มีแต่ต่อได้ = connection ยังใช้ได้
+                        self._reconnect()
+            self._checked = time.monotonic()
+            return self._conn
+
+    def _forget(self, worksheet=None):
+        if worksheet is None:
+            self._spreadsheet = None
+            self._worksheets = {}
+        else:
+            self._worksheets.pop(worksheet, None)
+
+    def _reconnect(self):
+        # st.connection ถูก cache ไว้ในตัว: reset() ให้สร้าง client ใหม่ ส่วน connection แบบอื่นสร้างใหม่จาก factory
+        self.reconnects += 1
+        self._forget()
+        with perf.span("sheets.connect"):
+            if hasattr(self._conn, "reset"):
+                self._conn.reset()
+            else:
+                self._conn = self.factory()
+
+    def _call(self, method, retry, **kwargs):
+        conn = self._connection()
+        try:
+            return getattr(conn, method)(**kwargs)
+        except Exception as e:
+            if not retry or not _transient(e):
+                raise
+            with self._lock:
+                if self._conn is conn:
+                    self._reconnect()
+            return getattr(self._connection(), method)(**kwargs)
+
+    @property
+    def client(self):
+        return self._connection().client
+
+    def spreadsheet(self):
+        conn = self._connection()
+        with self._lock:
+            if self._spreadsheet is None:
+                with perf.span("sheets.open"):
+                    self._spreadsheet = conn.client._open_spreadsheet()
+            return self._spreadsheet
+
+    def select_worksheet(self, worksheet):
+        # หาจาก spreadsheet ที่เปิดไว้แล้ว (1 API call) ยังไม่มีชีตนี้: WorksheetNotFound ส่งต่อให้ผู้เรียก
+        # (ไม่เก็บผลว่าไม่มี จะได้เจอชีตทันทีที่ถูกสร้าง)
+        with self._lock:
+            ws = self._worksheets.get(worksheet)
+        if ws is None:
+            spreadsheet = self.spreadsheet()
+            with perf.span("sheets.open"):
+                ws = spreadsheet.worksheet(worksheet)
+            with self._lock:
+                if self._spreadsheet is spreadsheet:
+                    self._worksheets[worksheet] = ws
+        return ws
+
+    def read(self, **kwargs):
+        return self._call("read", True, **kwargs)
+
+    def update(self, **kwargs):
+        return self._call("update", True, **kwargs)
+
+    def create(self, **kwargs):
+        with self._lock:
+            self._forget(kwargs.get("worksheet"))
+        return self._call("create", False, **kwargs)
+
+
+# --- STORAGE ENGINES ---
+# ทุก backend มีหน้าตาเดียวกัน: read / append / overwrite / read_settings / write_settings
+# driver_app.py เลือก backend จาก config ([storage] ใน secrets.toml หรือ env DRIVER_STORAGE)
+DEFAULT_SETTINGS = {"ev_rate": 50.0, "target_income": 2000.0}
+ROLLUP_DAILY_COLS = ['กำไรสุทธิ', 'รายรับรวม', 'รายจ่ายรวม', 'เงินสดเข้าตัว', 'ระยะทาง', 'ชั่วโมงขับ', 'จำนวนงาน']
+ROLLUP_APP_COLS = ['ยอดหน้าแอป', 'เติมเอง', 'หักส่วนต่าง', 'เครดิตเข้า Wallet', 'รายรับสุทธิ', 'จำนวนงาน']
+
+
+# --- DATA VERSIONS ---
+# เลขรุ่นข้อมูลต่อ worksheet ใช้ร่วมทั้ง process: cache ในแอปผูก key กับ (worksheet, version)
+# เขียนข้อมูลแล้ว bump() เฉพาะ worksheet นั้น แทนการล้าง cache ทุกตัวด้วย st.cache_data.clear()
+class DataVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def get(self, worksheet):
+        with self._lock:
+            return self._versions.get(worksheet, 0)
+
+    def bump(self, worksheet):
+        with self._lock:
+            self._versions[worksheet] = self._versions.get(worksheet, 0) + 1
+            return self._versions[worksheet]
+
+
+class LedgerStorage:
+    name = "base"
+    worksheet = "Drivers"
+    settings_sheet = "Settings"
+    month = None  # พาร์ทิชันรายเดือน "YYYY-MM" (None = ทั้ง ledger)
+    partitioned = False
+
+    def read(self, start=None, end=None):
+        raise NotImplementedError
+
+    # backend ทั่วไปมีพาร์ทิชันเดียวคือตัวเอง (PartitionedStorage คืนพาร์ทิชันรายเดือนที่ทับช่วงวันที่)
+    def partitions(self, start=None, end=None):
+        return [self]
+
+    def create(self):
+        pass
+
+    def read_manifest(self):
+        raise NotImplementedError
+
+    def write_manifest(self, manifest):
+        raise NotImplementedError
+
+    # อ่านแบบเพิ่มเติม: mark=None อ่านทั้งหมด; ไม่งั้นคืนเฉพาะแถวที่เพิ่มหรือถูกแก้หลัง mark
+    # (แถวที่ถูกแก้มีรหัสแถวเดิม ผู้เรียกแทนที่แถวที่รหัสตรงกัน)
+    # คืน (rows, mark ใหม่) หรือ (None, None) เมื่อ mark ใช้ไม่ได้แล้ว (มีการเขียนทับ/ลบ) ต้องอ่านใหม่ทั้งหมด
+    def read_since(self, mark=None):
+        if mark is not None:
+            return None, None
+        return self.read(), None
+
+    def append(self, rows):
+        raise NotImplementedError
+
+    # รหัสแถวของ rows ที่มีอยู่ใน backend แล้ว: ใช้ตัดแถวที่ outbox ส่งซ้ำ (ส่งสำเร็จแต่ลบออกจาก outbox ไม่ทัน)
+    def existing_ids(self, rows):
+        return set()
+
+    def overwrite(self, df):
+        raise NotImplementedError
+
+    # แก้ไขเฉพาะแถว: pairs = [(แถวเดิม, แถวใหม่)] ดู plan_edits()
+    def apply_edits(self, pairs):
+        raise NotImplementedError
+
+    def read_settings(self):
+        raise NotImplementedError
+
+    def write_settings(self, settings):
+        raise NotImplementedError
+
+    # rollup รายวัน: backend ที่ไม่รองรับจะคืน None ให้สร้างใหม่จาก ledger
+    def read_rollup(self, n_rows):
+        return None
+
+    def write_rollup(self, rollup, n_rows, days=None):
+        pass
+
+
+def filter_dates(df, start=None, end=None):
+    if start is not None:
+        df = df[df['วันที่'] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df['วันที่'] <= pd.Timestamp(end)]
+    return df
+
+
+def to_records(rows):
+    # แถวเป็น list ของ dict ค่าพื้นฐาน (str/int/float) ตามลำดับ LEDGER_COLS พร้อมเขียนลง backend / JSON
+    if isinstance(rows, dict):
+        rows = [rows]
+    if isinstance(rows, pd.DataFrame):
+        rows = rows.to_dict("records")
+    return [{c: _cell(row.get(c, 0.0 if c in NUM_COLS else "")) for c in LEDGER_COLS} for row in rows]
+
+
+def _num(val):
+    try:
+        return round(float(val), 2)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _value(col, val):
+    # ค่าในรูปแบบที่เทียบกันได้ (ตัวเลขปัดทศนิยม 2 ตำแหน่ง ข้อความตัดช่องว่าง)
+    return _num(val) if col in NUM_COLS else str(val).strip()
+
+
+def row_key(record):
+    rec = to_records(record)[0]
+    return tuple(_value(c, rec[c]) for c in CONTENT_COLS)
+
+
+def legacy_row_id(record):
+    # รหัสของแถวรุ่นก่อน (ยังไม่มีรหัส) คำนวณจากค่าในแถว: หลายเครื่องที่แก้แถวเดียวกันจากสำเนาเดิมได้รหัสเดียวกัน
+    digest = hashlib.blake2b(repr(row_key(record)).encode(), digest_size=8).digest()
+    return f"r{int.from_bytes(digest, 'big') >> 4 or 1:015x}"
+
+
+def plan_edits(df, pairs):
+    # pairs: [(แถวเดิม, แถวใหม่)] รูปแบบชีต; แถวเดิม None = แถวใหม่, แถวใหม่ None = ลบแถว
+    # หาแถวเดิมใน df ด้วยรหัสแถว; แถวเดิมรุ่นก่อนที่ยังไม่มีรหัส: ด้วยค่าในแถว (แถวละครั้ง)
+    # ถ้าไม่พบ (เครื่องอื่นแก้ไปก่อนแล้ว) ด้วยรหัสที่แถวนั้นได้ตอนถูกแก้ครั้งแรก (legacy_row_id)
+    # คืน (updates {index: แถวใหม่}, deletes [index], inserts [แถวใหม่])
+    # แถวเดิม = ค่าที่เครื่องนั้นเห็นตอนเริ่มแก้: ถ้าแถวปัจจุบันต่างไป (เครื่องอื่นแก้ระหว่างนั้น)
+    # เขียนเฉพาะช่องที่คู่นี้แก้ลงบนแถวปัจจุบัน ช่องอื่นคงค่าที่เครื่องอื่นแก้ไว้
+    # แถวเดิมที่หาไม่พบ (ถูกลบไปแล้วที่อื่น) ถ้ามีแถวใหม่จะเพิ่มเป็นแถวใหม่แทน การแก้ไขจึงไม่หาย
+    # df ต้องมีแถวที่รหัสตรงกับแถวใหม่ที่เพิ่มด้วย (ถ้ามี) แถวใหม่ที่เพิ่มไปแล้วจึงไม่ถูกเพิ่มซ้ำ
+    current = dict(zip(df.index, to_records(df)))
+    by_id, slots = {}, {}
+    for label, row in current.items():
+        if row[ROW_ID]:
+            by_id[row[ROW_ID]] = label
+        slots.setdefault(row_key(row), []).append(label)
+    updates, deletes, inserts = {}, [], []
+    for old, new in pairs:
+        label = None
+        if old is not None:
+            old = to_records(old)[0]
+            if old[ROW_ID]:
+                label = by_id.get(old[ROW_ID])
+            else:
+                found = slots.get(row_key(old))
+                label = found.pop(0) if found else by_id.get(legacy_row_id(old))
+        elif new is not None and to_records(new)[0][ROW_ID] in by_id:
+            continue  # แถวใหม่ที่มีอยู่แล้ว: คู่นี้ถูกส่งซ้ำ (outbox ส่งแบบอย่างน้อยหนึ่งครั้ง)
+        if label is None:
+            if new is not None:
+                inserts.append(new)
+        elif new is None:
+            deletes.append(label)
+            by_id.pop(updates.pop(label, current[label])[ROW_ID], None)
+        else:
+            base, new = updates.get(label, current[label]), to_records(new)[0]
+            merged = {c: new[c] if _value(c, new[c]) != _value(c, old[c]) else base[c] for c in LEDGER_COLS}
+            merged[ROW_ID] = base[ROW_ID] or merged[ROW_ID]  # แถวที่มีรหัสแล้วใช้รหัสเดิมเสมอ
+            updates[label] = merged
+            if merged[ROW_ID]:
+                by_id[merged[ROW_ID]] = label
+    return updates, deletes, inserts
+
+
+def _runs(numbers):
+    # [3, 4, 5, 9] -> [(3, 5), (9, 9)]
+    runs = []
+    for n in sorted(numbers):
+        if runs and runs[-1][1] == n - 1:
+            runs[-1] = (runs[-1][0], n)
+        else:
+            runs.append((n, n))
+    return runs
+
+
+LEGACY_CHANGE = "*"
+
+
+class GSheetsStorage(LedgerStorage):
+    name = "gsheets"
+
+    # ttl=0: ไม่ให้ connector cache ซ้อน (แอป cache ผลอ่านตามเลขรุ่นข้อมูลเอง)
+    def __init__(self, conn, worksheet="Drivers", settings_sheet="Settings", ttl=0, manifest_sheet="Partitions"):
+        self.conn = conn
+        self.worksheet = worksheet
+        self.settings_sheet = settings_sheet
+        self.manifest_sheet = manifest_sheet
+        self.ttl = ttl
+
+    def create(self):
+        self.conn.create(worksheet=self.worksheet, data=empty_ledger())
+        _header_cache[self.worksheet] = list(LEDGER_COLS)
+
+    @perf.timed("sheets.read_manifest")
+    def read_manifest(self):
+        try:
+            df = self.conn.read(worksheet=self.manifest_sheet, ttl=self.ttl)
+        except Exception:  # ยังไม่มี worksheet manifest
+            return {}
+        if df.empty or 'Month' not in df.columns or 'Worksheet' not in df.columns:
+            return {}
+        return dict(zip(df['Month'].astype(str), df['Worksheet'].astype(str)))
+
+    @perf.timed("sheets.write_manifest")
+    def write_manifest(self, manifest):
+        data = pd.DataFrame({'Month': list(manifest), 'Worksheet': list(manifest.values())})
+        try:
+            self.conn.update(worksheet=self.manifest_sheet, data=data)
+        except Exception:
+            self.conn.create(worksheet=self.manifest_sheet, data=data)
+
+    def read(self, start=None, end=None):
+        # ชีตไม่มี index: อ่านทั้งชีตแล้วค่อยกรองช่วงวันที่
+        try:
+            df = read_ledger(self.conn, self.worksheet, ttl=self.ttl)
+        except Exception as e:
+            if not _missing(e):
+                raise
+            return empty_ledger()  # คนขับใหม่: สร้างชีตตอนบันทึกครั้งแรก
+        return filter_dates(df, start, end)
+
+    @property
+    def changes_sheet(self):
+        # บันทึกการแก้แถวเดิม (รหัสแถวละบรรทัด) ให้เครื่องอื่นรู้ว่าต้องดึงแถวไหนใหม่; ชื่อคนขับมี '.' ไม่ได้ จึงไม่ชนกัน
+        return f"{self.worksheet}.changes"
+
+    def _log_since(self, n_log=0, anchor=None):
+        # รายการใน changes_sheet ต่อจากรายการที่ n_log (เทียบ anchor แบบเดียวกับ ledger)
+        # คืน (รหัสที่เปลี่ยน, n_log ใหม่, anchor ใหม่) หรือ None ถ้าบันทึกถูกล้าง/สร้างใหม่
+        try:
+            ws = select_worksheet(self.conn, self.changes_sheet)
+        except Exception as e:
+            if not _missing(e):
+                raise
+            return ([], 0, None) if not n_log else None  # ยังไม่เคยมีการแก้ไข
+        entries = [r[0] if r else "" for r in ws.get_values(f"A{n_log + 1 if n_log else 2}:A")]
+        if n_log:
+            if not entries or entries[0] != anchor:
+                return None
+            entries = entries[1:]
+        return entries, n_log + len(entries), entries[-1] if entries else anchor
+
+    def _log_changes(self, ids):
+        if not ids:
+            return
+        try:
+            ws = select_worksheet(self.conn, self.changes_sheet)
+        except Exception as e:
+            if not _missing(e):
+                raise
+            self.conn.create(worksheet=self.changes_sheet, data=pd.DataFrame(columns=[ROW_ID]))
+            ws = select_worksheet(self.conn, self.changes_sheet)
+        ws.append_rows([[i] for i in ids], value_input_option="RAW")
+
+    @perf.timed("sheets.read_since")
+    def read_since(self, mark=None):
+        # mark = (จำนวนแถวข้อมูล, ค่าดิบของแถวสุดท้าย, จำนวนรายการใน changes_sheet, รายการสุดท้าย)
+        # อ่านต่อจากแถวสุดท้ายที่รู้จัก: ทุกครั้งอ่านแถวนั้นซ้ำมาเทียบกับ anchor ถ้าเปลี่ยนไป
+        # (ชีตถูกเขียนทับ/ลบหรือแทรกแถว) ถือว่า mark ใช้ไม่ได้
+        # แถวเดิมที่เครื่องอื่นแก้: รหัสอยู่ใน changes_sheet ดึงเฉพาะแถวเหล่านั้นมาด้วย (ผู้เรียกแทนที่ตามรหัสแถว)
+        # อ่านทั้งชีต (mark=None) ก็อ่านค่าดิบแบบเดียวกัน anchor จึงเทียบกับค่าที่ delta อ่านได้ตรงกัน
+        try:
+            ws = select_worksheet(self.conn, self.worksheet)
+        except Exception as e:
+            if not _missing(e):
+                raise
+            return (empty_ledger(), (0, None, 0, None)) if mark is None or not mark[0] else (None, None)
+        if mark is None:
+            _header_cache.pop(self.worksheet, None)  # อ่านหัวใหม่ด้วย (เครื่องอื่นอาจเพิ่มคอลัมน์)
+        n_rows, anchor, n_log, log_anchor = mark or (0, None, 0, None)
+        log = self._log_since(n_log, log_anchor)
+        if log is None:
+            return None, None
+        changed, n_log, log_anchor = log
+        header = _sheet_header(ws, self.worksheet)
+        if not header:
+            return (empty_ledger(), (0, None, n_log, log_anchor)) if not n_rows else (None, None)
+        last_col = _col_letter(len(header))
+        # ชีตจริงตัดเซลล์ว่างท้ายแถว: เติมให้ครบก่อนเทียบ/เก็บ
+        rows = [_padded(r, header) for r in ws.get_values(f"A{n_rows + 1 if n_rows else 2}:{last_col}")]
+        edited = []
+        if n_rows:
+            if not rows or rows[0] != anchor:
+                return None, None
+            rows = rows[1:]
+            changed = set(changed)
+            if LEGACY_CHANGE in changed:
+                return None, None  # แถวที่ยังไม่มีรหัสถูกแก้: แทนที่ตามรหัสไม่ได้
+            if changed:
+                col = self._id_column(header)
+                at = [i for i, r in enumerate(ws.get_values(f"{col}2:{col}")[:n_rows]) if r and r[0] in changed]
+                if at:
+                    got = ws.batch_get([f"A{i + 2}:{last_col}{i + 2}" for i in at])
+                    edited = [_padded(r[0] if r else [], header) for r in got]
+        last = rows[-1] if rows else anchor
+        rows = edited + rows
+        df = normalize_ledger(pd.DataFrame(rows, columns=header)) if rows else empty_ledger()
+        return df, (n_rows + len(rows) - len(edited), last, n_log, log_anchor)
+
+    def append(self, rows):
+        try:
+            return append_rows(self.conn, self.worksheet, rows)
+        except Exception as e:
+            if not _missing(e):
+                raise
+            self.create()  # คนขับใหม่: ยังไม่มีชีต สร้างตอนบันทึกครั้งแรก
+            return append_rows(self.conn, self.worksheet, rows)
+
+    def existing_ids(self, rows):
+        # อ่านคอลัมน์รหัสแถวคอลัมน์เดียว
+        wanted = {r[ROW_ID] for r in to_records(rows) if r[ROW_ID]}
+        try:
+            ws = select_worksheet(self.conn, self.worksheet)
+        except Exception as e:
+            if not _missing(e):
+                raise
+            return set()
+        header = _sheet_header(ws, self.worksheet)
+        if not wanted or ROW_ID not in [COL_MAP.get(h, h) for h in header]:
+            return set()
+        col = self._id_column(header)
+        return {r[0] for r in ws.get_values(f"{col}2:{col}") if r and r[0] in wanted}
+
+    def overwrite(self, df):
+        overwrite_ledger(self.conn, self.worksheet, df)
+
+    EDIT_ATTEMPTS = 3
+
+    @perf.timed("sheets.apply_edits")
+    def apply_edits(self, pairs):
+        # เขียนเฉพาะแถวที่เปลี่ยน: แถวที่แก้ส่งใน batch_update ครั้งเดียว ลบแถวจากล่างขึ้นบน แถวใหม่ต่อท้าย
+        # ไม่อ่านทั้งชีต: อ่านคอลัมน์รหัสแถวคอลัมน์เดียวหาตำแหน่ง แล้วอ่านเฉพาะแถวเป้าหมายมาวางแผน (plan_edits)
+        # ก่อนเขียนอ่านรหัสของแถวเป้าหมายซ้ำ ถ้าแถวเลื่อน (เครื่องอื่นลบ/แทรกระหว่างนั้น) วางแผนใหม่
+        try:
+            ws = select_worksheet(self.conn, self.worksheet)
+        except Exception as e:
+            if not _missing(e):
+                raise
+            self.create()
+            ws = select_worksheet(self.conn, self.worksheet)
+        header = _writable_header(ws, self.worksheet)
+        for _ in range(self.EDIT_ATTEMPTS):
+            rows, df = self._edit_targets(ws, header, pairs)
+            updates, deletes, inserts = plan_edits(df, pairs)
+            if not self._still_at(ws, header, rows, list(updates) + deletes):
+                continue
+            if updates:
+                keys = [COL_MAP.get(h, h) for h in header]
+                last = _col_letter(len(header))
+                data = []
+                for i, new in updates.items():
+                    rec = to_records(new)[0]
+                    # คอลัมน์ที่ไม่อยู่ใน ledger (เช่นหัวเก่า) คงค่าเดิมไว้
+                    values = [rec[k] if k in rec else rows[i][j] for j, k in enumerate(keys)]
+                    data.append({"range": f"A{i + 2}:{last}{i + 2}", "values": [values]})
+                ws.batch_update(data, value_input_option="USER_ENTERED")
+                # แถวที่เดิมไม่มีรหัสบันทึกเป็น LEGACY_CHANGE: เครื่องอื่นอ่านใหม่ทั้งชีต
+                self._log_changes([new[ROW_ID] if df.at[i, ROW_ID] else LEGACY_CHANGE for i, new in updates.items()])
+            for start, end in reversed(_runs(i + 2 for i in deletes)):
+                ws.delete_rows(start, end)
+            if inserts:
+                append_rows(self.conn, self.worksheet, inserts)
+            return len(updates) + len(deletes) + len(inserts)
+        raise RuntimeError(f"แถวในชีต {self.worksheet} เลื่อนระหว่างแก้ไข {self.EDIT_ATTEMPTS} ครั้งติด ลองใหม่ภายหลัง")
+
+    def _id_column(self, header):
+        return _col_letter([COL_MAP.get(h, h) for h in header].index(ROW_ID) + 1)
+
+    def _edit_targets(self, ws, header, pairs):
+        # ({เลขแถวข้อมูล: ค่าดิบ}, df ของแถวเหล่านั้น index = เลขแถวข้อมูล) สำหรับ plan_edits
+        if not header:
+            return {}, empty_ledger()
+        col = self._id_column(header)
+        positions = {}
+        for i, r in enumerate(ws.get_values(f"{col}2:{col}")):
+            if r and r[0]:
+                positions.setdefault(r[0], i)
+        olds = [to_records(old)[0] for old, _ in pairs if old is not None]
+        news = [to_records(new)[0] for old, new in pairs if old is None and new is not None]
+        wanted = {positions.get(old[ROW_ID] or legacy_row_id(old)) for old in olds}
+        wanted = (wanted | {positions.get(new[ROW_ID]) for new in news}) - {None}
+        if any(not old[ROW_ID] and legacy_row_id(old) not in positions for old in olds):
+            wanted = None  # แถวรุ่นก่อนที่ยังไม่มีรหัส: ต้องหาด้วยค่าในแถว อ่านทั้งชีต (ครั้งแรกครั้งเดียว)
+        last = _col_letter(len(header))
+        if wanted is None:
+            got = ws.get_values(f"A2:{last}")
+            labels = range(len(got))
+        else:
+            labels = sorted(wanted)
+            got = [r[0] if r else [] for r in ws.batch_get([f"A{i + 2}:{last}{i + 2}" for i in labels])] if labels else []
+        rows = {i: _padded(r, header) for i, r in zip(labels, got)}
+        if not rows:
+            return rows, empty_ledger()
+        return rows, normalize_ledger(pd.DataFrame(list(rows.values()), columns=header, index=list(rows)))
+
+    def _still_at(self, ws, header, rows, labels):
+        # แถวเป้าหมายในชีตตอนนี้ยังตรงกับที่อ่านมาวางแผนไว้ทุกแถวไหม (แถวเลื่อน/ถูกแก้ระหว่างนั้น = ไม่ตรง)
+        if not labels:
+            return True
+        last = _col_letter(len(header))
+        got = ws.batch_get([f"A{i + 2}:{last}{i + 2}" for i in labels])
+        return all(_padded(r[0] if r else [], header) == rows[i] for i, r in zip(labels, got))
+
+    @perf.timed("sheets.read_settings")
+    def read_settings(self):
+        try:
+            df = self.conn.read(worksheet=self.settings_sheet, ttl=self.ttl)
+        except Exception as e:
+            if not _missing(e):
+                raise
+            return dict(DEFAULT_SETTINGS)
+        if not df.empty and 'Key' in df.columns and 'Value' in df.columns:
+            return dict(zip(df['Key'], df['Value']))
+        return dict(DEFAULT_SETTINGS)
+
+    @perf.timed("sheets.write_settings")
+    def write_settings(self, settings):
+        data = pd.DataFrame([{'Key': k, 'Value': str(v)} for k, v in settings.items()])
+        try:
+            self.conn.update(worksheet=self.settings_sheet, data=data)
+        except Exception:  # คนขับใหม่: ยังไม่มีชีต settings
+            self.conn.create(worksheet=self.settings_sheet, data=data)
+
+
+def _col_letter(n):
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def _q(col):
+    return '"' + col.replace('"', '""') + '"'
+
+
+class SQLiteStorage(LedgerStorage):
+    # ฐานข้อมูลในเครื่อง: มี index ตามวันที่ และแก้ไขรายแถวได้ด้วย rowid
+    name = "local"
+
+    def __init__(self, path="driver_data.db", table="ledger"):
+        self.path = path
+        self.table = table
+        self.worksheet = table
+        self.settings_sheet = "settings"
+        with closing(self._connect()) as db, db:
+            cols = ", ".join(f"{_q(c)} {'REAL' if c in NUM_COLS else 'TEXT'}" for c in LEDGER_COLS)
+            db.execute(f"CREATE TABLE IF NOT EXISTS {_q(table)} (id INTEGER PRIMARY KEY AUTOINCREMENT, {cols})")
+            if ROW_ID not in [row[1] for row in db.execute(f"PRAGMA table_info({_q(table)})")]:
+                db.execute(f"ALTER TABLE {_q(table)} ADD COLUMN {_q(ROW_ID)} TEXT")  # ฐานข้อมูลก่อนมีรหัสแถว
+            db.execute(f"CREATE INDEX IF NOT EXISTS {_q(table + '_date')} ON {_q(table)} ({_q('วันที่')}, {_q('เวลา')})")
+            db.execute(f"CREATE INDEX IF NOT EXISTS {_q(table + '_row_id')} ON {_q(table)} ({_q(ROW_ID)})")
+            db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS partitions (month TEXT PRIMARY KEY, name TEXT)")
+            db.execute(f"CREATE TABLE IF NOT EXISTS rollup_daily ({_q('วันที่')} TEXT PRIMARY KEY, "
+                       + ", ".join(f"{_q(c)} REAL" for c in ROLLUP_DAILY_COLS) + ")")
+            db.execute(f"CREATE TABLE IF NOT EXISTS rollup_app ({_q('วันที่')} TEXT, {_q('แอป')} TEXT, "
+                       + ", ".join(f"{_q(c)} REAL" for c in ROLLUP_APP_COLS)
+                       + f", PRIMARY KEY ({_q('วันที่')}, {_q('แอป')}))")
+
+    def _connect(self):
+        # เปิด connection ใหม่ทุกครั้ง: sqlite ผูก connection กับ thread ที่สร้าง
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    @staticmethod
+    def _records(rows):
+        return [[row[c] for c in LEDGER_COLS] for row in to_records(rows)]
+
+    @perf.timed("sqlite.read")
+    def read(self, start=None, end=None):
+        where, params = [], []
+        if start is not None:
+            where.append(f"{_q('วันที่')} >= ?"); params.append(_cell(pd.Timestamp(start)))
+        if end is not None:
+            where.append(f"{_q('วันที่')} <= ?"); params.append(_cell(pd.Timestamp(end)))
+        with closing(self._connect()) as db:
+            return self._select(db, where, params)
+
+    def _select(self, db, where, params):
+        sql = f"SELECT id, {', '.join(_q(c) for c in LEDGER_COLS)} FROM {_q(self.table)}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+        df = pd.read_sql_query(sql, db, params=params, index_col="id")
+        if df.empty:
+            return empty_ledger()
+        df['วันที่'] = pd.to_datetime(df['วันที่'], errors='coerce')
+        return df
+
+    @perf.timed("sqlite.read_since")
+    def read_since(self, mark=None):
+        # mark = (generation, id ล่าสุด): generation เพิ่มทุกครั้งที่เขียนทับ/แก้ไขแถวเดิม
+        with closing(self._connect()) as db:
+            generation = self._generation(db)
+            last_id = db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {_q(self.table)}").fetchone()[0]
+            if mark is not None and mark[0] != generation:
+                return None, None
+            since = 0 if mark is None else mark[1]
+            df = self._select(db, ["id > ?", "id <= ?"], [since, last_id])
+        return df, (generation, last_id)
+
+    @staticmethod
+    def _generation(db):
+        row = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    @staticmethod
+    def _bump_generation(db):
+        db.execute("INSERT INTO meta (key, value) VALUES ('generation', '1') "
+                   "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    def _insert(self, db, rows):
+        values = self._records(rows)
+        marks = ", ".join("?" for _ in LEDGER_COLS)
+        db.executemany(f"INSERT INTO {_q(self.table)} ({', '.join(_q(c) for c in LEDGER_COLS)}) VALUES ({marks})", values)
+        return len(values)
+
+    def _update(self, db, updates):
+        for rowid, changes in updates.items():
+            changes = {k: v for k, v in changes.items() if k in LEDGER_COLS}
+            if not changes:
+                continue
+            sets = ", ".join(f"{_q(k)} = ?" for k in changes)
+            db.execute(f"UPDATE {_q(self.table)} SET {sets} WHERE id = ?", [_cell(v) for v in changes.values()] + [int(rowid)])
+
+    @perf.timed("sqlite.append")
+    def append(self, rows):
+        with closing(self._connect()) as db, db:
+            return self._insert(db, rows)
+
+    def update_rows(self, updates):
+        # updates: {rowid: {คอลัมน์: ค่าใหม่}}
+        with closing(self._connect()) as db, db:
+            self._bump_generation(db)
+            self._update(db, updates)
+
+    @perf.timed("sqlite.apply_edits")
+    def apply_edits(self, pairs):
+        # หาแถวเดิมเฉพาะรหัสแถว/วันที่ของแถวที่แก้ (ใช้ index) แล้ว UPDATE/DELETE ด้วย id ใน transaction เดียว
+        olds = [to_records(old)[0] for old, _ in pairs if old is not None]
+        news = [to_records(new)[0] for old, new in pairs if old is None and new is not None]
+        ids = sorted({row[ROW_ID] for row in olds + news if row[ROW_ID]})
+        dates = sorted({old['วันที่'] for old in olds})
+        where = f"{_q('วันที่')} IN ({', '.join('?' for _ in dates)}) OR {_q(ROW_ID)} IN ({', '.join('?' for _ in ids)})"
+        with closing(self._connect()) as db, db:
+            df = self._select(db, [where], dates + ids) if olds or ids else empty_ledger()
+            updates, deletes, inserts = plan_edits(df, pairs)
+            self._bump_generation(db)
+            self._update(db, {i: to_records(new)[0] for i, new in updates.items()})
+            db.executemany(f"DELETE FROM {_q(self.table)} WHERE id = ?", [(int(i),) for i in deletes])
+            self._insert(db, inserts)
+        return len(updates) + len(deletes) + len(inserts)
+
+    def existing_ids(self, rows):
+        ids = sorted({r[ROW_ID] for r in to_records(rows) if r[ROW_ID]})
+        found = set()
+        with closing(self._connect()) as db:
+            for i in range(0, len(ids), 500):  # เพดานจำนวนพารามิเตอร์ของ SQLite
+                chunk = ids[i:i + 500]
+                sql = f"SELECT {_q(ROW_ID)} FROM {_q(self.table)} WHERE {_q(ROW_ID)} IN ({', '.join('?' for _ in chunk)})"
+                found.update(row_id for (row_id,) in db.execute(sql, chunk))
+        return found
+
+    @perf.timed("sqlite.overwrite")
+    def overwrite(self, df):
+        with closing(self._connect()) as db, db:
+            db.execute(f"DELETE FROM {_q(self.table)}")
+            self._bump_generation(db)
+        self.append(df)
+
+    def read_manifest(self):
+        with closing(self._connect()) as db:
+            return dict(db.execute("SELECT month, name FROM partitions ORDER BY month").fetchall())
+
+    def write_manifest(self, manifest):
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM partitions")
+            db.executemany("INSERT INTO partitions (month, name) VALUES (?, ?)", list(manifest.items()))
+
+    def read_settings(self):
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT key, value FROM settings").fetchall()
+        return dict(rows) if rows else dict(DEFAULT_SETTINGS)
+
+    def write_settings(self, settings):
+        with closing(self._connect()) as db, db:
+            db.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", [(k, str(v)) for k, v in settings.items()])
+
+    @perf.timed("sqlite.read_rollup")
+    def read_rollup(self, n_rows):
+        # ใช้ rollup ที่เก็บไว้ได้ก็ต่อเมื่อสร้างจาก ledger รุ่นเดียวกัน: generation (เพิ่มทุกครั้งที่แก้/ลบ/เขียนทับ)
+        # และจำนวนแถว (เพิ่มตอน append) ตรงกันทั้งคู่ แก้ไขที่จำนวนแถวเท่าเดิมจึงไม่ได้ rollup เก่า
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT value FROM meta WHERE key = 'rollup_stamp'").fetchone()
+            if row is None or row[0] != f"{self._generation(db)}:{n_rows}":
+                return None
+            daily = pd.read_sql_query("SELECT * FROM rollup_daily", db)
+            apps = pd.read_sql_query("SELECT * FROM rollup_app", db)
+        for df in (daily, apps):
+            df['วันที่'] = pd.to_datetime(df['วันที่'])
+        return {
+            "daily": daily.set_index('วันที่').sort_index(),
+            "apps": apps.set_index(['วันที่', 'แอป']).sort_index(),
+        }
+
+    @perf.timed("sqlite.write_rollup")
+    def write_rollup(self, rollup, n_rows, days=None):
+        daily = rollup["daily"]
+        apps = rollup["apps"]
+        if days is not None:
+            days = {pd.Timestamp(d) for d in days}
+            daily = daily[daily.index.isin(days)]
+            apps = apps[apps.index.get_level_values('วันที่').isin(days)]
+        with closing(self._connect()) as db, db:
+            if days is None:
+                db.execute("DELETE FROM rollup_daily")
+                db.execute("DELETE FROM rollup_app")
+            else:
+                keys = [(_cell(pd.Timestamp(d)),) for d in days]
+                db.executemany(f"DELETE FROM rollup_daily WHERE {_q('วันที่')} = ?", keys)
+                db.executemany(f"DELETE FROM rollup_app WHERE {_q('วันที่')} = ?", keys)
+            db.executemany(
+                f"INSERT INTO rollup_daily VALUES ({', '.join('?' * (len(ROLLUP_DAILY_COLS) + 1))})",
+                [(_cell(d),) + tuple(float(v) for v in vals) for d, vals in zip(daily.index, daily[ROLLUP_DAILY_COLS].values)])
+            db.executemany(
+                f"INSERT INTO rollup_app VALUES ({', '.join('?' * (len(ROLLUP_APP_COLS) + 2))})",
+                [(_cell(d), a) + tuple(float(v) for v in vals) for (d, a), vals in zip(apps.index, apps[ROLLUP_APP_COLS].values)])
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollup_stamp', ?)",
+                       (f"{self._generation(db)}:{n_rows}",))
+
+
+# ชนิดการเขียน: op ของ outbox (sync.py) และคิวสำเนาของ MirroredStorage
+APPEND = "append"
+OVERWRITE = "overwrite"
+EDIT = "edit"  # rows = [(แถวเดิม, แถวใหม่)] จากตารางแก้ไข (plan_edits)
+SETTINGS = "settings"  # rows = dict ค่าตั้งต้น
+MIGRATE = "migrate"
+
+
+class MirroredStorage(LedgerStorage):
+    # อ่าน/เขียนที่ primary (เร็ว) แล้วส่งสำเนาไป mirror (เช่น Google Sheets)
+    # สำเนาเข้าคิว outbox ของ mirror เอง (sync.SyncWorker) เน็ตหลุดก็ไม่หาย ส่งต่อเมื่อกลับมาออนไลน์
+    def __init__(self, primary, mirror, queue):
+        self.primary = primary
+        self.mirror = mirror
+        self.queue = queue
+        self.name = f"{primary.name}+{mirror.name}"
+        self.worksheet = primary.worksheet
+        self.settings_sheet = primary.settings_sheet
+        self.partitioned = primary.partitioned
+        if queue.pending():  # ค้างจากรอบก่อน
+            queue.start()
+
+    @property
+    def last_error(self):
+        return self.queue.last_error
+
+    def mirror_pending(self):
+        return self.queue.pending()
+
+    def _to_mirror(self, op, rows, scope=None):
+        self.queue.submit(op, rows, scope)
+        self.queue.start()
+
+    def read(self, start=None, end=None):
+        return self.primary.read(start, end)
+
+    def read_since(self, mark=None):
+        return self.primary.read_since(mark)
+
+    def partitions(self, start=None, end=None):
+        return self.primary.partitions(start, end)
+
+    def migrate(self):
+        n = self.primary.migrate()
+        self._to_mirror(MIGRATE, [])
+        return n
+
+    def needs_migration(self):
+        return self.primary.needs_migration()
+
+    def append(self, rows):
+        n = self.primary.append(rows)
+        self._to_mirror(APPEND, rows)
+        return n
+
+    def existing_ids(self, rows):
+        return self.primary.existing_ids(rows)
+
+    def apply_edits(self, pairs):
+        n = self.primary.apply_edits(pairs)
+        self._to_mirror(EDIT, pairs)
+        return n
+
+    def overwrite(self, df, months=None):
+        # months ส่งต่อเฉพาะเมื่อแบ่งพาร์ทิชัน (backend ธรรมดาไม่รับพารามิเตอร์นี้)
+        args = (df,) if months is None else (df, months)
+        self.primary.overwrite(*args)
+        self._to_mirror(OVERWRITE, df, months)
+
+    def read_settings(self):
+        return self.primary.read_settings()
+
+    def write_settings(self, settings):
+        self.primary.write_settings(settings)
+        self._to_mirror(SETTINGS, settings)
+
+    def read_rollup(self, n_rows):
+        return self.primary.read_rollup(n_rows)
+
+    def write_rollup(self, rollup, n_rows, days=None):
+        self.primary.write_rollup(rollup, n_rows, days)
+
+
+# --- MONTHLY PARTITIONS ---
+# ledger แยกเป็น worksheet/ตารางรายเดือน (เช่น Drivers_2026-10) + manifest เดือน -> ชื่อพาร์ทิชัน
+# อ่านเฉพาะเดือนที่ช่วงวันที่ต้องการ ขนาดการโหลดจึงไม่โตตามจำนวนปีที่บันทึกไว้
+# แถวที่อ่านวันที่ไม่ได้ไปอยู่พาร์ทิชันของเดือนปัจจุบัน
+def month_key(value):
+    return pd.Timestamp(value).strftime('%Y-%m')
+
+
+def record_month(record):
+    date = pd.to_datetime(to_records(record)[0]['วันที่'], errors='coerce')
+    return month_key(pd.Timestamp.now() if pd.isna(date) else date)
+
+
+def split_by_month(rows):
+    records = to_records(rows)
+    if not records:
+        return {}
+    dates = pd.to_datetime(pd.Series([r['วันที่'] for r in records], dtype=object), errors='coerce')
+    months = dates.dt.strftime('%Y-%m').fillna(month_key(pd.Timestamp.now()))
+    groups = {}
+    for month, rec in zip(months, records):
+        groups.setdefault(month, []).append(rec)
+    return groups
+
+
+class PartitionedStorage(LedgerStorage):
+    def __init__(self, root, make_part):
+        # root: backend ของชีตเดิม (ใช้เก็บ settings / manifest / rollup และเป็นต้นทางตอน migrate)
+        # make_part(name): สร้าง backend ของพาร์ทิชันหนึ่งเดือน
+        self.root = root
+        self.make_part = make_part
+        self.name = f"{root.name}/monthly"
+        self.partitioned = True
+        self.worksheet = root.worksheet
+        self.settings_sheet = root.settings_sheet
+        self._lock = threading.RLock()
+        self._manifest = None
+        self._parts = {}
+
+    def manifest(self):
+        with self._lock:
+            if self._manifest is None:
+                try:
+                    self._manifest = self.root.read_manifest()
+                except Exception:
+                    self._manifest = {}
+            return dict(self._manifest)
+
+    def needs_migration(self):
+        return not self.manifest()
+
+    def part(self, month):
+        with self._lock:
+            if month not in self._parts:
+                part = self.make_part(f"{self.worksheet}_{month}")
+                part.month = month
+                self._parts[month] = part
+            return self._parts[month]
+
+    def _ensure(self, months):
+        # สร้างพาร์ทิชันเดือนใหม่ + บันทึก manifest (เขียน manifest เฉพาะตอนมีเดือนใหม่)
+        with self._lock:
+            manifest = self.manifest()
+            new = sorted(set(months) - set(manifest))
+            for month in new:
+                self.part(month).create()
+                manifest[month] = self.part(month).worksheet
+            if new:
+                self.root.write_manifest(dict(sorted(manifest.items())))
+                self._manifest = manifest
+
+    def partitions(self, start=None, end=None):
+        lo = None if start is None else month_key(start)
+        hi = None if end is None else month_key(end)
+        return [self.part(m) for m in sorted(self.manifest())
+                if (lo is None or m >= lo) and (hi is None or m <= hi)]
+
+    def read(self, start=None, end=None):
+        frames = [p.read(start, end) for p in self.partitions(start, end)]
+        frames = [f for f in frames if not f.empty]
+        return pd.concat(frames, ignore_index=True) if frames else empty_ledger()
+
+    def append(self, rows):
+        groups = split_by_month(rows)
+        self._ensure(groups)
+        for month, records in groups.items():
+            self.part(month).append(records)
+        return sum(len(r) for r in groups.values())
+
+    def existing_ids(self, rows):
+        # ดูเฉพาะพาร์ทิชันของเดือนที่แถวจะไปอยู่ (ตาม split_by_month เดียวกับ append)
+        manifest = self.manifest()
+        found = set()
+        for month, records in split_by_month(rows).items():
+            if month in manifest:
+                found |= self.part(month).existing_ids(records)
+        return found
+
+    def overwrite(self, df, months=None):
+        # months = เดือนที่ผู้เรียกโหลดมาครบ (None = ทุกเดือน): เขียนทับเฉพาะเดือนเหล่านั้น
+        # แถวที่ย้ายไปเดือนที่ไม่ได้โหลดจะถูกต่อท้ายพาร์ทิชันนั้นแทน
+        groups = split_by_month(df)
+        targets = set(self.manifest()) if months is None else set(months)
+        self._ensure(set(groups) | targets)
+        for month in sorted(targets | set(groups)):
+            records = groups.get(month, [])
+            if month in targets:
+                self.part(month).overwrite(pd.DataFrame(records, columns=LEDGER_COLS))
+            elif records:
+                self.part(month).append(records)
+
+    def apply_edits(self, pairs):
+        # แถวที่ถูกแก้วันที่ข้ามเดือน = ลบจากพาร์ทิชันเดิม + เพิ่มในพาร์ทิชันของเดือนใหม่
+        groups = {}
+        for old, new in pairs:
+            if old is not None and new is not None and record_month(old) != record_month(new):
+                groups.setdefault(record_month(old), []).append((old, None))
+                groups.setdefault(record_month(new), []).append((None, new))
+            else:
+                groups.setdefault(record_month(new if old is None else old), []).append((old, new))
+        self._ensure(groups)
+        return sum(self.part(month).apply_edits(part_pairs) for month, part_pairs in sorted(groups.items()))
+
+    def migrate(self):
+        # คัดลอกชีตเดิมแยกรายเดือน (ชีตเดิมเก็บไว้เป็นสำรอง ไม่ลบ)
+        df = self.root.read()
+        self.overwrite(df, months=split_by_month(df).keys())
+        return len(df)
+
+    def read_settings(self):
+        return self.root.read_settings()
+
+    def write_settings(self, settings):
+        self.root.write_settings(settings)
+
+    def read_rollup(self, n_rows):
+        return self.root.read_rollup(n_rows)
+
+    def write_rollup(self, rollup, n_rows, days=None):
+        self.root.write_rollup(rollup, n_rows, days)
+
+
+# --- SETTINGS (write-through) ---
+# ค่าตั้งต้นอยู่ใน memory ของ process: อ่านจาก backend ครั้งแรก แล้วอ่านใหม่ทุก ttl วินาที (เครื่องอื่นอาจแก้)
+# update() เปลี่ยนค่าใน memory ทันที แล้วให้ thread เบื้องหลังบันทึกลง backend (เขียนเฉพาะค่าล่าสุด)
+# ระหว่างยังบันทึกไม่สำเร็จ (pending) ไม่อ่านทับค่าใน memory; บันทึกล้มจะลองใหม่ตอน get()/update() ครั้งถัดไป
+SETTINGS_TYPES = {"ev_rate": float, "target_income": float}
+
+
+def typed_settings(raw):
+    out = dict(DEFAULT_SETTINGS)
+    for key, value in (raw or {}).items():
+        cast = SETTINGS_TYPES.get(key)
+        if cast is None:
+            out[key] = value
+            continue
+        try:
+            out[key] = cast(value)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+class SettingsStore:
+    def __init__(self, backend, ttl=3600):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._values = None
+        self._loaded_at = 0.0
+        self._dirty = False
+        self._worker = None
+        self.last_error = None
+
+    def pending(self):
+        # มีค่าที่ยังไม่ได้บันทึกลง backend (กำลังเขียน หรือเขียนล้มรอลองใหม่)
+        with self._lock:
+            return self._dirty or self._writing()
+
+    def _writing(self):
+        return self._worker is not None and self._worker.is_alive()
+
+    def get(self):
+        with self._lock:
+            if self._dirty and not self._writing():
+                self._start()  # รอบก่อนบันทึกล้ม: ลองใหม่
+            expired = time.monotonic() - self._loaded_at > self.ttl
+            if self._values is None or (expired and not self._dirty and not self._writing()):
+                try:
+                    self._values = typed_settings(self.backend.read_settings())
+                except Exception as e:
+                    self.last_error = e
+                    if self._values is None:
+                        self._values = dict(DEFAULT_SETTINGS)
+                self._loaded_at = time.monotonic()
+            return dict(self._values)
+
+    def update(self, **values):
+        changed = typed_settings({**self.get(), **values})
+        with self._lock:
+            if changed == self._values:
+                return False
+            self._values = changed
+            self._dirty = True
+            if not self._writing():
+                self._start()
+        return True
+
+    def _start(self):
+        self._worker = threading.Thread(target=self._persist, name="settings-writer", daemon=True)
+        self._worker.start()
+
+    def _persist(self):
+        while True:
+            with self._lock:
+                if not self._dirty:
+                    self._worker = None
+                    return
+                snapshot = dict(self._values)
+                self._dirty = False
+            try:
+                self.backend.write_settings(snapshot)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                with self._lock:
+                    self._dirty = True  # ค่าล่าสุดยังไม่ได้บันทึก: ลองใหม่ตอน get()/update() ครั้งถัดไป
+                    self._worker = None
+                return
+
+    def flush(self, timeout=None):
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+        return not self._dirty
+
+
+# --- คนขับหลายคน ---
+# คนขับแต่ละคนมี ledger / settings / manifest ของตัวเอง: ชีต Drivers_<ID>, Settings_<ID>, Partitions_<ID>
+# และไฟล์ในเครื่อง driver_data_<ID>.db; คนขับเริ่มต้น (ID ว่าง) ใช้ชื่อเดิม ข้อมูลเก่าจึงไม่ต้องย้าย
+def driver_id(value):
+    # ตัดอักขระที่ใช้ในชื่อชีต/ไฟล์ไม่ได้ (รองรับชื่อภาษาไทย)
+    return re.sub(r"[\s\[\]:*?/\\'\"<>|.]", "", str(value or ""))[:40]
+
+
+def driver_path(path, driver):
+    if not driver:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{driver}{ext}"
+
+
+def storage_config(section=None):
+    # [storage] ใน secrets.toml + env: DRIVER_STORAGE = backend, DRIVER_ID = คนขับเริ่มต้น
+    config = {"backend": "gsheets"}
+    config.update(dict(section or {}))
+    if os.environ.get("DRIVER_STORAGE"):
+        config["backend"] = os.environ["DRIVER_STORAGE"]
+    if os.environ.get("DRIVER_ID"):
+        config["driver"] = os.environ["DRIVER_ID"]
+    return config
+
+
+_PARTITION_SUFFIX = re.compile(r"_\d{4}-\d{2}$")
+
+
+def list_drivers(config, gsheets_conn=None):
+    # คนขับทุกคนที่มี ledger อยู่ใน backend ("" = คนขับเริ่มต้น): ไฟล์ driver_data_<ID>.db หรือชีต Drivers_<ID>
+    if config.get("backend", "gsheets") == "local":
+        root, ext = os.path.splitext(config.get("path", "driver_data.db"))
+        found = [""] if os.path.exists(root + ext) else []
+        for path in sorted(glob.glob(f"{glob.escape(root)}_*{glob.escape(ext)}")):
+            found.append(path[len(root) + 1:len(path) - len(ext)])
+        return found
+    titles = [ws.title for ws in open_spreadsheet(gsheets_conn()).worksheets()]
+    # ข้ามพาร์ทิชันรายเดือน (Drivers_2024-05, Drivers_<ID>_2024-05) และบันทึกการแก้ไข (Drivers_<ID>.changes)
+    return [t[len("Drivers_"):] if t != "Drivers" else "" for t in titles
+            if (t == "Drivers" or t.startswith("Drivers_")) and not _PARTITION_SUFFIX.search(t) and "." not in t]
+
+
+def allowed_driver(requested, config, gsheets_conn=None):
+    # ?driver= ใน URL เปิดได้เฉพาะคนขับเริ่มต้น, คนขับใน [storage] drivers = [...] (ถ้ากำหนด)
+    # หรือคนขับที่มี ledger อยู่แล้วใน backend; คืน None = ไม่อนุญาต (ไม่สร้างชีต/ไฟล์ใหม่ตาม URL)
+    default, requested = driver_id(config.get("driver")), driver_id(requested)
+    if not requested or requested == default:
+        return default
+    if "drivers" in config:
+        allowed = {driver_id(d) for d in config["drivers"]}
+    else:
+        allowed = set(list_drivers(config, gsheets_conn))
+    return requested if requested in allowed else None
+
+
+def open_storage(config, gsheets_conn=None, driver=""):
+    # config: {"backend": "gsheets" | "local", "path": ..., "mirror": bool, "mirror_outbox": ..., "partition": "monthly"}
+    backend = config.get("backend", "gsheets")
+    monthly = config.get("partition") == "monthly"
+    suffix = f"_{driver}" if driver else ""
+
+    def sheets():
+        conn = gsheets_conn()
+        root = GSheetsStorage(conn, worksheet=f"Drivers{suffix}", settings_sheet=f"Settings{suffix}",
+                              manifest_sheet=f"Partitions{suffix}")
+        if monthly:
+            return PartitionedStorage(root, lambda name: GSheetsStorage(conn, worksheet=name))
+        return root
+
+    if backend == "gsheets":
+        return sheets()
+    if backend == "local":
+        path = driver_path(config.get("path", "driver_data.db"), driver)
+        local = SQLiteStorage(path)
+        if monthly:
+            local = PartitionedStorage(local, lambda name: SQLiteStorage(path, table=name))
+        if config.get("mirror"):
+            import sync  # sync import storage อยู่แล้ว: import ตอนใช้กัน import วน
+            mirror = sheets()
+            outbox = sync.Outbox(driver_path(config.get("mirror_outbox", "driver_mirror_outbox.db"), driver))
+            return MirroredStorage(local, mirror, sync.SyncWorker(outbox, mirror))
+        return local
+    raise ValueError(f"unknown storage backend: {backend}")
@@ -0,0 +1,283 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import pandas as pd
+
+import ledger
+import perf
+from storage import APPEND, EDIT, LEDGER_COLS, MIGRATE, OVERWRITE, ROW_ID, SETTINGS, to_records
+
+# --- OUTBOX ---
+# ทุกการเขียนถูกบันทึกลงไฟล์ SQLite ในเครื่องก่อน (ไม่หายแม้เน็ตหลุดหรือแอปปิด)
+# แล้ว SyncWorker ค่อยส่งขึ้น backend เบื้องหลัง: รวม append ที่ต่อกันเป็นชุดเดียว
+# ส่งไม่สำเร็จจะรอแบบ exponential backoff แล้วลองใหม่
+# op: storage.APPEND/OVERWRITE/EDIT (+ SETTINGS/MIGRATE ในคิวสำเนาของ MirroredStorage)
+
+
+def _encode(op, rows):
+    if op in (SETTINGS, MIGRATE):
+        return rows
+    if op == EDIT:
+        return [[None if row is None else to_records(row)[0] for row in pair] for pair in rows]
+    return to_records(rows)
+
+
+class Outbox:
+    def __init__(self, path="driver_outbox.db"):
+        self.path = path
+        with closing(self._connect()) as db, db:
+            db.execute("CREATE TABLE IF NOT EXISTS outbox ("
+                       "id INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, payload TEXT NOT NULL, "
+                       "created REAL NOT NULL)")
+            cols = [row[1] for row in db.execute("PRAGMA table_info(outbox)")]
+            if "scope" not in cols:  # outbox จากรุ่นก่อนแบ่งพาร์ทิชัน
+                db.execute("ALTER TABLE outbox ADD COLUMN scope TEXT")
+            if "attempts" not in cols:
+                db.execute("ALTER TABLE outbox ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def put(self, op, rows, scope=None):
+        # scope: เดือนที่ overwrite ครอบคลุม (None = ทั้ง ledger)
+        payload = json.dumps(_encode(op, rows), ensure_ascii=False)
+        scope = None if scope is None else json.dumps(sorted(scope))
+        with closing(self._connect()) as db, db:
+            if op == OVERWRITE and scope is None:
+                # เขียนทับทั้งชีต: แถวที่ยังไม่ได้ส่งก่อนหน้านี้ไม่มีความหมายแล้ว (ค่าตั้งต้นยังต้องส่ง)
+                db.execute("DELETE FROM outbox WHERE op IN (?, ?, ?)", (APPEND, EDIT, OVERWRITE))
+            cur = db.execute("INSERT INTO outbox (op, payload, created, scope) VALUES (?, ?, ?, ?)",
+                             (op, payload, time.time(), scope))
+        return cur.lastrowid
+
+    @perf.timed("outbox.pending")
+    def pending(self):
+        # [(id, op, rows, scope)] เรียงตามลำดับที่บันทึก
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT id, op, payload, scope FROM outbox ORDER BY id").fetchall()
+        return [(i, op, json.loads(payload), None if scope is None else json.loads(scope))
+                for i, op, payload, scope in rows]
+
+    def count(self):
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def next_batch(self, max_rows=500):
+        # overwrite/edit ส่งเดี่ยว ๆ; append ที่ต่อกันรวมเป็นชุดเดียวไม่เกิน max_rows แถว
+        batch = []
+        for entry in self.pending():
+            if entry[1] != APPEND:
+                return batch or [entry]
+            if batch and sum(len(e[2]) for e in batch) + len(entry[2]) > max_rows:
+                break
+            batch.append(entry)
+        return batch
+
+    def mark_attempt(self, ids):
+        # บันทึกก่อนส่ง: ถ้าแอปปิด/ล้มหลังส่งแต่ก่อน remove รอบหน้าจะรู้ว่าอาจส่งไปแล้ว
+        with closing(self._connect()) as db, db:
+            db.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids])
+
+    def attempted(self, ids):
+        with closing(self._connect()) as db:
+            sql = f"SELECT COUNT(*) FROM outbox WHERE attempts > 0 AND id IN ({', '.join('?' for _ in ids)})"
+            return db.execute(sql, list(ids)).fetchone()[0] > 0
+
+    def remove(self, ids):
+        with closing(self._connect()) as db, db:
+            db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+
+class SyncWorker:
+    BASE_DELAY = 2.0
+    MAX_DELAY = 300.0
+
+    def __init__(self, outbox, storage, on_synced=None):
+        self.outbox = outbox
+        self.storage = storage
+        self.on_synced = on_synced
+        # ถือ lock ระหว่างส่ง + ลบออกจาก outbox: ผู้อ่านที่ถือ lock เดียวกันจะไม่เห็นแถวซ้ำหรือแถวหาย
+        self.lock = threading.RLock()
+        self.failures = 0
+        self.last_error = None
+        self.last_synced = None
+        self._next_try = 0.0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ledger-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, op, rows, scope=None):
+        self.outbox.put(op, rows, scope)
+        self._wake.set()
+
+    def kick(self):
+        # ลองส่งทันที (ข้ามเวลารอ backoff) เช่นตอนผู้ใช้กดรีเฟรช
+        self._next_try = 0.0
+        self._wake.set()
+
+    def pending(self):
+        return self.outbox.count()
+
+    def _run(self):
+        while True:
+            delay = self._next_try - time.monotonic()
+            if delay > 0:
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+            if not self.sync_once():
+                self._wake.wait(60)
+                self._wake.clear()
+
+    def sync_once(self):
+        # ส่ง 1 ชุด; คืน True ถ้ายังมีงานเหลือ (ส่งต่อได้เลยหรือรอ backoff)
+        with self.lock:
+            batch = self.outbox.next_batch()
+            if not batch:
+                return False
+            op, scope = batch[0][1], batch[0][3]
+            ids = [entry[0] for entry in batch]
+            rows = [row for entry in batch for row in entry[2]] if op == APPEND else batch[0][2]
+            try:
+                if op == APPEND and self.outbox.attempted(ids):
+                    # ส่งแบบอย่างน้อยหนึ่งครั้ง: รอบก่อนอาจเขียนสำเร็จไปแล้ว ตัดแถวที่ backend มีรหัสอยู่แล้ว
+                    have = self.storage.existing_ids(rows)
+                    rows = [row for row in rows if not row.get(ROW_ID) or row[ROW_ID] not in have]
+                self.outbox.mark_attempt(ids)
+                with perf.run(f"sync.{op}"):
+                    if op == OVERWRITE and scope is not None:
+                        self.storage.overwrite(pd.DataFrame(rows, columns=LEDGER_COLS), months=scope)
+                    elif op == OVERWRITE:
+                        self.storage.overwrite(pd.DataFrame(rows, columns=LEDGER_COLS))
+                    elif op == EDIT:
+                        self.storage.apply_edits(rows)
+                    elif op == SETTINGS:
+                        self.storage.write_settings(rows)
+                    elif op == MIGRATE:
+                        self.storage.migrate()
+                    elif rows:
+                        self.storage.append(rows)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                self._next_try = time.monotonic() + min(self.BASE_DELAY * 2 ** (self.failures - 1), self.MAX_DELAY)
+                return True
+            self.outbox.remove(ids)
+            self.failures = 0
+            self.last_error = None
+            self.last_synced = time.time()
+            if self.on_synced is not None:
+                self.on_synced(op)
+        return True
+
+
+@perf.timed("sync.replay")
+def replay(frame, pending, start=None, end=None):
+    # ledger ที่อ่านจาก backend + รายการใน outbox ที่ยังไม่ได้ส่ง (ตามลำดับ) ตัดเฉพาะช่วง [start, end]
+    for _, op, rows, scope in pending:
+        if op in (SETTINGS, MIGRATE):
+            continue
+        if op == EDIT:
+            frame = ledger.apply_edits(frame, rows)
+            continue
+        new_rows = ledger.from_records(rows)
+        if op == APPEND:
+            # ส่งไปแล้วแต่ยังไม่ถูกลบจาก outbox (ล้มระหว่างนั้น): แถวอยู่ใน frame แล้ว ไม่ใส่ซ้ำ
+            ids = new_rows[ROW_ID]
+            new_rows = new_rows[(ids == 0) | ~ids.isin(frame[ROW_ID])]
+            frame = ledger.insert_sorted(frame, new_rows)
+        elif scope is None:
+            frame = ledger.sort_by_time(new_rows)
+        else:
+            # overwrite เฉพาะบางเดือน: แทนที่แถวของเดือนเหล่านั้น
+            kept = frame[~ledger.month_keys(frame).isin(scope)]
+            frame = ledger.sort_by_time(ledger.concat([kept, new_rows]))
+    return ledger.slice_range(frame, start, end)
+
+
+# --- REMOTE LEDGER (delta refresh) ---
+# สำเนา ledger ของ backend ที่ใช้ร่วมทั้ง process แยกตามพาร์ทิชัน แต่ละพาร์ทิชันมี high-water mark ของตัวเอง
+# ข้อมูลเปลี่ยนรุ่นหรือครบ max_age: ดึงเฉพาะแถวหลัง mark + แถวที่ถูกแก้ (storage.read_since) แล้ว merge เข้าตารางเดิม
+# mark ใช้ไม่ได้ (ชีตถูกเขียนทับ/ลบแถว) หรือสั่ง full=True จึงอ่านใหม่ทั้งหมด
+class RemoteLedger:
+    def __init__(self, storage, max_age=600):
+        self.storage = storage
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.parts = {}  # worksheet -> {"frame", "mark", "version", "loaded_at"}
+        self.last_fetch = None  # ("delta" | "full", จำนวนแถวที่อ่าน)
+        self.last_error = None
+
+    def invalidate(self):
+        with self.lock:
+            for part in self.parts.values():
+                part["mark"] = None
+
+    def nbytes(self):
+        with self.lock:
+            return sum(ledger.memory_bytes(p["frame"]) for p in self.parts.values() if p["frame"] is not None)
+
+    def clear(self):
+        # ปล่อยสำเนาทั้งหมด (คนขับถูก evict) ครั้งหน้าอ่านใหม่ทั้งชีต
+        with self.lock:
+            self.parts.clear()
+
+    def get(self, version, partitions=None, full=False):
+        # partitions: backend ของพาร์ทิชันที่ต้องการ (None = ทุกพาร์ทิชัน)
+        with self.lock:
+            if partitions is None:
+                partitions = self.storage.partitions()
+            frames = [self._get_part(p, version, full) for p in partitions]
+        if not frames:
+            return ledger.empty()
+        if len(frames) == 1:
+            return frames[0]
+        # แต่ละพาร์ทิชันเรียงแล้ว; เรียงรวมอีกรอบเพื่อให้แถวไม่มีวันที่ไปอยู่ท้าย
+        return ledger.sort_by_time(ledger.concat(frames))
+
+    def _get_part(self, part_store, version, full):
+        part = self.parts.setdefault(part_store.worksheet, {"frame": None, "mark": None, "version": None, "loaded_at": 0.0})
+        expired = time.monotonic() - part["loaded_at"] > self.max_age
+        stale = part["frame"] is None or full or version != part["version"] or expired
+        perf.cache("remote_ledger", not stale)
+        if stale:
+            try:
+                self._refresh(part, part_store, full or part["frame"] is None)
+            except Exception as e:
+                # ดึงไม่สำเร็จ: ใช้สำเนาเดิมไปก่อน (ถ้ามี) ไม่เลื่อนรุ่น ครั้งหน้าจึงลองดึงใหม่
+                self.last_error = e
+                if part["frame"] is None:
+                    raise
+            else:
+                self.last_error = None
+                part["version"] = version
+        return part["frame"]
+
+    def _refresh(self, part, part_store, full):
+        rows, mark = (None, None) if full or part["mark"] is None else part_store.read_since(part["mark"])
+        if rows is None:
+            rows, mark = part_store.read_since(None)
+            part["frame"] = ledger.sort_by_time(ledger.from_sheet(rows))
+            self.last_fetch = ("full", len(rows))
+        else:
+            if len(rows):
+                # แถวที่ถูกแก้ (รหัสซ้ำกับที่มีอยู่) แทนที่แถวเดิม
+                rows = ledger.from_sheet(rows)
+                ids = rows[ROW_ID][rows[ROW_ID] != 0]
+                frame = part["frame"]
+                if len(ids):
+                    frame = frame[~frame[ROW_ID].isin(ids)]
+                part["frame"] = ledger.insert_sorted(frame, rows)
+            self.last_fetch = ("delta", len(rows))
+        part["mark"] = mark
+        part["loaded_at"] = time.monotonic()
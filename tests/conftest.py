@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# โมดูลของแอปอยู่ที่รากของ repo (ไม่ได้ติดตั้งเป็น package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ledger  # noqa: E402
+import storage  # noqa: E402
+from fake_gsheets import FakeGSheetsConnection  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clear_header_cache():
+    # หัวชีตถูก cache ระดับ process ตามชื่อ worksheet: ล้างทุกเทสต์ (ทุกเทสต์ใช้ชื่อ Drivers ซ้ำกัน)
+    storage._header_cache.clear()
+    yield
+    storage._header_cache.clear()
+
+
+def _trip(minute, gross=100, note=""):
+    when = pd.Timestamp("2026-10-01 08:00") + pd.Timedelta(minutes=minute)
+    return ledger.make_record('รายรับ', 'ค่าโดยสาร', when=when, app='Grab', gross=gross, net=gross * 0.8, note=note)
+
+
+@pytest.fixture
+def trip():
+    # trip(นาทีหลัง 08:00 ของ 2026-10-01, gross, note) -> แถวรายรับ (มีรหัสแถวใหม่ทุกครั้ง)
+    return _trip
+
+
+@pytest.fixture
+def sheet_with():
+    # sheet_with(n) -> (FakeGSheetsConnection, GSheetsStorage) ที่มีชีต Drivers n แถว
+    def make(n):
+        conn = FakeGSheetsConnection({"Drivers": pd.DataFrame([_trip(i) for i in range(n)], columns=storage.LEDGER_COLS)})
+        return conn, storage.GSheetsStorage(conn)
+    return make
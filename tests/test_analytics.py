@@ -0,0 +1,123 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import analytics
+import ledger
+
+TODAY = datetime.date(2026, 10, 17)
+
+
+def book(*records):
+    return ledger.from_sheet(pd.DataFrame(records))
+
+
+def at(text):
+    return pd.Timestamp(f"2026-10-{text}")
+
+
+# --- period_range ---
+@pytest.mark.parametrize("start, end, expected", [
+    (datetime.date(2026, 10, 1), datetime.date(2026, 10, 10), ("2026-10-01", "2026-10-10", 10)),
+    (datetime.date(2026, 10, 5), None, ("2026-10-05", "2026-10-05", 1)),  # ยังไม่เลือกวันสิ้นสุด
+    (None, None, ("2026-10-17", "2026-10-17", 1)),
+])
+def test_custom_period_never_unbounded(start, end, expected):
+    # None = ไม่จำกัดช่วง -> โหลดทุก partition: ช่วงที่เลือกไม่ครบต้องไม่ตกไปกรณีนั้น
+    p_start, p_end, days = analytics.period_range("กำหนดเอง", TODAY, start, end)
+    assert (p_start, p_end, days) == (pd.Timestamp(expected[0]), pd.Timestamp(expected[1]), expected[2])
+
+
+def test_preset_periods():
+    assert analytics.period_range("เดือนที่แล้ว", TODAY) == (pd.Timestamp("2026-09-01"), pd.Timestamp("2026-09-30"), 30)
+    assert analytics.period_range("สัปดาห์นี้", TODAY)[:2] == (pd.Timestamp("2026-10-12"), pd.Timestamp("2026-10-18"))
+
+
+# --- ชั่วโมงกะงาน ---
+def shifts(*events):
+    # events: ("01 22:00", True=เริ่ม / False=เลิก)
+    return book(*(ledger.shift_record(started, 0, when=at(when)) for when, started in events))
+
+
+def test_shift_crossing_midnight_counts_for_start_day():
+    df = shifts(("01 22:00", True), ("02 02:30", False))
+    paired = analytics.pair_shifts(df)
+    assert paired['ชั่วโมง'].tolist() == [4.5] and paired['วันที่'].tolist() == [at("01")]
+    hours = analytics.daily_shift_hours(df)
+    assert hours.to_dict() == {at("01"): 4.5}
+
+
+def test_several_shifts_in_one_day_exclude_the_break():
+    df = shifts(("01 06:00", True), ("01 10:00", False), ("01 17:00", True), ("01 21:30", False))
+    assert analytics.pair_shifts(df)['ชั่วโมง'].tolist() == [4.0, 4.5]
+    assert analytics.daily_shift_hours(df).to_dict() == {at("01"): 8.5}
+
+
+def test_unpaired_and_overlong_shifts_are_skipped():
+    df = shifts(("01 06:00", True), ("01 08:00", True), ("01 09:00", False),  # กดเริ่มซ้ำ: นับจากครั้งหลัง
+                ("01 10:00", False),                                         # เลิกโดยไม่มีเริ่ม
+                ("02 06:00", True), ("04 06:00", False))                     # ลืมกดเลิก (> 24 ชม.)
+    assert analytics.pair_shifts(df)['ชั่วโมง'].tolist() == [1.0]
+
+
+def test_shift_pairing_ignores_row_order():
+    df = shifts(("02 01:00", False), ("01 20:00", True))  # แถวบนชีตไม่เรียงตามเวลา
+    assert analytics.daily_shift_hours(df).to_dict() == {at("01"): 5.0}
+
+
+# --- ชื่อรายจ่ายในกราฟ ---
+def baseline_expense_name(row):
+    # detailed_expense_name เดิม (apply ทีละแถว) ไว้เทียบผลกับกฎแบบ vectorized
+    item = row['รายการ']
+    app_name = row['แอป']
+    note = str(row['หมายเหตุ']).strip()
+    if 'เติมเครดิต' in item: return f"💳 เติม {app_name}"
+    if 'น้ำมัน' in item or 'ไฟ' in item:
+        if 'ชาร์จ' in item or 'ชาร์จ' in note: return "⚡ ชาร์จไฟ"
+        if 'น้ำมัน' in item or 'น้ำมัน' in note: return "⛽ น้ำมัน"
+        return "⛽ พลังงาน"
+    if 'ทั่วไป' in item:
+        if note and note.lower() != 'nan' and note != '': return f"🛠️ {note}"
+        return "🛠️ จ่ายทั่วไป"
+    return item
+
+
+@pytest.mark.parametrize("item, app, note, expected", [
+    ("💳 เติมเครดิต", "Grab", "", "💳 เติม Grab"),
+    ("💳 เติมเครดิต", "Bolt", "ชาร์จ", "💳 เติม Bolt"),  # กฎเติมเครดิตมาก่อนพลังงาน
+    ("⛽ น้ำมัน/ไฟ", "ค่าใช้จ่าย", "ชาร์จที่ปั๊ม", "⚡ ชาร์จไฟ"),
+    ("⚡ ค่าชาร์จไฟ", "ค่าใช้จ่าย", "", "⚡ ชาร์จไฟ"),
+    ("⛽ น้ำมัน/ไฟ", "ค่าใช้จ่าย", "", "⛽ น้ำมัน"),
+    ("🔌 ค่าไฟ", "ค่าใช้จ่าย", "บ้าน", "⛽ พลังงาน"),
+    ("🛠️ จ่ายทั่วไป", "ค่าใช้จ่าย", "  ล้างรถ ", "🛠️ ล้างรถ"),
+    ("🛠️ จ่ายทั่วไป", "ค่าใช้จ่าย", "nan", "🛠️ จ่ายทั่วไป"),
+    ("🛠️ จ่ายทั่วไป", "ค่าใช้จ่าย", "", "🛠️ จ่ายทั่วไป"),
+    ("🍜 ค่าอาหาร", "ค่าใช้จ่าย", "ข้าวมันไก่", "🍜 ค่าอาหาร"),
+])
+def test_expense_labels_match_baseline(item, app, note, expected):
+    df = book(ledger.expense_record(item, 50, when=at("01 12:00"), app=app, note=note))
+    assert analytics.expense_labels(df).tolist() == [expected]
+    assert baseline_expense_name(df.iloc[0]) == expected
+
+
+def test_expense_breakdown_sums_per_label():
+    df = book(ledger.expense_record("⛽ น้ำมัน/ไฟ", 300, when=at("01 07:00")),
+              ledger.expense_record("⛽ น้ำมัน/ไฟ", 200.5, when=at("02 07:00")),
+              ledger.expense_record("💳 เติมเครดิต", 100, when=at("02 08:00"), app='Grab'))
+    out = analytics.expense_breakdown(df).set_index('ชื่อรายการกราฟ')['หัก/จ่าย']
+    assert out.to_dict() == {"💳 เติม Grab": 100.0, "⛽ น้ำมัน": 500.5}
+
+
+# --- GP ต่อแอป ---
+def test_grab_wallet_topup_counts_for_grab_but_wallet_income_stays_separate():
+    df = book(
+        ledger.make_record('รายรับ', 'ค่าโดยสาร', when=at("01 08:00"), app='Grab', channel='💵 เงินสด/โอน', gross=100, net=100),
+        ledger.make_record('รายรับ', 'ค่าโดยสาร', when=at("01 09:00"), app='Grab Wallet', channel='💳 ตัดบัตร/แอป', gross=200, net=160),
+        ledger.make_record('รายจ่าย', '💳 เติมเครดิต', when=at("01 10:00"), app='Grab Wallet', channel='จ่ายสด', deduct=30, net=-30),
+    )
+    gp = analytics.gp_table(df).set_index('แอป')
+    assert sorted(gp.index) == ['Grab', 'Grab Wallet']
+    assert (gp.loc['Grab', 'เติมเอง'], gp.loc['Grab', 'ยอดหน้าแอป (บ.)']) == (30, 100)
+    assert gp.loc['Grab Wallet', 'เติมเอง'] == 0
+    assert (gp.loc['Grab Wallet', 'หักส่วนต่าง'], gp.loc['Grab Wallet', 'เครดิตเข้า Wallet']) == (40, 160)
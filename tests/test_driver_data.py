@@ -0,0 +1,51 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import ledger
+import storage
+import sync
+from driver_data import DriverData
+
+
+@pytest.fixture
+def data(sheet_with, tmp_path):
+    # คนขับที่มี 5 แถวบนชีต (2026-10-01) โหลดไว้แล้ว; worker ไม่ start ส่งเองด้วย sync_once
+    conn, store = sheet_with(5)
+    worker = sync.SyncWorker(sync.Outbox(str(tmp_path / "outbox.db")), store)
+    out = DriverData(ledger.DriverBook(""), store, worker, sync.RemoteLedger(store), storage.DataVersions(),
+                     today=lambda: datetime.date(2026, 10, 1))
+    out.load_book()
+    return out
+
+
+def test_append_updates_book_rollup_and_outbox(data, trip):
+    version = data.book.version
+    data.append_data(trip(30, gross=500))
+    assert len(data.book.frame()) == 6 and data.book.version > version
+    assert data.book.rollup["daily"].loc[pd.Timestamp("2026-10-01"), 'จำนวนงาน'] == 6
+    assert data.get_live_state() is data.book.live
+    assert data.worker.pending() == 1
+    data.worker.sync_once()
+    assert len(data.store.read()) == 6
+
+
+def test_save_edits_sends_only_changed_rows(data):
+    before = data.book.frame()
+    after = before.copy()
+    after.loc[after.index[0], 'หมายเหตุ'] = 'แก้ไข'
+    assert data.save_edits(before, after) == 1
+    data.worker.sync_once()
+    assert (data.store.read()['หมายเหตุ'] == 'แก้ไข').sum() == 1
+
+
+def test_save_data_refused_after_failed_load(data):
+    errors = []
+    data.on_error = errors.append
+    data.book.load_error = OSError("offline")
+    assert data.save_data(ledger.empty()) is False
+    assert errors and data.worker.pending() == 0 and len(data.book.frame()) == 5
+    data.on_error = None
+    with pytest.raises(RuntimeError):
+        data.save_data(ledger.empty())
@@ -0,0 +1,124 @@
+import pandas as pd
+
+import ledger
+import storage
+import sync
+from fake_gsheets import FakeGSheetsConnection
+
+ROW_ID = storage.ROW_ID
+
+
+def sheet_frame(rows):
+    return storage.normalize_ledger(pd.DataFrame(storage.to_records(rows), columns=storage.LEDGER_COLS))
+
+
+# --- plan_edits ---
+def test_concurrent_edits_to_different_fields_both_kept(trip):
+    base = trip(1)
+    current = {**base, 'หมายเหตุ': 'เครื่อง A'}  # เครื่อง A แก้หมายเหตุไปก่อน
+    updates, deletes, inserts = storage.plan_edits(sheet_frame([current]), [(base, {**base, 'ยอดเต็ม/หน้าแอป': 250})])
+    assert not deletes and not inserts
+    merged = updates[0]
+    assert merged['หมายเหตุ'] == 'เครื่อง A' and merged['ยอดเต็ม/หน้าแอป'] == 250
+    assert merged[ROW_ID] == base[ROW_ID]
+
+
+def test_edit_of_row_deleted_elsewhere_is_reinserted(trip):
+    base, other = trip(1), trip(2)
+    updates, deletes, inserts = storage.plan_edits(sheet_frame([other]), [(base, {**base, 'หมายเหตุ': 'แก้'})])
+    assert not updates and not deletes
+    assert [r['หมายเหตุ'] for r in storage.to_records(inserts)] == ['แก้']
+
+
+def test_delete_of_row_edited_elsewhere_removes_it(trip):
+    base = trip(1)
+    current = {**base, 'หมายเหตุ': 'เครื่อง A'}
+    updates, deletes, inserts = storage.plan_edits(sheet_frame([trip(0), current]), [(base, None)])
+    assert deletes == [1] and not updates and not inserts
+
+
+def test_legacy_rows_match_by_value_and_get_ids(trip):
+    legacy = [{**trip(i), ROW_ID: ""} for i in range(3)]
+    pairs = ledger.assign_ids([(legacy[1], {**legacy[1], 'หมายเหตุ': 'แก้'})])
+    new_id = pairs[0][1][ROW_ID]
+    assert new_id == storage.legacy_row_id(legacy[1])
+    updates, deletes, inserts = storage.plan_edits(sheet_frame(legacy), pairs)
+    assert list(updates) == [1] and updates[1][ROW_ID] == new_id and not inserts
+
+
+def test_legacy_row_edited_on_two_devices_merges_by_legacy_id(trip):
+    # เครื่อง A แก้แถวรุ่นก่อนไปแล้ว (ได้รหัสจากค่าเดิม) เครื่อง B แก้จากสำเนาเดิมที่ยังไม่มีรหัส
+    legacy = {**trip(1), ROW_ID: ""}
+    first = ledger.assign_ids([(legacy, {**legacy, 'หมายเหตุ': 'A'})])[0][1]
+    second = ledger.assign_ids([(legacy, {**legacy, 'ทิป': 20})])
+    updates, deletes, inserts = storage.plan_edits(sheet_frame([first]), second)
+    assert not inserts and updates[0]['หมายเหตุ'] == 'A' and updates[0]['ทิป'] == 20
+
+
+def test_legacy_row_id_is_stable_and_ignores_id_column(trip):
+    row = {**trip(1), ROW_ID: ""}
+    assert storage.legacy_row_id(row) == storage.legacy_row_id({**row, ROW_ID: "rffffffffffffff0"})
+    assert storage.legacy_row_id(row) != storage.legacy_row_id({**row, 'ทิป': 1})
+
+
+def test_assign_ids_gives_duplicate_legacy_rows_distinct_ids(trip):
+    row, copied = {**trip(1), ROW_ID: ""}, trip(2)
+    pairs = ledger.assign_ids([(row, {**row, 'หมายเหตุ': 'x'}), (row, {**row, 'หมายเหตุ': 'y'}), (None, copied)])
+    ids = [new[ROW_ID] for _, new in pairs]
+    assert ids[0] == storage.legacy_row_id(row) and len(set(ids)) == 3
+    assert ids[2] != copied[ROW_ID]  # แถวที่เพิ่ม (แม้คัดลอกมา) ได้รหัสใหม่เสมอ
+
+
+# --- ledger.apply_edits (ledger ใน memory ใช้กติกาเดียวกับ backend) ---
+def test_ledger_apply_edits_matches_backend(trip):
+    rows = [trip(i) for i in range(5)]
+    frame = ledger.from_records(rows)
+    pairs = [(rows[1], {**rows[1], 'หมายเหตุ': 'แก้'}), (rows[3], None), (None, trip(10))]
+    out = ledger.apply_edits(frame, pairs)
+    assert len(out) == 5
+    notes = dict(zip(ledger.to_sheet(out)[ROW_ID], out['หมายเหตุ']))
+    assert notes[rows[1][ROW_ID]] == 'แก้' and rows[3][ROW_ID] not in notes
+    assert out[ledger.TS_COL].is_monotonic_increasing
+
+
+# --- outbox replay: ledger ที่อ่านได้ + รายการที่ยังไม่ได้ส่ง ---
+def test_replay_applies_pending_in_order(trip, tmp_path):
+    rows = [trip(i) for i in range(3)]
+    outbox = sync.Outbox(str(tmp_path / "outbox.db"))
+    outbox.put(sync.APPEND, [trip(5)])
+    outbox.put(sync.EDIT, [(rows[0], {**rows[0], 'หมายเหตุ': 'แก้'})])
+    outbox.put(sync.EDIT, [(rows[2], None)])
+    out = sync.replay(ledger.from_records(rows), outbox.pending())
+    assert len(out) == 3
+    assert sorted(out['หมายเหตุ']) == ['', '', 'แก้']
+
+
+def test_replay_scoped_overwrite_replaces_only_those_months(trip, tmp_path):
+    sept = ledger.make_record('รายรับ', 'ค่าโดยสาร', when=pd.Timestamp("2026-09-15 08:00"), app='Grab', gross=50)
+    rows = [sept, trip(1), trip(2)]
+    outbox = sync.Outbox(str(tmp_path / "outbox.db"))
+    outbox.put(sync.OVERWRITE, [trip(9)], scope={"2026-10"})
+    out = sync.replay(ledger.from_records(rows), outbox.pending())
+    assert len(out) == 2 and set(ledger.month_keys(out)) == {"2026-09", "2026-10"}
+
+
+# --- ยังไม่มี worksheet (คนขับใหม่) ---
+def test_missing_worksheet_reads_empty_and_is_created_on_first_write(trip):
+    conn = FakeGSheetsConnection()
+    store = storage.GSheetsStorage(conn, worksheet="Drivers_new", settings_sheet="Settings_new")
+    assert store.read().empty
+    rows, mark = store.read_since(None)
+    assert rows.empty
+    assert store.read_settings() == storage.DEFAULT_SETTINGS
+    assert store.existing_ids([trip(1)]) == set()
+    store.append([trip(1)])
+    assert "Drivers_new" in conn.sheets and len(store.read()) == 1
+    rows, mark = store.read_since(mark)
+    assert len(rows) == 1
+
+
+def test_missing_worksheet_created_by_edit_inserts(trip):
+    conn = FakeGSheetsConnection()
+    store = storage.GSheetsStorage(conn, worksheet="Drivers_new")
+    assert store.apply_edits(ledger.assign_ids([(None, trip(1))])) == 1
+    assert len(store.read()) == 1
@@ -0,0 +1,107 @@
+import io
+
+import pandas as pd
+import pytest
+
+import importer
+import ledger
+import storage
+
+
+def csv_file(text, encoding="utf-8"):
+    return io.BytesIO(text.encode(encoding))
+
+
+def read_all(text, platform, filename="statement.csv", encoding="utf-8"):
+    chunks = list(importer.read_chunks(csv_file(text, encoding), filename, platform))
+    return [importer.to_ledger(c, platform) for c in chunks]
+
+
+# --- จับคอลัมน์ตามแอป ---
+@pytest.mark.parametrize("platform, header, row", [
+    ("Grab", "Booking ID,Booking Time,Fare Amount (THB),Grab Commission,Tip,Payment Method",
+     "G-1,03/05/2024 14:30,120.00,24.00,10,Cashless"),
+    ("Bolt", "Ride ID,Ride Date,Ride Price,Bolt Fee,Tips,Payment Type",
+     "B-1,03/05/2024 14:30,฿120,-24,10,Card"),
+    ("Line Man", "เลขที่ออเดอร์,เวลาสั่งซื้อ,ค่าส่ง (บาท),ค่า GP,ทิป,ช่องทางชำระเงิน",
+     "L-1,03/05/2024 14:30,\"120.00\",24,10,LINE Pay"),
+])
+def test_profile_columns_map_to_ledger(platform, header, row):
+    [(rows, invalid)] = read_all(f"{header}\n{row}\n", platform)
+    assert invalid == 0 and list(rows.columns) == storage.LEDGER_COLS
+    r = rows.iloc[0]
+    assert (r['วันที่'], r['เวลา'], r['แอป']) == ('2024-05-03', '14:30', platform)
+    assert (r['ยอดเต็ม/หน้าแอป'], r['หัก/จ่าย'], r['ทิป'], r['คงเหลือ/สุทธิ']) == (120, 24, 10, 106)
+    assert r['ช่องทางรับเงิน'] == importer.CARD and r['เงินสดเข้าตัว'] == 0
+    assert r['หมายเหตุ'] == f"นำเข้า {platform} #{row.split(',')[0]}"
+
+
+def test_report_title_rows_before_header_are_skipped():
+    text = "Grab Driver Statement\nPeriod: May 2024\n\nBooking Time,Fare Amount,Net Earnings\n03/05/2024 14:30,100,80\n"
+    [(rows, invalid)] = read_all(text, "Grab")
+    assert invalid == 0 and rows['หัก/จ่าย'].tolist() == [20]
+
+
+# --- encoding ---
+@pytest.mark.parametrize("encoding", ["cp874", "utf-8-sig", "utf-8"])
+def test_thai_headers_in_each_encoding(encoding):
+    text = "วันที่,เวลา,ค่าโดยสาร,รายได้สุทธิ,หมายเหตุ\n03/05/2024,14:30,100,80,ทดสอบ\n"
+    [(rows, invalid)] = read_all(text, "Line Man", encoding=encoding)
+    assert invalid == 0 and len(rows) == 1
+    assert (rows['วันที่'][0], rows['เวลา'][0], rows['คงเหลือ/สุทธิ'][0]) == ('2024-05-03', '14:30', 80)
+
+
+# --- วันที่ ---
+@pytest.mark.parametrize("value, expected", [
+    ("03/05/2567 14:30", "2024-05-03 14:30"),  # พ.ศ. วัน/เดือน/ปี
+    ("03/05/2024 14:30", "2024-05-03 14:30"),  # ค.ศ. วัน/เดือน/ปี (ไม่ใช่ 5 มี.ค.)
+    ("13/05/2024", "2024-05-13 00:00"),
+    ("2024-05-03 14:30:00", "2024-05-03 14:30"),  # ISO ไม่สลับวันกับเดือน
+    ("2567-05-03T14:30", "2024-05-03 14:30"),
+])
+def test_dates_buddhist_year_and_dayfirst(value, expected):
+    chunk = pd.DataFrame({"Date/Time": [value], "Fare": ["100"]})
+    rows, invalid = importer.to_ledger(chunk, "Grab")
+    assert invalid == 0 and f"{rows['วันที่'][0]} {rows['เวลา'][0]}" == expected
+
+
+def test_rows_without_date_or_amount_are_counted_invalid():
+    chunk = pd.DataFrame({"Date/Time": ["03/05/2024 10:00", "ไม่ใช่วันที่", "03/05/2024 11:00"],
+                          "Fare": ["100", "50", ""]})
+    rows, invalid = importer.to_ledger(chunk, "Grab")
+    assert len(rows) == 1 and invalid == 2
+
+
+# --- งานเงินสด ---
+def test_cash_trip_keeps_amounts_consistent():
+    # เงินสด: รับเต็ม ยอดเต็ม + ทิป, หัก 0 เหมือนฟอร์มรับงาน (ค่าคอมลงตอนเติมเครดิต ไม่นับซ้ำ)
+    chunk = pd.DataFrame({"Date/Time": ["03/05/2024 10:00", "03/05/2024 11:00"], "Fare": ["120", "120"],
+                          "Commission": ["24", "24"], "Tip": ["10", "10"], "Payment": ["Cash", "Card"]})
+    rows, _ = importer.to_ledger(chunk, "Grab")
+    cash, card = rows.iloc[0], rows.iloc[1]
+    assert cash['ช่องทางรับเงิน'] == importer.CASH and card['ช่องทางรับเงิน'] == importer.CARD
+    assert (cash['หัก/จ่าย'], cash['คงเหลือ/สุทธิ'], cash['เงินสดเข้าตัว']) == (0, 130, 130)
+    assert (card['หัก/จ่าย'], card['คงเหลือ/สุทธิ'], card['เงินสดเข้าตัว']) == (24, 106, 0)
+    amounts = rows[['ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'คงเหลือ/สุทธิ']].astype(float)
+    assert (amounts.iloc[:, 0] - amounts.iloc[:, 1] + amounts.iloc[:, 2] == amounts.iloc[:, 3]).all()
+
+
+# --- นำเข้าซ้ำ ---
+def test_reimport_counts_duplicates():
+    text = ("Booking ID,Booking Time,Fare Amount,Net Earnings\n"
+            "G-1,03/05/2024 10:00,100,80\nG-2,03/05/2024 11:00,150,120\n"
+            "G-3,04/05/2024 09:00,90,72\nG-3,04/05/2024 09:00,90,72\n")  # แถวซ้ำในไฟล์เองก็นำเข้าทั้งคู่
+    saved = []
+
+    def existing(start, end):
+        book = ledger.from_sheet(pd.concat(saved)) if saved else ledger.from_sheet(pd.DataFrame(columns=storage.LEDGER_COLS))
+        return book[(book['วันที่'] >= start) & (book['วันที่'] <= end)]
+
+    def run():
+        return list(importer.import_statement(csv_file(text), "grab.csv", "Grab", existing, saved.append, chunk_rows=2))[-1]
+
+    assert run() == {"read": 4, "imported": 4, "duplicates": 0, "invalid": 0}
+    assert run() == {"read": 4, "imported": 0, "duplicates": 4, "invalid": 0}
+    text += "G-4,05/05/2024 08:00,60,48\n"
+    assert run() == {"read": 5, "imported": 1, "duplicates": 4, "invalid": 0}
+    assert sum(map(len, saved)) == 5
@@ -0,0 +1,140 @@
+import math
+import threading
+
+import pandas as pd
+import pytest
+
+import ledger
+import storage
+
+
+def sheet(*records):
+    return pd.DataFrame(list(records), columns=storage.LEDGER_COLS)
+
+
+# --- รูปแบบ typed <-> ชีต ---
+def test_typed_round_trip_keeps_satang_and_row_ids(trip):
+    rows = sheet(
+        ledger.make_record('รายรับ', 'ค่าโดยสาร', when=pd.Timestamp("2026-10-01 23:59"), app='Bolt',
+                           channel='💳 ตัดบัตร/แอป', gross=123.45, deduct=0.1, tip=0.05, net=123.4, note=' ทิป '),
+        ledger.expense_record('⛽ น้ำมัน/ไฟ', 0.3, when=pd.Timestamp("2026-10-02 00:01")),  # 0.1 + 0.2 แบบ float ก็ได้ 30 สตางค์
+        ledger.shift_record(True, 12345, when=pd.Timestamp("2026-10-02 06:00")),
+        trip(0),
+    )
+    typed = ledger.from_sheet(rows)
+    assert typed['ยอดเต็ม/หน้าแอป'].dtype == 'int64' and typed[storage.ROW_ID].dtype == 'int64'
+    assert typed['ยอดเต็ม/หน้าแอป'].tolist()[:2] == [12345, 0] and typed['หัก/จ่าย'].tolist()[:2] == [10, 30]
+    assert typed['แอป'].dtype == 'category' and typed['วันที่'].dtype.kind == 'M'
+    assert typed[ledger.TS_COL].tolist()[:2] == [pd.Timestamp("2026-10-01 23:59"), pd.Timestamp("2026-10-02 00:01")]
+
+    back = ledger.to_sheet(typed)
+    assert list(back.columns) == storage.LEDGER_COLS
+    assert back[storage.ROW_ID].tolist() == rows[storage.ROW_ID].tolist()
+    assert back['วันที่'].tolist() == ['2026-10-01', '2026-10-02', '2026-10-02', '2026-10-01']
+    for col in ledger.MONEY_COLS:
+        assert back[col].tolist() == [round(float(v), 2) for v in rows[col]]
+    assert back['เลขไมล์'].tolist() == [0, 0, 12345, 0] and back['หมายเหตุ'][0] == ' ทิป '
+    again = ledger.from_sheet(back)
+    assert again.drop(columns=['วันที่', ledger.TS_COL]).equals(typed.drop(columns=['วันที่', ledger.TS_COL]))
+    assert (again[ledger.TS_COL] == typed[ledger.TS_COL]).all()  # ความละเอียดของ datetime64 อาจต่างกันตามที่ pandas อนุมาน
+
+
+def test_sheet_values_from_gsheets_are_parsed():
+    # ค่าที่อ่านจากชีตเป็นข้อความ: คอมมา/ว่าง/แถวเก่าที่ไม่มีรหัส
+    rows = sheet({'วันที่': '2026-10-01', 'เวลา': '08:05', 'แอป': 'Grab', 'หมวดหมู่': 'รายรับ', 'รายการ': 'ค่าโดยสาร',
+                  'ช่องทางรับเงิน': '-', 'ยอดเต็ม/หน้าแอป': '99.99', 'หัก/จ่าย': '', 'ทิป': None,
+                  'คงเหลือ/สุทธิ': '99.99', 'เงินสดเข้าตัว': '0', 'เลขไมล์': '1500.0', 'หมายเหตุ': None, storage.ROW_ID: ''})
+    typed = ledger.from_sheet(rows)
+    assert typed.iloc[0][['ยอดเต็ม/หน้าแอป', 'หัก/จ่าย', 'ทิป', 'เลขไมล์', storage.ROW_ID]].tolist() == [9999, 0, 0, 1500, 0]
+    assert ledger.to_sheet(typed)[storage.ROW_ID].tolist() == [""]
+
+
+def test_row_id_text_round_trip():
+    ids = ledger.new_ids(1000)
+    assert (ids > 0).all()
+    text = ledger.format_ids(ids)
+    assert all(len(t) == 16 and t.startswith('r') for t in text)
+    assert ledger.parse_ids(text).tolist() == ids.tolist()
+    assert ledger.parse_ids(["", None, "rXYZ", "r" + "f" * 16, math.nan]).tolist() == [0] * 5
+
+
+# --- สร้างรายการผ่านทางเดียว ---
+@pytest.mark.parametrize("kwargs, message", [
+    ({"gross": -1}, "ยอดเต็ม/หน้าแอป ติดลบไม่ได้"),
+    ({"deduct": -5}, "หัก/จ่าย ติดลบไม่ได้"),
+    ({"tip": -0.5}, "ทิป ติดลบไม่ได้"),
+    ({"odometer": -10}, "เลขไมล์ ติดลบไม่ได้"),
+    ({"net": float("nan")}, "คงเหลือ/สุทธิ ต้องเป็นตัวเลข"),
+    ({"cash": float("inf")}, "เงินสดเข้าตัว ต้องเป็นตัวเลข"),
+])
+def test_make_record_rejects_bad_amounts(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        ledger.make_record('รายรับ', 'ค่าโดยสาร', when=pd.Timestamp("2026-10-01 08:00"), app='Grab', **kwargs)
+
+
+def test_make_record_rejects_unknown_category_and_text_amounts():
+    when = pd.Timestamp("2026-10-01 08:00")
+    with pytest.raises(ValueError, match="หมวดหมู่ไม่ถูกต้อง"):
+        ledger.make_record('รายได้', 'ค่าโดยสาร', when=when, app='Grab')
+    with pytest.raises(ValueError):
+        ledger.make_record('รายรับ', 'ค่าโดยสาร', when=when, app='Grab', gross="หนึ่งร้อย")
+
+
+def test_make_record_fills_defaults_and_new_ids():
+    when = pd.Timestamp("2026-10-01 08:00")
+    a = ledger.make_record('รายรับ', 'ค่าโดยสาร', when=when, app='Grab', gross=None, net=-20, note=None)
+    b = ledger.make_record('รายรับ', 'ค่าโดยสาร', when=when, app='Grab')
+    assert list(a) == storage.LEDGER_COLS
+    assert (a['ยอดเต็ม/หน้าแอป'], a['คงเหลือ/สุทธิ'], a['หมายเหตุ'], a['เวลา']) == (0.0, -20.0, '', '08:00')
+    assert a[storage.ROW_ID] != b[storage.ROW_ID]
+
+
+def test_buffered_appends_match_one_concat(trip, monkeypatch):
+    monkeypatch.setattr(ledger.Ledger, "FLUSH_AT", 8)
+    first = [trip(i) for i in range(0, 40, 2)]
+    later = [trip(i) for i in range(1, 40, 2)]
+    book = ledger.Ledger(ledger.from_sheet(sheet(*first)))
+    for rec in later:
+        book.append(rec)
+    assert len(book) == 40 and book._n_pending < ledger.Ledger.FLUSH_AT  # รวมเข้าตารางหลักไปแล้วอย่างน้อยหนึ่งครั้ง
+    frame = book.frame
+    assert book._n_pending == 0 and frame[ledger.TS_COL].is_monotonic_increasing
+    expected = ledger.sort_by_time(ledger.from_sheet(sheet(*first, *later)))
+    assert ledger.to_sheet(frame).reset_index(drop=True).equals(ledger.to_sheet(expected).reset_index(drop=True))
+
+
+# --- BookCache ---
+def test_book_cache_drops_evicted_and_unused_books(trip):
+    evicted = []
+    books = ledger.BookCache(max_bytes=0, on_evict=evicted.append, min_idle=0)
+    a = books.get("A")
+    a.ledger = ledger.Ledger(ledger.from_sheet(sheet(trip(0))))
+    a.measure()
+    books.get("never-loaded")
+    books.get("B")
+    books.trim(keep="B")
+    assert evicted == ["A"] and books.evictions == 1 and not a.loaded
+    assert list(books._books) == ["B"]  # ไม่เหลือเล่มว่างของคนขับที่ไม่ได้ใช้
+    assert books.get("A") is not a and not books.get("A").loaded
+
+
+def test_book_cache_keeps_books_in_use(trip):
+    books = ledger.BookCache(max_bytes=0, min_idle=0)
+    a = books.get("A")
+    holding, done = threading.Event(), threading.Event()
+
+    def load():  # อีกเซสชันถือ lock ระหว่างโหลด
+        with a.lock:
+            holding.set()
+            done.wait(5)
+
+    loader = threading.Thread(target=load)
+    loader.start()
+    holding.wait(5)
+    books.trim(keep="B")
+    done.set()
+    loader.join()
+    assert books.get("A") is a
+    books.min_idle = 60
+    books.trim(keep="B")  # เพิ่งใช้: ยังไม่ทิ้ง
+    assert books.get("A") is a
@@ -0,0 +1,83 @@
+import threading
+
+import storage
+
+
+class Backend:
+    # backend ค่าตั้งต้นในหน่วยความจำ: นับการเขียน, สั่งให้ล้มหรือค้างได้
+    def __init__(self, values=None):
+        self.values = dict(values or {"ev_rate": "50", "target_income": "2000"})
+        self.writes = []
+        self.fail = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def read_settings(self):
+        return dict(self.values)
+
+    def write_settings(self, settings):
+        self.gate.wait(5)
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("offline")
+        self.writes.append(dict(settings))
+        self.values = {k: str(v) for k, v in settings.items()}
+
+
+def test_update_coalesces_writes_to_latest_values():
+    backend = Backend()
+    store = storage.SettingsStore(backend)
+    backend.gate.clear()  # เขียนครั้งแรกค้างไว้ ระหว่างนั้นแก้อีกหลายครั้ง
+    assert store.update(ev_rate=60)
+    for rate in (70, 80, 90):
+        store.update(ev_rate=rate)
+    assert store.pending()
+    backend.gate.set()
+    assert store.flush(5)
+    assert len(backend.writes) <= 2 and backend.writes[-1]["ev_rate"] == 90
+    assert not store.pending() and store.last_error is None
+
+
+def test_update_without_change_does_not_write():
+    backend = Backend()
+    store = storage.SettingsStore(backend)
+    assert not store.update(ev_rate=50)
+    assert backend.writes == []
+
+
+def test_failed_write_is_reported_and_retried():
+    backend = Backend()
+    backend.fail = 1
+    store = storage.SettingsStore(backend)
+    store.update(target_income=3000)
+    store.flush(5)
+    assert isinstance(store.last_error, ConnectionError) and store.pending()
+    assert backend.writes == []
+    assert store.get()["target_income"] == 3000  # ค่าใน memory ยังเป็นค่าที่ผู้ใช้ตั้ง
+    store.flush(5)  # get() เริ่มบันทึกใหม่
+    assert store.last_error is None and not store.pending()
+    assert backend.values["target_income"] == "3000.0"
+
+
+def test_settings_reread_after_ttl():
+    backend = Backend()
+    store = storage.SettingsStore(backend, ttl=0)
+    assert store.get()["ev_rate"] == 50
+    backend.values["ev_rate"] = "75"  # เครื่องอื่นแก้
+    assert store.get()["ev_rate"] == 75
+    cached = storage.SettingsStore(backend, ttl=3600)
+    cached.get()
+    backend.values["ev_rate"] = "80"
+    assert cached.get()["ev_rate"] == 75
+
+
+def test_reread_does_not_clobber_unsaved_value():
+    backend = Backend()
+    store = storage.SettingsStore(backend, ttl=0)
+    store.get()
+    backend.gate.clear()
+    store.update(ev_rate=99)
+    backend.values["ev_rate"] = "10"
+    assert store.get()["ev_rate"] == 99
+    backend.gate.set()
+    store.flush(5)
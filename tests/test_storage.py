@@ -0,0 +1,227 @@
+import pandas as pd
+
+import ledger
+import storage
+import sync
+from fake_gsheets import FakeGSheetsConnection
+
+
+# --- read_since (delta refresh) ---
+def test_read_since_returns_only_new_rows(trip, sheet_with):
+    conn, store = sheet_with(5)
+    rows, mark = store.read_since(None)
+    assert len(rows) == 5 and mark[0] == 5 and mark[1] is not None
+    store.append([trip(10), trip(11)])
+    rows, mark = store.read_since(mark)
+    assert len(rows) == 2 and mark[0] == 7
+    rows, mark = store.read_since(mark)
+    assert len(rows) == 0 and mark[0] == 7
+
+
+def test_read_since_detects_delete_plus_append_by_other_device(trip, sheet_with):
+    conn, store = sheet_with(40)
+    rows, mark = store.read_since(None)
+    other = storage.GSheetsStorage(conn)
+    conn.client._select_worksheet(worksheet="Drivers").delete_rows(10)  # ลบแถวกลางชีต
+    other.append([trip(100, gross=555)])  # แล้วต่อท้าย 1 แถว: จำนวนแถวเท่าเดิม
+    assert store.read_since(mark) == (None, None)
+
+
+def test_remote_ledger_recovers_after_delete_plus_append(trip, sheet_with):
+    conn, store = sheet_with(40)
+    remote = sync.RemoteLedger(store, max_age=0)
+    assert len(remote.get(0)) == 40
+    ws = conn.client._select_worksheet(worksheet="Drivers")
+    deleted = ws.values[10][:]
+    ws.delete_rows(11)
+    storage.GSheetsStorage(conn).append([trip(100, gross=555)])
+    frame = remote.get(1)
+    assert len(frame) == 40
+    assert remote.last_fetch[0] == "full"
+    assert 55500 in frame['ยอดเต็ม/หน้าแอป'].tolist()
+    assert deleted[-1] not in ledger.to_sheet(frame)[storage.ROW_ID].tolist()
+    # รอบถัดไปกลับมาอ่านแบบ delta ได้ตามปกติ
+    storage.GSheetsStorage(conn).append([trip(101)])
+    assert len(remote.get(2)) == 41 and remote.last_fetch == ("delta", 1)
+
+
+def test_read_since_pads_trimmed_anchor_row(sheet_with):
+    # ชีตจริงตัดเซลล์ว่างท้ายแถว: anchor ที่เก็บแบบเติมครบต้องยังเทียบผ่าน
+    conn, store = sheet_with(3)
+    ws = conn.client._select_worksheet(worksheet="Drivers")
+    ws.values[-1][-1] = ""
+    _, mark = store.read_since(None)
+    ws.values[-1] = ws.values[-1][:-1]
+    rows, mark = store.read_since(mark)
+    assert rows is not None and len(rows) == 0
+
+
+# --- MirroredStorage: สำเนาที่ส่งไม่สำเร็จต้องค้างในคิวจนส่งได้ ---
+def test_mirror_keeps_offline_writes_queued(trip, tmp_path, monkeypatch):
+    conn = FakeGSheetsConnection()
+    mirror = storage.GSheetsStorage(conn)
+    queue = sync.SyncWorker(sync.Outbox(str(tmp_path / "mirror.db")), mirror)
+    monkeypatch.setattr(queue, "start", lambda: queue)  # ส่งเองด้วย sync_once
+    store = storage.MirroredStorage(storage.SQLiteStorage(str(tmp_path / "local.db")), mirror, queue)
+
+    def offline(rows):
+        raise ConnectionError("offline")
+    monkeypatch.setattr(mirror, "append", offline)
+    store.append([trip(1), trip(2)])
+    store.write_settings({"ev_rate": 150, "target_income": 1500})
+    assert queue.sync_once()
+    assert len(store.read()) == 2 and store.mirror_pending() == 2
+    assert isinstance(store.last_error, ConnectionError)
+
+    monkeypatch.undo()
+    while queue.sync_once():
+        pass
+    assert store.mirror_pending() == 0 and store.last_error is None
+    assert len(mirror.read()) == 2
+    assert int(mirror.read_settings()["ev_rate"]) == 150
+
+
+# --- GSheetsStorage.apply_edits: อ่านเฉพาะแถวเป้าหมาย ---
+def test_sheet_edit_reads_only_target_rows(sheet_with):
+    conn, store = sheet_with(50)
+    before = store.read()
+    old = before.iloc[[7]]
+    new = old.assign(**{'ยอดเต็ม/หน้าแอป': 999})
+    conn.calls.clear()
+    assert store.apply_edits([(old, new)]) == 1
+    reads = [c for c in conn.calls if c[0] in ("get_values", "batch_get", "read")]
+    assert reads == [("get_values", "Drivers", "N2:N"), ("batch_get", "Drivers", 1), ("batch_get", "Drivers", 1)]
+    after = store.read()
+    assert after.iloc[7]['ยอดเต็ม/หน้าแอป'] == 999 and len(after) == 50
+
+
+def test_sheet_edit_replans_when_rows_shift_before_write(sheet_with):
+    conn, store = sheet_with(20)
+    before = store.read()
+    ws = conn.client._select_worksheet(worksheet="Drivers")
+    target, victim = before.iloc[[10]], before.iloc[[12]]
+    original = ws.batch_get
+    seen = []
+
+    def racing(ranges):
+        seen.append(ranges)
+        if len(seen) == 2:
+            ws.delete_rows(3)  # เครื่องอื่นลบแถวด้านบนระหว่างวางแผนกับเขียน
+        return original(ranges)
+    ws.batch_get = racing
+    store.apply_edits([(target, target.assign(**{'ยอดเต็ม/หน้าแอป': 777})), (victim, None)])
+    after = store.read()
+    ids = after[storage.ROW_ID].tolist()
+    assert len(seen) == 4  # แผนแรกไม่ผ่านการตรวจ วางแผนใหม่อีกรอบ
+    assert len(after) == 18 and victim[storage.ROW_ID].iloc[0] not in ids
+    assert after[after[storage.ROW_ID] == target[storage.ROW_ID].iloc[0]]['ยอดเต็ม/หน้าแอป'].tolist() == [777]
+
+
+# --- แถวที่เครื่องอื่นแก้ต้องมาถึงสำเนาใน RemoteLedger ---
+def test_remote_ledger_picks_up_edits_from_other_device(trip, sheet_with):
+    conn, store = sheet_with(30)
+    remote = sync.RemoteLedger(store, max_age=0)
+    assert len(remote.get(0)) == 30
+    other = storage.GSheetsStorage(conn)
+    old = other.read().iloc[[4]]
+    other.apply_edits([(old, old.assign(**{'หมายเหตุ': 'แก้จากเครื่องอื่น'}))])
+    other.append([trip(200)])
+    frame = remote.get(1)
+    assert remote.last_fetch == ("delta", 2)
+    assert len(frame) == 31
+    edited = frame[frame[storage.ROW_ID] == ledger.parse_ids(old[storage.ROW_ID])[0]]
+    assert edited['หมายเหตุ'].tolist() == ['แก้จากเครื่องอื่น']
+
+
+def test_remote_ledger_rereads_when_legacy_row_edited(trip):
+    rows = [{**trip(i), storage.ROW_ID: ""} for i in range(10)]
+    conn = FakeGSheetsConnection({"Drivers": pd.DataFrame(rows, columns=storage.LEDGER_COLS)})
+    store = storage.GSheetsStorage(conn)
+    remote = sync.RemoteLedger(store, max_age=0)
+    remote.get(0)
+    old = store.read().iloc[[2]]
+    other = storage.GSheetsStorage(conn)
+    other.apply_edits(ledger.assign_ids([(storage.to_records(old)[0], {**storage.to_records(old)[0], 'หมายเหตุ': 'x'})]))
+    frame = remote.get(1)
+    assert remote.last_fetch[0] == "full" and len(frame) == 10
+    assert frame['หมายเหตุ'].tolist().count('x') == 1
+
+
+# --- SQLiteStorage rollup: ต้องไม่ใช้ rollup เก่าหลังแก้ไขที่จำนวนแถวเท่าเดิม ---
+def test_sqlite_rollup_goes_stale_after_same_size_edit(trip, tmp_path):
+    import analytics
+    store = storage.SQLiteStorage(str(tmp_path / "ledger.db"))
+    store.append([trip(1), trip(2)])
+    frame = ledger.from_sheet(store.read())
+    store.write_rollup(analytics.build_rollup(frame), len(frame))
+    assert store.read_rollup(len(frame)) is not None
+    old = store.read().iloc[[0]]
+    store.apply_edits([(old, old.assign(**{'ยอดเต็ม/หน้าแอป': 500}))])
+    assert store.read_rollup(len(frame)) is None
+
+
+def test_remote_ledger_retries_after_failed_refresh(trip, sheet_with, monkeypatch):
+    conn, store = sheet_with(5)
+    remote = sync.RemoteLedger(store, max_age=3600)
+    assert len(remote.get(0)) == 5
+    store.append([trip(10)])
+
+    def offline(mark=None):
+        raise ConnectionError("offline")
+    monkeypatch.setattr(store, "read_since", offline)
+    assert len(remote.get(1)) == 5  # ดึงไม่ได้: ใช้สำเนาเดิมไปก่อน
+    assert isinstance(remote.last_error, ConnectionError)
+    monkeypatch.undo()
+    assert len(remote.get(1)) == 6  # รุ่นเดิม แต่รอบก่อนล้ม: ต้องดึงใหม่ ไม่รอ max_age
+    assert remote.last_error is None
+
+
+# --- คนขับจาก ?driver= ---
+def test_allowed_driver_only_opens_known_ledgers(tmp_path):
+    config = {"backend": "local", "path": str(tmp_path / "driver_data.db"), "driver": "main"}
+    storage.open_storage(config, driver="A")
+    assert storage.allowed_driver(None, config) == "main"
+    assert storage.allowed_driver("main", config) == "main"
+    assert storage.allowed_driver("A", config) == "A"
+    assert storage.allowed_driver("a/../A", config) is None
+    assert storage.allowed_driver("B", config) is None  # ไม่สร้างไฟล์ใหม่ตาม URL
+    assert not (tmp_path / "driver_data_B.db").exists()
+    assert storage.allowed_driver("B", {**config, "drivers": ["B", "C"]}) == "B"
+    assert storage.allowed_driver("A", {**config, "drivers": ["B", "C"]}) is None
+
+
+def test_allowed_driver_lists_gsheets_worksheets():
+    conn = FakeGSheetsConnection({"Drivers": pd.DataFrame(columns=storage.LEDGER_COLS),
+                                  "Drivers_A": pd.DataFrame(columns=storage.LEDGER_COLS),
+                                  "Drivers_A.changes": pd.DataFrame(), "Drivers_2026-10": pd.DataFrame()})
+    config = {"backend": "gsheets"}
+    assert storage.allowed_driver("A", config, lambda: conn) == "A"
+    assert storage.allowed_driver("A.changes", config, lambda: conn) is None
+    assert storage.allowed_driver("2026-10", config, lambda: conn) is None
+
+
+# --- SharedConnection ---
+def test_shared_connection_reuses_worksheet_handles(trip):
+    fake = FakeGSheetsConnection({"Drivers": pd.DataFrame([trip(0)], columns=storage.LEDGER_COLS)})
+    conn = storage.SharedConnection(lambda: fake)
+    store = storage.GSheetsStorage(conn)
+    fake.calls.clear()
+    for i in range(3):
+        store.append([trip(i + 1)])
+    opens = [c for c in fake.calls if c[0] in ("open_spreadsheet", "worksheet")]
+    assert opens == [("open_spreadsheet",), ("worksheet", "Drivers")]
+    assert len(fake.sheets["Drivers"].values) == 5
+
+
+def test_shared_connection_looks_up_missing_sheets_again(trip):
+    fake = FakeGSheetsConnection({"Settings": pd.DataFrame(columns=["key", "value"])})
+    conn = storage.SharedConnection(lambda: fake)
+    store = storage.GSheetsStorage(conn, worksheet="Drivers_A")
+    assert store.read_since(None)[0].empty  # ยังไม่มีชีต
+    store.append([trip(0)])  # สร้างชีต
+    rows, _ = store.read_since(None)
+    assert len(rows) == 1
+    conn._reconnect()
+    fake.calls.clear()
+    conn.select_worksheet("Drivers_A")
+    assert fake.calls == [("open_spreadsheet",), ("worksheet", "Drivers_A")]  # reconnect ล้าง handle เดิม
@@ -0,0 +1,53 @@
+import pytest
+
+import ledger
+import storage
+import sync
+from fake_gsheets import FakeGSheetsConnection
+
+
+@pytest.fixture(params=["local", "gsheets"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        return storage.SQLiteStorage(str(tmp_path / "ledger.db"))
+    return storage.GSheetsStorage(FakeGSheetsConnection())
+
+
+# --- ส่งซ้ำ (at-least-once) ---
+def test_redelivered_append_is_not_duplicated(trip, backend, tmp_path, monkeypatch):
+    worker = sync.SyncWorker(sync.Outbox(str(tmp_path / "outbox.db")), backend)
+    worker.submit(sync.APPEND, [trip(1), trip(2)])
+    # ส่งสำเร็จแต่ลบออกจาก outbox ไม่ทัน (แอปปิด/ล้มกลางทาง)
+    monkeypatch.setattr(worker.outbox, "remove", lambda ids: None)
+    worker.sync_once()
+    monkeypatch.undo()
+    worker.submit(sync.APPEND, [trip(3)])
+    while worker.sync_once():
+        pass
+    assert worker.pending() == 0
+    assert len(backend.read()) == 3
+
+
+def test_redelivered_edit_insert_is_not_duplicated(trip, backend):
+    backend.append([trip(1)])
+    pairs = ledger.assign_ids([(None, trip(5))])
+    backend.apply_edits(pairs)
+    backend.apply_edits(pairs)
+    assert len(backend.read()) == 2
+
+
+def test_replay_skips_rows_already_in_frame(trip):
+    rows = [trip(1), trip(2)]
+    frame = ledger.from_records(rows)
+    pending = [(1, sync.APPEND, storage.to_records(rows + [trip(3)]), None)]
+    out = sync.replay(frame, pending)
+    assert len(out) == 3 and out[storage.ROW_ID].is_unique
+
+
+def test_outbox_marks_attempts(trip, tmp_path):
+    outbox = sync.Outbox(str(tmp_path / "outbox.db"))
+    first = outbox.put(sync.APPEND, [trip(1)])
+    second = outbox.put(sync.APPEND, [trip(2)])
+    assert not outbox.attempted([first, second])
+    outbox.mark_attempt([first])
+    assert outbox.attempted([first, second]) and not outbox.attempted([second])